@@ -1,28 +1,171 @@
-import tkinter as tk
-from tkinter import messagebox
 import pyvisa
 import time
 import argparse
 import struct
 import numpy as np
 import os
-import csv
+import json
+import re
+from collections import namedtuple
 from datetime import datetime
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 
 import sys
 import subprocess
+import threading
+import queue
+import heapq
+import tempfile
+import signal
+import importlib.util
+import sqlite3
+
+# tkinter is only imported when the GUI starts (see load_gui_modules), pandas only when a cycle is saved
+# or loaded and plotly only when a plot is drawn, so the GUI opens and the first segment is measured
+# without waiting for them, and the headless mode (--headless) runs without tkinter and plotly at all
+tk = messagebox = ttk = None
 
 # Define constants for better readability and easier modification
 MHZ_TO_HZ = 1_000_000 # Conversion factor from MHz to Hz
 
 # Updated wait time variable and its usage for the continuous loop
 DEFAULT_RBW_STEP_SIZE_HZ = 10000 # 10 kHz RBW resolution desired per data point
+CSV_FREQUENCY_RESOLUTION_HZ = 10000 # CSV rows hold frequencies to 0.01 MHz ("%.2f"), so finer steps would give duplicate frequencies
 DEFAULT_CYCLE_WAIT_TIME_SECONDS = 30 # 5 minutes wait (300 seconds) between full scan cycles
 DEFAULT_MAXHOLD_TIME_SECONDS = 5 # Default max hold time for the new argument
 
+# Number of points the N9340B returns per sweep (10 divisions * 40 points/div + 1)
+TRACE_SWEEP_POINTS = 401
+
+# Data acquisition modes for scan_bands:
+#   "Marker"   - steps the five markers across each segment and queries their amplitudes (original method)
+#   "Trace"    - sets each segment once and pulls the whole trace in a single binary :TRAC1:DATA? transfer
+#   "Adaptive" - a fast coarse trace pass over wide segments, then fine-resolution traces only where
+#                a signal rises above the noise floor (empty stretches keep the coarse points)
+ACQUISITION_MODES = ["Marker", "Trace", "Adaptive"]
+DEFAULT_ACQUISITION_MODE = "Marker"
+
+# "Adaptive" mode settings
+ADAPTIVE_COARSE_STEP_FACTOR = 10 # Coarse pass point spacing, as a multiple of the RBW step size.
+                                 # The coarse pass also uses a wider RBW/VBW (the widest in SUPPORTED_RBW_HZ at or below
+                                 # its point spacing), so it sweeps each Hz up to ADAPTIVE_COARSE_STEP_FACTOR squared times faster.
+# The RBW settings the N9340B accepts (1-3-10 sequence); other values are rejected or rounded by the instrument
+SUPPORTED_RBW_HZ = [10, 30, 100, 300, 1e3, 3e3, 10e3, 30e3, 100e3, 300e3, 1e6]
+DEFAULT_ADAPTIVE_THRESHOLD_DB = 10.0 # A coarse point this far above the noise floor marks a signal region
+ADAPTIVE_GUARD_POINTS = 1 # Coarse points added either side of a detection, so carrier skirts are scanned in full
+
+# Instrument settings used when none are given (the values the scan loop always applied before)
+DEFAULT_INSTRUMENT_SETTINGS = {
+    "clear_reset": True, # *CLS; *RST at the start of every cycle
+    "preamplifier_on": True,
+    "display_log": True,
+    "ref_level": -30, # dBm
+    "max_hold_on": True,
+}
+
+# Extra time (milliseconds) allowed beyond twice the reported sweep time before a sweep is considered timed out
+SWEEP_TIMEOUT_MARGIN_MS = 5000
+
+# Streaming CSV writer: how often (seconds) the file is fsync'ed and the resume checkpoint updated
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5
+CHECKPOINT_FILE_SUFFIX = ".checkpoint.json"
+# An interrupted cycle is only resumed while its checkpoint is younger than this many cycle times (scan + wait),
+# and at least CHECKPOINT_MIN_MAX_AGE_SECONDS; an older one belongs to an old cycle and a new cycle is started
+CHECKPOINT_MAX_AGE_CYCLES = 3
+CHECKPOINT_MIN_MAX_AGE_SECONDS = 600
+
+# Output files written for each cycle. "CSV + NPZ" also saves a binary NumPy .npz file with
+# frequency, level, band and timestamp columns plus the scan settings (see save_scan_npz).
+OUTPUT_FORMATS = ["CSV", "CSV + NPZ"]
+DEFAULT_OUTPUT_FORMAT = "CSV"
+
+# Running statistics of a scan series per frequency bin (see ScanStatistics), kept in <series>_statistics.npz.
+# The optional level histograms (for percentiles) cover STATISTICS_HISTOGRAM_BINS steps from STATISTICS_HISTOGRAM_MIN_DBM.
+STATISTICS_FILE_SUFFIX = "_statistics.npz"
+STATISTICS_HISTOGRAM_MIN_DBM = -150
+STATISTICS_HISTOGRAM_STEP_DB = 1
+STATISTICS_HISTOGRAM_BINS = 180 # Up to +30 dBm
+STATISTICS_PERCENTILES = (10, 50, 90) # Percentile columns of ScanStatistics.to_dataframe
+
+# Spectrum store of every cycle of every series, for time/frequency window queries (see SpectrumStore),
+# in this file of the "N9340 Scans" folder. Each cycle is stored in blocks of STORE_CHUNK_BINS frequency bins.
+STORE_FILENAME = "spectrum_store.sqlite"
+STORE_CHUNK_BINS = 1024
+# Cycles older than this are deleted from the store when a newer cycle of the series is added (0 keeps every cycle).
+# The store holds about 2.2 GB per week of 5-minute cycles of 130k points, so it stops growing at ~10 GB with 30 days.
+STORE_RETENTION_DAYS = 30
+STORE_QUERY_MAX_CELLS = 100_000_000 # Most cycles x frequency bins SpectrumStore.query returns (400 MB of float32); use waterfall for larger windows
+
+# Waterfall of a series' history from the spectrum store (see SpectrumStore.waterfall and plot_waterfall):
+# the most rows (time) and columns (frequency) of the image, and the stored blocks binned at once
+WATERFALL_TIME_ROWS = 600
+WATERFALL_FREQUENCY_BINS = 1600
+WATERFALL_BATCH_ROWS = 2048
+WATERFALL_COLOR_PERCENTILES = (1, 99.5) # Level percentiles at the ends of the color scale
+WATERFALL_FILE_SUFFIX = "_waterfall.html"
+
+# How often (milliseconds) the GUI checks the scan thread's progress queue (and redraws the live spectrum)
+SCAN_EVENT_POLL_MS = 200
+
+# Live spectrum window shown while scanning (see LiveSpectrumView)
+LIVE_VIEW_GEOMETRY = "900x320"
+LIVE_VIEW_MARGINS = (45, 18, 10, 20) # Left, top, right, bottom space (pixels) around the plot for the axis labels
+LIVE_VIEW_FREQUENCY_TICKS = 8
+
+# Most points plot_spectrum_data draws in the HTML plot. Larger scans are reduced to the min and max
+# point of each of (DEFAULT_PLOT_POINT_BUDGET / 2) buckets along the frequency axis per band,
+# so the file size and browser load time follow the screen width instead of the scan size (0 draws every point).
+DEFAULT_PLOT_POINT_BUDGET = 8000
+
+# Number of markers measured together in one set/query exchange in "Marker" mode
+MARKERS_PER_BATCH = 5
+
+# Longest ';'-joined SCPI message (in characters) the command pipeline sends at once, by model in the *IDN? response.
+# A full marker batch (MARKERS_PER_BATCH set and query commands plus the error check) fits in one message.
+SCPI_MAX_MESSAGE_LENGTH_BY_MODEL = {
+    "N9340B": 512,
+}
+DEFAULT_SCPI_MAX_MESSAGE_LENGTH = 256 # Unknown models
+SCPI_MAX_ERRORS_PER_MESSAGE = 20 # Stop draining the error queue after this many errors for one message
+
+# Multi-instrument scanning: every VISA resource whose *IDN? response contains this model name takes part,
+# each scanning its own share of the selected bands in its own thread (see run_multi_instrument_scan_logic)
+INSTRUMENT_MODEL_PATTERN = "N9340"
+MULTI_INSTRUMENT_PART_SUFFIX = ".part{}.csv" # Per-instrument CSV file of a cycle, merged when all parts are done
+MULTI_INSTRUMENT_MAX_FAILED_CYCLES = 3 # Cycles in a row an analyzer may fail before it is dropped and its bands go to the others
+
+# Acquisition benchmark (see run_acquisition_benchmark): results go to this subfolder of "N9340 Scans"
+BENCHMARK_SUBFOLDER = "Benchmarks"
+BENCHMARK_LATENCY_PERCENTILES = (50, 90, 99) # Latency percentiles reported for every SCPI mnemonic
+
+# Startup benchmark (see run_startup_benchmark): each run starts fresh interpreters that report
+# the time from launch to the end of the imports, to the open GUI and to the first measured segment
+STARTUP_BENCHMARK_RUNS = 5
+STARTUP_PROBES = ["gui", "scan"]
+STARTUP_LAUNCH_TIME_VARIABLE = "SCAN_STARTUP_LAUNCH_TIME" # Environment variable with the launch time (time.time()) of a probe
+STARTUP_PROBE_RESULT_PREFIX = "STARTUP_PROBE_RESULT " # Marks the probe's JSON result line in its output
+STARTUP_TRACKED_MODULES = ["pyvisa", "numpy", "pandas", "plotly", "tkinter"] # Reported as loaded or not at each milestone
+
+# Optional VISA instrumentation (see VisaMetrics): latency histogram bucket limits (milliseconds),
+# how often a summary is printed (and shown in the GUI) and how many message types it lists
+VISA_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+VISA_METRICS_SUMMARY_INTERVAL_SECONDS = 60
+VISA_METRICS_SUMMARY_TOP_COUNT = 5
+VISA_METRICS_FILE_SUFFIX = "_visa_metrics.json" # Cumulative statistics of a scan series, in its folder
+VISA_TIMELINE_FILE_SUFFIX = ".trace.json" # Chrome trace timeline of one cycle, next to its CSV file
+
+# Rough per-operation costs used by the scan planner (see plan_scan) to predict a cycle's duration,
+# and to balance the bands across instruments by estimated scan time.
+ESTIMATED_ROUND_TRIP_SECONDS = 0.03 # One command/response exchange with the instrument
+ESTIMATED_SWEEP_SECONDS = 0.1 # One segment sweep, when the RBW setting can't be read as a number (e.g. "AUTO")
+ESTIMATED_TRACE_TRANSFER_SECONDS = 0.05 # One binary :TRAC1:DATA? transfer
+ESTIMATED_SWEEP_TIME_FACTOR = 2.5 # A swept analyzer takes about this * span / RBW^2 seconds per sweep...
+ESTIMATED_MIN_SWEEP_SECONDS = 0.01 # ...but never less than this
+ESTIMATED_MESSAGE_BYTES = 80 # One command message (with its ';:SYST:ERR?' check) and the reply
+ESTIMATED_MARKER_BYTES = 60 # One marker's set and query commands and its amplitude in the reply
+ESTIMATED_TRACE_BYTES = TRACE_SWEEP_POINTS * 4 + 8 # One float32 trace with its block header and terminator
+ESTIMATED_ADAPTIVE_SIGNAL_FRACTION = 0.1 # Share of each band "Adaptive" mode is assumed to fine-scan
+ESTIMATED_CYCLE_SETUP_ROUND_TRIPS = 3 # *CLS/*RST and the settings at the start of a cycle, the reset at its end
+
 # Define the frequency bands to *SCAN* (User's specified bands for instrument operation)
 # This list will be used by the scan_bands function.
 SCAN_BAND_RANGES = [
@@ -250,6 +393,531 @@ for band_info in gov_frequency_bands_full_list:
     })
 
 
+class BandIntervalIndex:
+    """
+    Sorted, non-overlapping frequency intervals ([Start MHz, Stop MHz, Name] lists such as
+    gov_frequency_bands_full_list) with vectorized lookups:
+    lookup() finds the interval of every frequency in one np.searchsorted pass, and
+    overlapping() finds the intervals that overlap a frequency range without scanning the list.
+    Intervals are half-open, [start, stop): a frequency on a shared edge belongs to the upper interval.
+    """
+
+    def __init__(self, band_list):
+        """
+        Args:
+            band_list (list): [start_mhz, stop_mhz, name] entries, in any order.
+        Raises:
+            ValueError: If two intervals overlap.
+        """
+        sorted_bands = sorted(band_list, key=lambda band_info: (band_info[0], band_info[1]))
+        self.starts_mhz = np.array([band_info[0] for band_info in sorted_bands], dtype=np.float64)
+        self.stops_mhz = np.array([band_info[1] for band_info in sorted_bands], dtype=np.float64)
+        self.names = [band_info[2].strip() for band_info in sorted_bands]
+        # Several intervals can share a name (e.g. 'BROADCASTING'), so names are also kept as codes into unique categories
+        self.category_names, self.name_codes = np.unique(self.names, return_inverse=True)
+        overlaps = np.flatnonzero(self.starts_mhz[1:] < self.stops_mhz[:-1])
+        if overlaps.size:
+            first_overlap = overlaps[0]
+            raise ValueError(f"Band intervals overlap: '{self.names[first_overlap]}' and '{self.names[first_overlap + 1]}'")
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, frequencies_mhz):
+        """
+        Finds the interval each frequency falls in.
+        Args:
+            frequencies_mhz (numpy.ndarray): Frequencies in MHz (any order).
+        Returns:
+            numpy.ndarray: Interval index for every frequency (int64), -1 where no interval contains it.
+        """
+        frequencies_mhz = np.asarray(frequencies_mhz, dtype=np.float64)
+        interval_indices = np.searchsorted(self.starts_mhz, frequencies_mhz, side='right') - 1
+        inside = (interval_indices >= 0) & (frequencies_mhz < self.stops_mhz[np.maximum(interval_indices, 0)])
+        return np.where(inside, interval_indices, -1)
+
+    def categorical(self, frequencies_mhz):
+        """
+        Tags every frequency with the name of its interval.
+        Args:
+            frequencies_mhz (numpy.ndarray): Frequencies in MHz.
+        Returns:
+            pandas.Categorical: The interval name per frequency (NaN outside every interval).
+        """
+        import pandas as pd
+
+        interval_indices = self.lookup(frequencies_mhz)
+        name_codes = np.where(interval_indices >= 0, self.name_codes[np.maximum(interval_indices, 0)], -1)
+        return pd.Categorical.from_codes(name_codes, categories=self.category_names)
+
+    def overlapping(self, range_start_mhz, range_stop_mhz):
+        """
+        Finds the intervals overlapping a frequency range.
+        Args:
+            range_start_mhz (float): Start of the range in MHz.
+            range_stop_mhz (float): Stop of the range in MHz.
+        Returns:
+            range: Indices of the overlapping intervals (consecutive, as the intervals are sorted and disjoint).
+        """
+        first_index = int(np.searchsorted(self.stops_mhz, range_start_mhz, side='right'))
+        stop_index = int(np.searchsorted(self.starts_mhz, range_stop_mhz, side='left'))
+        return range(first_index, max(first_index, stop_index))
+
+    def band(self, interval_index):
+        """
+        Returns an interval as a marker dictionary.
+        Args:
+            interval_index (int): Index from lookup() or overlapping().
+        Returns:
+            dict: {"Start MHz", "Stop MHz", "Band Name"}, like the *_PLOT_BAND_MARKERS entries.
+        """
+        return {
+            "Start MHz": self.starts_mhz[interval_index],
+            "Stop MHz": self.stops_mhz[interval_index],
+            "Band Name": self.names[interval_index],
+        }
+
+
+# Interval indexes over the allocation and TV channel tables, for tagging scan points and placing plot markers
+GOV_BAND_INDEX = BandIntervalIndex(gov_frequency_bands_full_list)
+TV_CHANNEL_INDEX = BandIntervalIndex(frequency_TV_Channel_bands_full_list)
+
+
+def tag_band_allocations(df):
+    """
+    Adds 'Allocation' and 'TV Channel' columns naming the allocation and TV channel of every point,
+    from one vectorized lookup per index (no per-point loop over the band lists).
+    Args:
+        df (pd.DataFrame): Scan data with a 'Frequency (MHz)' column.
+    Returns:
+        pd.DataFrame: A copy of df with the two categorical columns added.
+    """
+    frequencies_mhz = df['Frequency (MHz)'].to_numpy(dtype=np.float64)
+    return df.assign(**{
+        'Allocation': GOV_BAND_INDEX.categorical(frequencies_mhz),
+        'TV Channel': TV_CHANNEL_INDEX.categorical(frequencies_mhz),
+    })
+
+
+
+
+# --- Simulated N9340B Instrument (offline scans and benchmarking) ---
+# Selecting this address (or the "Use Simulated Instrument" option in the GUI) runs the
+# scanner against SimulatedN9340B instead of a real analyzer found by pyvisa.
+SIMULATED_INSTRUMENT_ADDRESS = "SIM::N9340B::INSTR"
+SIMULATED_INSTRUMENT_COUNT = 2 # Simulated analyzers offered in multi-instrument mode (SIM::N9340B::2::INSTR, ...)
+
+# Carriers synthesized by the simulated instrument: [Center MHz, Level dBm, Occupied Bandwidth kHz]
+SIMULATED_CARRIERS = [
+    [88.5, -45.0, 200],      # FM broadcast
+    [98.1, -40.0, 200],      # FM broadcast
+    [189.0, -60.0, 5600],    # TV-CH9 (ATSC)
+    [473.0, -62.0, 5600],    # TV-CH14 (ATSC)
+    [615.0, -55.0, 200],     # Wireless mic in the 600 MHz duplex gap
+    [915.0, -70.0, 500],     # 900 ISM
+    [1450.0, -72.0, 1000],   # AFTRCC telemetry
+    [1905.0, -65.0, 1700],   # DECT
+    [2200.0, -75.0, 10000],  # 2 GHz camera link
+]
+SIMULATED_NOISE_FLOOR_DBM = -95.0 # Noise floor with the preamplifier ON
+SIMULATED_NOISE_STD_DB = 1.5 # Standard deviation of the noise around the floor
+SIMULATED_PREAMP_OFF_PENALTY_DB = 15.0 # Noise floor rises by this much with the preamplifier OFF
+
+# Modelled latency (seconds) of each kind of VISA transaction on the simulated instrument
+SIMULATED_COMMAND_LATENCY_SECONDS = {
+    "write": 0.002, # Any command message sent to the instrument
+    "query": 0.004, # Extra turnaround for a message that expects a response
+    "trace": 0.015, # Extra time to transfer a full binary trace
+}
+
+
+def parse_scpi_number(value_str):
+    """
+    Parses a SCPI numeric argument with an optional unit suffix into base units.
+    Args:
+        value_str (str): The argument, e.g. "50000000.0", "1000HZ", "1KHZ", "2.4GHZ", "-30DBM".
+    Returns:
+        float: The value in Hz (for frequencies) or in the unit given (e.g. dBm).
+    Raises:
+        ValueError: If the argument is not a number.
+    """
+    value_str = value_str.strip().upper()
+    multipliers = {"GHZ": 1e9, "MHZ": 1e6, "KHZ": 1e3, "HZ": 1.0, "DBM": 1.0, "S": 1.0, "MS": 1e-3}
+    for suffix in sorted(multipliers, key=len, reverse=True):
+        if value_str.endswith(suffix):
+            return float(value_str[:-len(suffix)]) * multipliers[suffix]
+    return float(value_str)
+
+
+class SimulatedN9340B:
+    """
+    A software stand-in for a pyvisa N9340B resource.
+    It understands the SCPI commands this scanner sends (frequency, marker, trace,
+    display and status commands, joined with ';' or sent one at a time), synthesizes
+    a spectrum from configurable carriers over a noisy floor, and sleeps for a
+    modelled per-command latency and sweep time so acquisition strategies can be
+    benchmarked deterministically without the analyzer.
+    """
+
+    def __init__(self, carriers=None, noise_floor_dbm=SIMULATED_NOISE_FLOOR_DBM, noise_std_db=SIMULATED_NOISE_STD_DB,
+                 command_latency=None, time_scale=1.0, seed=0, resource_name=SIMULATED_INSTRUMENT_ADDRESS):
+        """
+        Args:
+            carriers (list): [Center MHz, Level dBm, Bandwidth kHz] entries. Defaults to SIMULATED_CARRIERS.
+            noise_floor_dbm (float): Noise floor level in dBm with the preamplifier ON.
+            noise_std_db (float): Standard deviation of the noise in dB.
+            command_latency (dict): Per-transaction latency in seconds ("write", "query", "trace").
+            time_scale (float): Multiplier for every modelled delay (0 disables sleeping entirely).
+            seed (int): Seed for the noise generator so runs are reproducible.
+            resource_name (str): The simulated VISA address (see simulated_instrument_addresses).
+        """
+        self.resource_name = resource_name
+        self.carriers = np.array(carriers if carriers is not None else SIMULATED_CARRIERS, dtype=np.float64).reshape(-1, 3)
+        self.noise_floor_dbm = noise_floor_dbm
+        self.noise_std_db = noise_std_db
+        self.command_latency = dict(SIMULATED_COMMAND_LATENCY_SECONDS if command_latency is None else command_latency)
+        self.time_scale = time_scale
+        self.seed = seed
+
+        # pyvisa resource attributes the scanner reads or sets
+        self.timeout = 2000 # Milliseconds, like pyvisa
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.encoding = 'ascii'
+        self.session = 1 # Truthy while the "connection" is open
+
+        self.error_queue = []
+        self._output_buffer = b''
+        self._rng = np.random.default_rng(seed)
+        self.reset_state()
+
+    # --- Instrument state ---
+
+    def reset_state(self):
+        """Restores the power-on state, as *RST does on the real instrument."""
+        self.center_hz = 1.5e9
+        self.span_hz = 3.0e9
+        self.rbw_hz = None # None means auto-coupled to the span
+        self.vbw_hz = None
+        self.preamp_on = False
+        self.display_log = True
+        self.ref_level_dbm = 0.0
+        self.continuous_sweep = True
+        self.trace_format = "ASC"
+        self.trace_modes = {1: "WRIT", 2: "BLAN", 3: "BLAN", 4: "BLAN"}
+        self.marker_freqs_hz = {}
+        self.marker_states = {}
+        self._trace = None
+        self._sweep_done_time = time.monotonic()
+
+    @property
+    def start_hz(self):
+        return self.center_hz - self.span_hz / 2
+
+    @property
+    def stop_hz(self):
+        return self.center_hz + self.span_hz / 2
+
+    def sweep_time_seconds(self):
+        """Models the sweep time of the current span and RBW (swept analyzer: ~2.5 * span / RBW^2)."""
+        rbw_hz = self.rbw_hz if self.rbw_hz else max(10.0, self.span_hz / 100)
+        return max(0.01, 2.5 * self.span_hz / (rbw_hz ** 2))
+
+    def _sleep(self, seconds):
+        if self.time_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _start_sweep(self):
+        """Starts a new sweep; the trace is ready once the modelled sweep time has elapsed."""
+        self._sweep_done_time = time.monotonic() + self.sweep_time_seconds() * self.time_scale
+        new_trace = self.synthesize_levels(np.linspace(self.start_hz, self.stop_hz, TRACE_SWEEP_POINTS))
+        if self.trace_modes.get(1) == "MAXH" and self._trace is not None:
+            new_trace = np.maximum(self._trace, new_trace)
+        self._trace = new_trace
+
+    def _frequency_changed(self):
+        # A new span clears any max hold accumulation, exactly like the real analyzer.
+        # In single-sweep mode (":INIT:CONT OFF") nothing is swept until ":INIT:IMM".
+        self._trace = None
+        if self.continuous_sweep:
+            self._start_sweep()
+
+    def _wait_for_sweep(self):
+        remaining = self._sweep_done_time - time.monotonic()
+        if remaining > 0:
+            if remaining * 1000 > self.timeout:
+                # Like read_raw: a real timeout takes the full VISA timeout, but time_scale=0 never sleeps
+                time.sleep(self.timeout / 1000 if self.time_scale > 0 else 0)
+                raise pyvisa.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+            time.sleep(remaining)
+
+    def synthesize_levels(self, freqs_hz):
+        """
+        Synthesizes the level seen at each frequency: carriers summed in linear power over the noise floor.
+        Args:
+            freqs_hz (numpy.ndarray): Frequencies in Hz.
+        Returns:
+            numpy.ndarray: Levels in dBm (float32).
+        """
+        freqs_mhz = np.asarray(freqs_hz, dtype=np.float64) / MHZ_TO_HZ
+        floor_dbm = self.noise_floor_dbm + (0.0 if self.preamp_on else SIMULATED_PREAMP_OFF_PENALTY_DB)
+        power_mw = np.full(freqs_mhz.shape, 10 ** (floor_dbm / 10))
+        for center_mhz, level_dbm, bandwidth_khz in self.carriers:
+            half_width_mhz = max(bandwidth_khz / 2000, 1e-6)
+            # Flat-topped carrier shape with steep skirts
+            power_mw += 10 ** (level_dbm / 10) * np.exp(-(np.abs(freqs_mhz - center_mhz) / half_width_mhz) ** 6)
+        levels_dbm = 10 * np.log10(power_mw) + self._rng.normal(0.0, self.noise_std_db, freqs_mhz.shape)
+        return levels_dbm.astype(np.float32)
+
+    def _current_trace(self):
+        if self._trace is None:
+            self._start_sweep()
+        return self._trace
+
+    # --- SCPI command handling ---
+
+    @staticmethod
+    def _normalize_header(header):
+        """Reduces a SCPI header to its short form, e.g. ":SENSe:FREQuency:STARt" -> "FREQ:STAR"."""
+        nodes = []
+        for node in header.strip().lstrip(':').split(':'):
+            if node.startswith('*'):
+                nodes.append(node.upper())
+            else:
+                short_node = ''.join(ch for ch in node if ch.isupper() or ch.isdigit() or ch == '?')
+                nodes.append(short_node or node.upper())
+        if nodes and nodes[0] in ("SENS", "SENSE"): # The SENSe node is optional
+            nodes = nodes[1:]
+        return ':'.join(nodes)
+
+    def _execute(self, command):
+        """Executes one SCPI command. Returns the response string for queries, otherwise None."""
+        command = command.strip()
+        if not command:
+            return None
+        header, _, argument = command.partition(' ')
+        header = self._normalize_header(header)
+        argument = argument.strip()
+        is_query = header.endswith('?')
+
+        try:
+            if header == "*IDN?":
+                return "Agilent Technologies,N9340B,SIM00001,A.01.00"
+            if header == "*OPC?":
+                self._wait_for_sweep()
+                return "1"
+            if header == "*CLS":
+                self.error_queue.clear()
+                return None
+            if header == "*RST":
+                self.reset_state()
+                return None
+            if header == "*STB?":
+                return "0"
+            if header == "SYST:ERR?":
+                if self.error_queue:
+                    code, message = self.error_queue.pop(0)
+                    return f'{code:+d},"{message}"'
+                return '+0,"No error"'
+            if header == "SYST:POW:RES":
+                self.reset_state()
+                return None
+
+            # Frequency settings
+            if header in ("FREQ:STAR", "FREQ:STOP", "FREQ:CENT", "FREQ:SPAN"):
+                value_hz = parse_scpi_number(argument)
+                start_hz, stop_hz = self.start_hz, self.stop_hz
+                if header == "FREQ:STAR":
+                    start_hz = value_hz
+                    stop_hz = max(stop_hz, start_hz)
+                elif header == "FREQ:STOP":
+                    stop_hz = value_hz
+                    start_hz = min(start_hz, stop_hz)
+                elif header == "FREQ:CENT":
+                    self.center_hz = value_hz
+                    self._frequency_changed()
+                    return None
+                else:
+                    self.span_hz = max(0.0, value_hz)
+                    self._frequency_changed()
+                    return None
+                self.center_hz = (start_hz + stop_hz) / 2
+                self.span_hz = stop_hz - start_hz
+                self._frequency_changed()
+                return None
+            if header in ("FREQ:STAR?", "FREQ:STOP?", "FREQ:CENT?", "FREQ:SPAN?"):
+                values = {"FREQ:STAR?": self.start_hz, "FREQ:STOP?": self.stop_hz, "FREQ:CENT?": self.center_hz, "FREQ:SPAN?": self.span_hz}
+                return f"{values[header]:.6E}"
+
+            # Bandwidth, sweep and amplitude settings
+            if header in ("BAND:RES", "BWID:RES", "BAND", "BWID"):
+                self.rbw_hz = parse_scpi_number(argument)
+                return None
+            if header in ("BAND:VID", "BWID:VID"):
+                self.vbw_hz = parse_scpi_number(argument)
+                return None
+            if header == "SWE:TIME?":
+                return f"{self.sweep_time_seconds():.6E}"
+            if header == "SWE:POIN?":
+                return str(TRACE_SWEEP_POINTS)
+            if header == "POW:GAIN":
+                self.preamp_on = argument.upper() in ("ON", "1")
+                return None
+            if header == "DISP:WIND:TRAC:Y:SCAL":
+                self.display_log = argument.upper().startswith("LOG")
+                return None
+            if header == "DISP:WIND:TRAC:Y:SCAL:RLEV":
+                self.ref_level_dbm = parse_scpi_number(argument)
+                return None
+            if header == "INIT:CONT":
+                self.continuous_sweep = argument.upper() in ("ON", "1")
+                return None
+            if header in ("INIT:IMM", "INIT"):
+                self._start_sweep()
+                return None
+
+            # Trace commands
+            if header.startswith("TRAC") and header.endswith(":MODE"):
+                trace_num = int(header[4:-5] or 1)
+                self.trace_modes[trace_num] = ''.join(ch for ch in argument if ch.isupper())[:4] or argument.upper()[:4]
+                if trace_num == 1 and self.trace_modes[1] == "WRIT":
+                    self._trace = None
+                return None
+            if header in ("TRAC:FORM", "FORM"):
+                self.trace_format = "REAL" if argument.upper().startswith("REAL") else "ASC"
+                return None
+            if header in ("TRAC1:DATA?", "TRAC:DATA?"):
+                self._wait_for_sweep()
+                self._sleep(self.command_latency.get("trace", 0.0))
+                trace = self._current_trace()
+                if self.trace_format == "REAL":
+                    return trace.astype('<f4').tobytes()
+                return ','.join(f"{level:.2f}" for level in trace)
+
+            # Marker commands
+            if header.startswith("CALC:MARK"):
+                marker_part, _, marker_command = header[len("CALC:MARK"):].partition(':')
+                marker_num = int(marker_part or 1)
+                if marker_command == "X":
+                    self.marker_freqs_hz[marker_num] = parse_scpi_number(argument)
+                    return None
+                if marker_command == "X?":
+                    return f"{self.marker_freqs_hz.get(marker_num, self.center_hz):.6E}"
+                if marker_command == "Y?":
+                    # Markers read the trace point nearest to their frequency
+                    marker_freq_hz = self.marker_freqs_hz.get(marker_num, self.center_hz)
+                    trace = self._current_trace()
+                    if self.span_hz > 0:
+                        point = int(round((marker_freq_hz - self.start_hz) / self.span_hz * (TRACE_SWEEP_POINTS - 1)))
+                    else:
+                        point = 0
+                    point = min(max(point, 0), TRACE_SWEEP_POINTS - 1)
+                    return f"{float(trace[point]):.3f}"
+                if marker_command in ("STAT", "MODE", "BWID:RES"):
+                    self.marker_states[(marker_num, marker_command)] = argument
+                    return None
+        except ValueError:
+            self.error_queue.append((-224, f"Illegal parameter value; {command}"))
+            return None
+
+        self.error_queue.append((-113, f"Undefined header; {command}"))
+        return "" if is_query else None
+
+    # --- pyvisa Resource interface ---
+
+    def write(self, message):
+        if not self.session:
+            raise pyvisa.VisaIOError(pyvisa.constants.StatusCode.error_connection_lost)
+        self._sleep(self.command_latency.get("write", 0.0))
+        responses = [self._execute(command) for command in message.split(';')]
+        responses = [response for response in responses if response is not None]
+        if responses:
+            self._sleep(self.command_latency.get("query", 0.0))
+            if len(responses) == 1 and isinstance(responses[0], bytes):
+                self._output_buffer = responses[0]
+            else:
+                self._output_buffer = ';'.join(str(response) for response in responses).encode(self.encoding) + b'\n'
+        return len(message)
+
+    def read_raw(self):
+        if not self._output_buffer:
+            time.sleep(self.timeout / 1000 if self.time_scale > 0 else 0)
+            raise pyvisa.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        data, self._output_buffer = self._output_buffer, b''
+        return data
+
+    def read(self):
+        return self.read_raw().decode(self.encoding, errors='replace').rstrip('\r\n')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def clear(self):
+        self._output_buffer = b''
+
+    def close(self):
+        self.session = None
+
+
+def simulated_instrument_addresses(count):
+    """
+    Returns the addresses of count simulated instruments, SIMULATED_INSTRUMENT_ADDRESS first.
+    """
+    return [SIMULATED_INSTRUMENT_ADDRESS] + [f"SIM::N9340B::{number}::INSTR" for number in range(2, count + 1)]
+
+
+def open_instrument(rm, instrument_address, visa_metrics=None):
+    """
+    Opens the instrument at the given address, returning a SimulatedN9340B for a simulated address.
+    Args:
+        rm (pyvisa.ResourceManager): The resource manager (may be None for simulated instruments).
+        instrument_address (str): VISA resource address or one of simulated_instrument_addresses().
+        visa_metrics (VisaMetrics): If given, every transaction with the instrument is recorded in it.
+    Returns:
+        The opened instrument resource (wrapped in an InstrumentedResource with visa_metrics).
+    """
+    if instrument_address.startswith("SIM::N9340B::"):
+        inst = SimulatedN9340B(resource_name=instrument_address)
+    else:
+        inst = rm.open_resource(instrument_address)
+    if visa_metrics is not None:
+        inst = InstrumentedResource(inst, visa_metrics)
+    return inst
+
+
+def discover_instruments(rm, available_resources, model_pattern=INSTRUMENT_MODEL_PATTERN):
+    """
+    Finds the analyzers among the VISA resources by asking each one for its *IDN?.
+    Resources that cannot be opened or that answer with another model are skipped.
+    Args:
+        rm (pyvisa.ResourceManager): The resource manager (may be None for simulated instruments).
+        available_resources (list): Resource addresses, e.g. from rm.list_resources().
+        model_pattern (str): Text the *IDN? response must contain.
+    Returns:
+        list: (address, idn_response) tuples of the matching instruments, in resource order.
+    """
+    instruments = []
+    for instrument_address in available_resources:
+        inst = None
+        try:
+            inst = open_instrument(rm, instrument_address)
+            idn_response = inst.query("*IDN?").strip()
+        except Exception as e:
+            print(f"⚠️ Skipping {instrument_address}: no *IDN? response ({e}).")
+            continue
+        finally:
+            if inst is not None:
+                try:
+                    inst.close()
+                except Exception:
+                    pass
+        if model_pattern in idn_response:
+            print(f"🔎 Found {idn_response} at {instrument_address}")
+            instruments.append((instrument_address, idn_response))
+        else:
+            print(f"⏭️ Skipping {instrument_address}: {idn_response}")
+    return instruments
 
 
 def query_safe(inst, command):
@@ -284,10 +952,602 @@ def write_safe(inst, command):
         return False
 
 
-def initialize_instrument(inst, clear_reset, preamplifier_on, display_log, ref_level, max_hold_on, rbw_config_val):
+def scpi_mnemonic(message):
+    """
+    Reduces a SCPI message to the headers it is made of, so messages that differ only in
+    their arguments or marker/trace numbers are counted together.
+    Args:
+        message (str): A ';'-joined SCPI message, e.g. ":CALC:MARK1:X 88000000.0HZ;:CALC:MARK1:Y?;:SYST:ERR?".
+    Returns:
+        str: The distinct headers in order, without numeric suffixes, e.g. ":CALC:MARK:X;:CALC:MARK:Y?;:SYST:ERR?".
+    """
+    headers = []
+    for command in message.split(';'):
+        header = re.sub(r'(?<=[A-Za-z])\d+', '', command.strip().split(' ', 1)[0]).upper()
+        if header and header not in headers:
+            headers.append(header)
+    return ';'.join(headers)
+
+
+class InstrumentedResource:
+    """
+    Wraps an instrument resource (pyvisa or SimulatedN9340B) and reports every write, query and
+    read to a recorder, with the message's SCPI mnemonic (see scpi_mnemonic), start time, duration,
+    bytes sent and received and any VISA error. Everything else (timeout, read_termination, ...)
+    is passed through to the wrapped resource, so the scan code uses it like the resource itself.
+    The recorder only needs a record(mnemonic, start_time, seconds, bytes_sent, bytes_received, error) method.
+    """
+
+    def __init__(self, inst, recorder):
+        """
+        Args:
+            inst (pyvisa.resources.Resource): The instrument resource to wrap.
+            recorder: Receives one record() call per instrument transaction.
+        """
+        object.__setattr__(self, "inst", inst)
+        object.__setattr__(self, "recorder", recorder)
+        object.__setattr__(self, "last_mnemonic", "")
+
+    def __getattr__(self, name):
+        return getattr(self.inst, name)
+
+    def __setattr__(self, name, value):
+        if name in ("recorder", "last_mnemonic"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.inst, name, value)
+
+    def _timed(self, mnemonic, bytes_sent, call):
+        """Runs call(), reporting its duration and size to the recorder; VISA errors are reported and re-raised."""
+        start_time = time.perf_counter()
+        try:
+            result = call()
+        except pyvisa.VisaIOError as e:
+            self.recorder.record(mnemonic, start_time, time.perf_counter() - start_time, bytes_sent, 0, e)
+            raise
+        bytes_received = len(result) if isinstance(result, (bytes, str)) else 0
+        self.recorder.record(mnemonic, start_time, time.perf_counter() - start_time, bytes_sent, bytes_received, None)
+        return result
+
+    def write(self, message):
+        self.last_mnemonic = scpi_mnemonic(message)
+        return self._timed(self.last_mnemonic, len(message), lambda: self.inst.write(message))
+
+    def query(self, message):
+        self.last_mnemonic = scpi_mnemonic(message)
+        return self._timed(self.last_mnemonic, len(message), lambda: self.inst.query(message))
+
+    def read(self):
+        # A read belongs to the query written just before it (e.g. the :TRAC1:DATA? trace transfer)
+        return self._timed(self.last_mnemonic + " <read>", 0, self.inst.read)
+
+    def read_raw(self):
+        return self._timed(self.last_mnemonic + " <read>", 0, self.inst.read_raw)
+
+
+class VisaMetrics:
+    """
+    Recorder for InstrumentedResource that keeps running VISA statistics per SCPI mnemonic:
+    calls, bytes sent and received, timeouts and other errors, total time and a latency histogram
+    (VISA_LATENCY_BUCKETS_MS). It also collects a timeline of every transaction (and of any spans
+    added with add_span) in Chrome trace format, one row per thread, for chrome://tracing or Perfetto.
+    Every summary_interval_seconds a summary is printed and passed to on_summary (e.g. for the GUI).
+    Safe to share between the scan threads of several instruments.
+    """
+
+    def __init__(self, summary_interval_seconds=VISA_METRICS_SUMMARY_INTERVAL_SECONDS, on_summary=None):
+        """
+        Args:
+            summary_interval_seconds (float): How often to print a summary while recording (0 for never).
+            on_summary (callable): Called with the summary text each time one is printed.
+        """
+        self.summary_interval_seconds = summary_interval_seconds
+        self.on_summary = on_summary
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.last_summary_time = self.start_time
+        self.commands = {} # mnemonic -> statistics dictionary (see _command_stats)
+        self.trace_events = [] # Chrome trace events since the last save_timeline()
+        self.thread_names = {} # thread id -> name, for the timeline's row labels
+
+    @staticmethod
+    def _command_stats():
+        return {"calls": 0, "bytes_sent": 0, "bytes_received": 0, "timeouts": 0, "errors": 0, "total_seconds": 0.0,
+                "histogram": [0] * (len(VISA_LATENCY_BUCKETS_MS) + 1)} # The last bucket holds everything slower
+
+    def _add_trace_event(self, name, category, start_time, seconds, args):
+        thread = threading.current_thread()
+        self.thread_names[thread.ident] = thread.name
+        self.trace_events.append({
+            "name": name, "cat": category, "ph": "X", "pid": 1, "tid": thread.ident,
+            "ts": round((start_time - self.start_time) * 1e6, 1), "dur": round(seconds * 1e6, 1), "args": args,
+        })
+
+    def record(self, mnemonic, start_time, seconds, bytes_sent, bytes_received, error):
+        timed_out = isinstance(error, pyvisa.VisaIOError) and error.error_code == pyvisa.constants.StatusCode.error_timeout
+        with self.lock:
+            command_stats = self.commands.setdefault(mnemonic, self._command_stats())
+            command_stats["calls"] += 1
+            command_stats["bytes_sent"] += bytes_sent
+            command_stats["bytes_received"] += bytes_received
+            command_stats["total_seconds"] += seconds
+            command_stats["histogram"][int(np.searchsorted(VISA_LATENCY_BUCKETS_MS, seconds * 1000))] += 1
+            if timed_out:
+                command_stats["timeouts"] += 1
+            elif error is not None:
+                command_stats["errors"] += 1
+            trace_args = {"bytes_sent": bytes_sent, "bytes_received": bytes_received}
+            if error is not None:
+                trace_args["error"] = str(error)
+            self._add_trace_event(mnemonic, "visa", start_time, seconds, trace_args)
+
+            summary_due = self.summary_interval_seconds > 0 and time.perf_counter() - self.last_summary_time >= self.summary_interval_seconds
+            if summary_due:
+                self.last_summary_time = time.perf_counter()
+        if summary_due:
+            self.print_summary()
+
+    def add_span(self, name, start_time, seconds):
+        """
+        Adds a non-VISA span (e.g. a cycle's scan or its file writing) to the timeline.
+        Args:
+            name (str): The span's label.
+            start_time (float): time.perf_counter() at the start of the span.
+            seconds (float): Duration of the span.
+        """
+        with self.lock:
+            self._add_trace_event(name, "scan", start_time, seconds, {})
+
+    def summary(self):
+        """
+        Returns:
+            dict: "elapsed_seconds", the run's "totals" and per-mnemonic "commands" statistics
+                  (with mean latency and the histogram keyed by bucket upper limit in ms).
+        """
+        with self.lock:
+            commands = {}
+            for mnemonic, command_stats in sorted(self.commands.items(), key=lambda item: -item[1]["total_seconds"]):
+                histogram_labels = [f"<={limit_ms:g}" for limit_ms in VISA_LATENCY_BUCKETS_MS] + [f">{VISA_LATENCY_BUCKETS_MS[-1]:g}"]
+                commands[mnemonic] = dict(
+                    command_stats,
+                    total_seconds=round(command_stats["total_seconds"], 6),
+                    mean_ms=round(command_stats["total_seconds"] / command_stats["calls"] * 1000, 3),
+                    histogram_ms=dict(zip(histogram_labels, command_stats["histogram"])),
+                )
+                del commands[mnemonic]["histogram"]
+        totals = {key: sum(command_stats[key] for command_stats in commands.values())
+                  for key in ("calls", "bytes_sent", "bytes_received", "timeouts", "errors", "total_seconds")}
+        return {"elapsed_seconds": round(time.perf_counter() - self.start_time, 3), "totals": totals, "commands": commands}
+
+    def summary_text(self, top_count=VISA_METRICS_SUMMARY_TOP_COUNT):
+        """
+        Formats the summary: one line of totals, then the top_count mnemonics by total time.
+        """
+        summary = self.summary()
+        totals = summary["totals"]
+        lines = [
+            f"VISA: {totals['calls']} calls, {(totals['bytes_sent'] + totals['bytes_received']) / 1e6:.2f} MB, "
+            f"{totals['timeouts']} timeouts, {totals['errors']} errors, {totals['total_seconds']:.1f} s of instrument I/O in {summary['elapsed_seconds']:.1f} s"
+        ]
+        for mnemonic, command_stats in list(summary["commands"].items())[:top_count]:
+            lines.append(f"  {command_stats['total_seconds']:8.2f} s {command_stats['calls']:7d} x {command_stats['mean_ms']:8.2f} ms  {mnemonic}")
+        return "\n".join(lines)
+
+    def print_summary(self):
+        """Prints the summary and passes it to on_summary."""
+        summary_text = self.summary_text()
+        print(f"\n📊 {summary_text}")
+        if self.on_summary is not None:
+            self.on_summary(summary_text)
+
+    def save_metrics(self, metrics_filename):
+        """Writes the summary (cumulative since recording started) to a JSON file."""
+        with open(metrics_filename, "w") as metrics_file:
+            json.dump(dict(self.summary(), updated=datetime.now().isoformat(timespec="seconds")), metrics_file, indent=2)
+
+    def save_timeline(self, timeline_filename):
+        """
+        Writes the timeline recorded since the last call as a Chrome trace JSON file and starts a new one.
+        Args:
+            timeline_filename (str): The file to write, e.g. "<cycle>.trace.json".
+        """
+        with self.lock:
+            trace_events, self.trace_events = self.trace_events, []
+            thread_names = dict(self.thread_names)
+        name_events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": thread_id, "args": {"name": thread_name}}
+                       for thread_id, thread_name in thread_names.items()]
+        with open(timeline_filename, "w") as timeline_file:
+            json.dump({"traceEvents": name_events + trace_events, "displayTimeUnit": "ms"}, timeline_file)
+
+
+# A failed SCPI command. code is the instrument's :SYST:ERR? error number (None if the error queue answer was unreadable),
+# message is the instrument's error text and command is the command it belongs to (or the whole message if the
+# instrument's error text doesn't say which command failed).
+ScpiError = namedtuple("ScpiError", ["code", "message", "command"])
+
+# The result of ScpiCommandPipeline.query(): the response text (None if nothing usable was received)
+# and the errors reported for the message it was sent in.
+ScpiReply = namedtuple("ScpiReply", ["response", "errors"])
+
+# Trailing ':SYST:ERR?' answer, e.g. '-113,"Undefined header"'
+SCPI_ERROR_RESPONSE_PATTERN = re.compile(r'([+-]?\d+)\s*,\s*"([^"]*)"\s*$')
+
+
+def scpi_max_message_length(idn_response):
+    """
+    Looks up the longest command message the instrument accepts from its *IDN? response.
+    Args:
+        idn_response (str): The instrument's *IDN? response.
+    Returns:
+        int: The maximum message length in characters for that model (DEFAULT_SCPI_MAX_MESSAGE_LENGTH if unknown).
+    """
+    for model, max_message_length in SCPI_MAX_MESSAGE_LENGTH_BY_MODEL.items():
+        if model in idn_response:
+            return max_message_length
+    return DEFAULT_SCPI_MAX_MESSAGE_LENGTH
+
+
+class ScpiCommandPipeline:
+    """
+    Batches SCPI commands to cut down on VISA round trips.
+    Writes are queued and only sent when a query needs an answer (or flush() is called),
+    joined with ';' into as few messages as the instrument's maximum message length allows.
+    With check_errors, ':SYST:ERR?' is appended to every message, so each message is also
+    checked for errors in the same round trip; the errors come back as ScpiError records
+    instead of being swallowed (see query_safe's "[Not Supported or Timeout]").
+    VISA I/O errors (a lost connection, a timeout) are not instrument errors and are raised as
+    pyvisa.VisaIOError, so the scan stops at the last measured segment and reconnects.
+    """
+
+    def __init__(self, inst, max_message_length=None, check_errors=True):
+        """
+        Args:
+            inst (pyvisa.resources.Resource): The PyVISA instrument object.
+            max_message_length (int): Longest message (in characters) to send at once.
+                                      If None, it is looked up from the instrument's *IDN? response.
+            check_errors (bool): Whether to read the instrument's error queue with every message.
+        """
+        self.inst = inst
+        if max_message_length is None:
+            max_message_length = scpi_max_message_length(query_safe(inst, "*IDN?"))
+        self.max_message_length = max_message_length
+        self.check_errors = check_errors
+        self.pending_commands = [] # Queued writes, not sent yet
+        self.errors = [] # Every error reported since the last take_errors()
+
+    def write(self, command):
+        """
+        Queues a command to be sent with the next query or flush().
+        Args:
+            command (str): The SCPI command to write.
+        Returns:
+            bool: Always True (the command is only checked when it is sent).
+        """
+        self.pending_commands.append(command)
+        return True
+
+    def _pack_messages(self, commands, reserved_length):
+        """
+        Groups commands into ';'-joined messages no longer than max_message_length (less reserved_length).
+        A single command longer than the limit is sent on its own.
+        Args:
+            commands (list): The commands to send, in order.
+            reserved_length (int): Characters to leave free in every message (for the appended ':SYST:ERR?').
+        Returns:
+            list: Lists of commands, one list per message.
+        """
+        messages = []
+        current_message = []
+        current_length = 0
+        for command in commands:
+            if current_message and current_length + 1 + len(command) + reserved_length > self.max_message_length:
+                messages.append(current_message)
+                current_message = []
+                current_length = 0
+            current_length += len(command) + (1 if current_message else 0) # +1 for the ';'
+            current_message.append(command)
+        if current_message:
+            messages.append(current_message)
+        return messages
+
+    def _error_suffix_length(self):
+        return len(";:SYST:ERR?") if self.check_errors else 0
+
+    def _send(self, commands, expects_response):
+        """
+        Sends one message and reads back its response and errors.
+        Args:
+            commands (list): The commands making up the message.
+            expects_response (bool): Whether the last command is a query whose answer is wanted.
+        Returns:
+            ScpiReply: The response (without the error queue answer) and the errors for this message.
+        Raises:
+            pyvisa.VisaIOError: If the message or its answer could not be transferred.
+        """
+        message = ";".join(commands)
+        errors = []
+        response = None
+        if self.check_errors:
+            raw_response = self.inst.query(message + ";:SYST:ERR?").strip()
+            error_match = SCPI_ERROR_RESPONSE_PATTERN.search(raw_response)
+            if error_match is None:
+                errors.append(ScpiError(None, f"Unreadable error queue response '{raw_response}'", message))
+                response = raw_response
+            else:
+                response = raw_response[:error_match.start()].rstrip(';').strip()
+                error_code = int(error_match.group(1))
+                # Drain the error queue; only a failing message costs extra round trips
+                for _ in range(SCPI_MAX_ERRORS_PER_MESSAGE):
+                    if error_code == 0:
+                        break
+                    errors.append(ScpiError(error_code, error_match.group(2), self._failed_command(commands, error_match.group(2), message)))
+                    error_match = SCPI_ERROR_RESPONSE_PATTERN.search(self.inst.query(":SYST:ERR?").strip())
+                    error_code = int(error_match.group(1)) if error_match else 0
+        elif expects_response:
+            response = self.inst.query(message).strip()
+        else:
+            self.inst.write(message)
+
+        if expects_response and response == "":
+            response = None
+        self.errors.extend(errors)
+        return ScpiReply(response if expects_response else None, errors)
+
+    @staticmethod
+    def _failed_command(commands, error_message, message):
+        """
+        Works out which command an error belongs to. The instrument usually names the offending
+        header in its error text (e.g. 'Undefined header; :FOO:BAR'); otherwise the whole message is blamed.
+        """
+        error_text = error_message.upper()
+        for command in commands:
+            header = command.split(' ', 1)[0].strip().upper()
+            if header and header.lstrip(':') in error_text:
+                return command
+        return message
+
+    def flush(self):
+        """
+        Sends every queued write.
+        Returns:
+            list: The ScpiError records for the commands sent (empty if all succeeded).
+        """
+        commands, self.pending_commands = self.pending_commands, []
+        errors = []
+        for message_commands in self._pack_messages(commands, self._error_suffix_length()):
+            errors.extend(self._send(message_commands, expects_response=False).errors)
+        return errors
+
+    def query(self, command):
+        """
+        Sends the queued writes followed by a query, in a single message when they fit.
+        Args:
+            command (str): The SCPI query (may itself be several ';'-joined commands, e.g. ":INIT:IMM;*OPC?").
+        Returns:
+            ScpiReply: The query's response and the errors for every command sent.
+        """
+        commands = self.pending_commands + [command]
+        self.pending_commands = []
+        messages = self._pack_messages(commands, self._error_suffix_length())
+        errors = []
+        for message_commands in messages[:-1]:
+            errors.extend(self._send(message_commands, expects_response=False).errors)
+        reply = self._send(messages[-1], expects_response=True)
+        return ScpiReply(reply.response, errors + reply.errors)
+
+    def clear(self):
+        """Drops any queued writes and clears the instrument's I/O buffers."""
+        self.pending_commands = []
+        self.inst.clear()
+
+    def take_errors(self):
+        """
+        Returns and forgets every error reported since the last call.
+        Returns:
+            list: The ScpiError records.
+        """
+        errors, self.errors = self.errors, []
+        return errors
+
+
+def report_scpi_errors(errors):
+    """
+    Prints the errors reported by a ScpiCommandPipeline.
+    Args:
+        errors (list): ScpiError records.
+    """
+    for error in errors:
+        if error.code is None:
+            print(f"❌ Unreadable reply for '{error.command}': {error.message}")
+        else:
+            print(f"⚠️ Instrument error {error.code} ({error.message}) for '{error.command}'")
+
+
+def read_trace_data(inst):
+    """
+    Reads the full Trace 1 data from the instrument in a single binary transfer.
+    The trace format must already be set to REAL (":TRAC:FORMat REAL").
+    Handles both a raw float32 stream and an IEEE 488.2 definite-length block ("#<n><length><data>").
+
+    Args:
+        inst (pyvisa.resources.Resource): The PyVISA instrument object.
+    Returns:
+        numpy.ndarray: The trace amplitudes in dBm as a float32 array (empty if nothing was received).
+    """
+    # Binary data can contain bytes that look like termination characters,
+    # so read the raw block without a read termination and restore it afterwards.
+    original_read_termination = inst.read_termination
+    inst.read_termination = ''
+    try:
+        inst.write(":TRAC1:DATA?")
+        raw_bytes = inst.read_raw()
+    finally:
+        inst.read_termination = original_read_termination
+
+    # Strip an IEEE 488.2 definite-length block header if the instrument sent one
+    if raw_bytes[:1] == b'#':
+        header_digits = int(raw_bytes[1:2])
+        data_length = int(raw_bytes[2:2 + header_digits])
+        raw_bytes = raw_bytes[2 + header_digits:2 + header_digits + data_length]
+
+    # Drop any trailing bytes (e.g. a newline) that do not make up a whole float32
+    usable_length = len(raw_bytes) - (len(raw_bytes) % 4)
+    return np.frombuffer(raw_bytes[:usable_length], dtype='<f4')
+
+
+def read_trace_levels_at(inst, segment_start_freq_hz, segment_span_hz, grid_hz):
+    """
+    Reads the current trace and picks the trace point nearest to each grid frequency.
+    Args:
+        inst (pyvisa.resources.Resource): The PyVISA instrument object (trace format REAL).
+        segment_start_freq_hz (float): The instrument's start frequency in Hz.
+        segment_span_hz (float): The instrument's span in Hz.
+        grid_hz (numpy.ndarray): The frequencies to return levels for, in Hz.
+    Returns:
+        numpy.ndarray: The levels in dBm (float32) for grid_hz, or None if no trace data was received.
+    """
+    trace_levels = read_trace_data(inst)
+    if trace_levels.size < 2:
+        print("🚫 No trace data bytes received for this segment.")
+        return None
+    # The trace points are evenly spaced across the instrument span; pick the one on each grid frequency
+    trace_step_hz = segment_span_hz / (trace_levels.size - 1)
+    trace_indices = np.rint((grid_hz - segment_start_freq_hz) / trace_step_hz).astype(np.int64)
+    trace_indices = np.clip(trace_indices, 0, trace_levels.size - 1)
+    return trace_levels[trace_indices]
+
+
+def query_sweep_time(pipeline):
+    """
+    Asks the instrument how long one sweep of the current span and RBW takes.
+    Any queued commands (e.g. the segment's start and stop frequencies) are sent in the same message.
+    Args:
+        pipeline (ScpiCommandPipeline): The command pipeline for the instrument.
+    Returns:
+        float: The sweep time in seconds, or None if the instrument did not report it.
+    """
+    try:
+        return float(pipeline.query(":SENS:SWE:TIME?").response)
+    except (TypeError, ValueError):
+        return None
+
+
+def wait_for_sweep_complete(pipeline, sweep_time_seconds, max_hold_time=0):
+    """
+    Triggers single sweeps and blocks until the instrument reports each one complete,
+    instead of sleeping for a fixed time. ":INIT:IMM;*OPC?" only answers once the sweep
+    has finished, so the wait is exactly as long as the instrument needs.
+    With max hold, the segment is swept repeatedly until max_hold_time has elapsed (at least
+    one full sweep), which is the minimum dwell for the MAXHold trace to capture intermittent signals.
+    Any queued commands (e.g. the segment's start and stop frequencies) go out with the first sweep.
+
+    Args:
+        pipeline (ScpiCommandPipeline): The command pipeline for the instrument (in single-sweep mode, ":INIT:CONT OFF").
+        sweep_time_seconds (float): Sweep time reported by the instrument, or None if unknown.
+        max_hold_time (float): Total time in seconds to keep sweeping the segment for max hold (0 for one sweep).
+    Returns:
+        int: The number of sweeps performed.
+    """
+    # Allow each sweep twice its nominal time plus a margin before the query times out
+    # (if the sweep time is unknown, the instrument's current timeout is kept)
+    sweep_timeout_ms = int(sweep_time_seconds * 2000) + SWEEP_TIMEOUT_MARGIN_MS if sweep_time_seconds else 0
+
+    inst = pipeline.inst
+    original_timeout = inst.timeout
+    inst.timeout = max(original_timeout, sweep_timeout_ms)
+    sweeps_done = 0
+    try:
+        hold_start_time = time.monotonic()
+        last_shown_second = None
+        while True:
+            pipeline.query(":INIT:IMM;*OPC?") # Answers "1" when the sweep is complete
+            sweeps_done += 1
+            seconds_left = max_hold_time - (time.monotonic() - hold_start_time)
+            if seconds_left <= 0:
+                break
+            # Show the remaining max hold time, once per whole second
+            whole_seconds_left = int(np.ceil(seconds_left))
+            if whole_seconds_left != last_shown_second:
+                sys.stdout.write(f"⏳{whole_seconds_left}")
+                sys.stdout.flush()
+                last_shown_second = whole_seconds_left
+        if max_hold_time > 0:
+            sys.stdout.write("✅")
+            sys.stdout.flush()
+    finally:
+        inst.timeout = original_timeout
+    return sweeps_done
+
+
+class InstrumentStateCache:
+    """
+    Remembers the value of every setting sent to the instrument, so a setting is only
+    sent again when its value actually changes. Anything that resets the instrument
+    (*RST, reconnecting after an error) must go through hard_reset() or invalidate(),
+    after which every setting is sent again.
+    Settings are queued on a ScpiCommandPipeline; settings the instrument reports
+    an error for are forgotten again with discard_failed().
+    """
+
+    def __init__(self):
+        self.settings = {} # SCPI header -> last value sent
+
+    def set(self, pipeline, header, value):
+        """
+        Queues "<header> <value>" unless the instrument already has that value.
+        Args:
+            pipeline (ScpiCommandPipeline): The command pipeline for the instrument.
+            header (str): The SCPI command header, e.g. ":SENS:POW:GAIN".
+            value: The setting value, e.g. "ON".
+        Returns:
+            bool: True if the command was queued, False if it was already set.
+        """
+        if header in self.settings and self.settings[header] == value:
+            return False
+        pipeline.write(f"{header} {value}")
+        self.settings[header] = value
+        return True
+
+    def discard_failed(self, errors):
+        """
+        Forgets the settings whose commands failed, so they are sent again next time.
+        Errors that can't be tied to a single command (e.g. an unreadable error queue answer) invalidate the whole cache.
+        Args:
+            errors (list): ScpiError records from the command pipeline.
+        """
+        for error in errors:
+            if error.code is None or ';' in error.command:
+                self.invalidate()
+                return
+            self.settings.pop(error.command.split(' ', 1)[0], None)
+
+    def invalidate(self):
+        """Forgets all cached settings (the instrument state is unknown)."""
+        self.settings.clear()
+
+    def hard_reset(self, pipeline):
+        """
+        Clears and resets the instrument (*CLS; *RST), waits for it to finish and forgets all cached settings.
+        Used at the start of a cycle (if enabled) and to recover from errors.
+        Args:
+            pipeline (ScpiCommandPipeline): The command pipeline for the instrument.
+        """
+        pipeline.write("*CLS")
+        pipeline.write("*RST")
+        report_scpi_errors(pipeline.query("*OPC?").errors) # Wait for operations to complete
+        pipeline.take_errors()
+        pipeline.clear() # Flush buffer after OPC query
+        self.invalidate()
+
+
+def initialize_instrument(inst, clear_reset, preamplifier_on, display_log, ref_level, max_hold_on, rbw_config_val, state_cache=None, pipeline=None):
     """
     Performs initial configuration of the instrument based on GUI settings.
     RBW and VBW settings are now handled in scan_bands.
+    With a state_cache, only the settings whose values changed since the last call are sent,
+    so it is cheap to call again before every band.
+    All settings are batched into as few messages as possible by the command pipeline
+    and sent together when the function returns.
 
     Args:
         inst (pyvisa.resources.Resource): The PyVISA instrument object.
@@ -297,58 +1557,69 @@ def initialize_instrument(inst, clear_reset, preamplifier_on, display_log, ref_l
         ref_level (float): Reference level in dBm.
         max_hold_on (bool): Whether to set trace 1 to max hold.
         rbw_config_val (str): Resolution Bandwidth value from GUI (e.g., "1KHZ").
+        state_cache (InstrumentStateCache): Cache of the settings already on the instrument.
+                                            If None, every setting is sent.
+        pipeline (ScpiCommandPipeline): The command pipeline for the instrument. A new one is created if None.
     Returns:
         bool: True if initialization is successful, False otherwise.
     """
+    if state_cache is None:
+        state_cache = InstrumentStateCache()
+
     try:
         inst.timeout = 30000 # Set timeout to 30 seconds for queries and data transfer
+        if pipeline is None:
+            pipeline = ScpiCommandPipeline(inst)
 
         if clear_reset:
-            write_safe(inst, "*CLS")
-            write_safe(inst, "*RST")
-            query_safe(inst, "*OPC?") # Wait for operations to complete
-            inst.clear() # Flush buffer after OPC query
+            state_cache.hard_reset(pipeline)
             print("✅ Instrument cleared and reset.")
 
         if preamplifier_on:
-            write_safe(inst, ":SENS:POW:GAIN ON")
-            print("📡 Preamplifier turned ON for high sensitivity.")
+            if state_cache.set(pipeline, ":SENS:POW:GAIN", "ON"):
+                print("📡 Preamplifier turned ON for high sensitivity.")
         else:
-            write_safe(inst, ":SENS:POW:GAIN OFF")
-            print("📡 Preamplifier turned OFF.")
+            if state_cache.set(pipeline, ":SENS:POW:GAIN", "OFF"):
+                print("📡 Preamplifier turned OFF.")
 
         if display_log:
-            write_safe(inst, ":DISP:WIND:TRAC:Y:SCAL LOG")
-            print("📊 Display set to logarithmic scale")
+            if state_cache.set(pipeline, ":DISP:WIND:TRAC:Y:SCAL", "LOG"):
+                print("📊 Display set to logarithmic scale")
         else:
-            write_safe(inst, ":DISP:WIND:TRAC:Y:SCAL LIN")
-            print("📊 Display set to linear scale")
+            if state_cache.set(pipeline, ":DISP:WIND:TRAC:Y:SCAL", "LIN"):
+                print("📊 Display set to linear scale")
 
-        write_safe(inst, f":DISP:WIND:TRAC:Y:SCAL:RLEVel {ref_level}DBM")
-        print(f"📉 Display set to reference level {ref_level} dBm.")
+        if state_cache.set(pipeline, ":DISP:WIND:TRAC:Y:SCAL:RLEVel", f"{ref_level}DBM"):
+            print(f"📉 Display set to reference level {ref_level} dBm.")
 
         if max_hold_on:
-            write_safe(inst, ":TRAC1:MODE MAXHold")
-            print("⏸️ Trace 1 set to max hold")
+            if state_cache.set(pipeline, ":TRAC1:MODE", "MAXHold"):
+                print("⏸️ Trace 1 set to max hold")
         else:
-            write_safe(inst, ":TRAC1:MODE WRITe") # Or NORMal, depending on desired default
-            print("▶️ Trace 1 set to normal/write mode")
-
-        print("⚙️ Setting traces 2, 3, and 4 to BLANK mode...")
-        write_safe(inst, ":TRAC2:MODE BLANK")
-        write_safe(inst, ":TRAC3:MODE BLANK")
-        write_safe(inst, ":TRAC4:MODE BLANK")
-
-        # Configure markers 1-6
-        for marker_num in range(1, 6): # Changed range to include 6 markers
-            write_safe(inst, f":CALC:MARK{marker_num}:STAT ON") # Enable marker
-            write_safe(inst, f":CALC:MARK{marker_num}:MODE NORMal") # Set to normal mode
+            if state_cache.set(pipeline, ":TRAC1:MODE", "WRITe"): # Or NORMal, depending on desired default
+                print("▶️ Trace 1 set to normal/write mode")
+
+        traces_blanked = [state_cache.set(pipeline, f":TRAC{trace_num}:MODE", "BLANK") for trace_num in (2, 3, 4)]
+        if any(traces_blanked):
+            print("⚙️ Traces 2, 3, and 4 set to BLANK mode.")
+
+        # Configure markers 1-5
+        markers_changed = False
+        for marker_num in range(1, MARKERS_PER_BATCH + 1):
+            markers_changed |= state_cache.set(pipeline, f":CALC:MARK{marker_num}:STAT", "ON") # Enable marker
+            markers_changed |= state_cache.set(pipeline, f":CALC:MARK{marker_num}:MODE", "NORMal") # Set to normal mode
             # Set marker bandwidth resolution to the configured RBW
-            write_safe(inst, f":CALC:MARK{marker_num}:BWID:RES {rbw_config_val}")
-        print(f"✅ Markers 1-6 enabled and set to {rbw_config_val} bandwidth.") # Updated print message
-        
-        
-        return True
+            markers_changed |= state_cache.set(pipeline, f":CALC:MARK{marker_num}:BWID:RES", rbw_config_val)
+        if markers_changed:
+            print(f"✅ Markers 1-{MARKERS_PER_BATCH} enabled and set to {rbw_config_val} bandwidth.")
+
+        # Send everything queued above; settings the instrument rejected are sent again next time
+        errors = pipeline.flush()
+        report_scpi_errors(errors)
+        state_cache.discard_failed(errors)
+        pipeline.take_errors()
+        # Rejected settings are only warnings, but an unreadable error queue answer means the connection is out of step
+        return not any(error.code is None for error in errors)
     except pyvisa.VisaIOError as e:
         print(f"❌ VISA Error during instrument configuration: {e}")
         return False
@@ -357,12 +1628,1295 @@ def initialize_instrument(inst, clear_reset, preamplifier_on, display_log, ref_l
         return False
 
 
-def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanned_band_index=0, rbw_config_val="1KHZ", vbw_config_val="1KHZ"):
+def build_segment_frequency_grid(segment_start_freq_hz, segment_stop_freq_hz, step_hz, include_stop=False):
+    """
+    Builds the non-overlapping frequency grid for one segment: start, start + step, start + 2*step, ...
+    Args:
+        segment_start_freq_hz (float): First frequency of the segment in Hz.
+        segment_stop_freq_hz (float): Stop frequency of the segment in Hz.
+        step_hz (float): Grid step in Hz (the desired resolution, e.g. 10000).
+        include_stop (bool): Whether a grid point landing on the stop frequency is kept.
+                             Only the last segment of a band keeps it; otherwise it belongs to the next segment.
+    Returns:
+        numpy.ndarray: The grid frequencies in Hz (float64), ascending.
+    """
+    # A small tolerance absorbs floating point error so the stop frequency is treated consistently
+    tolerance = step_hz * 1e-6
+    point_count = int(np.floor((segment_stop_freq_hz - segment_start_freq_hz + tolerance) / step_hz)) + 1
+    grid_hz = segment_start_freq_hz + np.arange(point_count, dtype=np.float64) * step_hz
+    if not include_stop:
+        grid_hz = grid_hz[grid_hz < segment_stop_freq_hz - tolerance]
+    return grid_hz
+
+
+def segment_span_for_mode(step_hz, acquisition_mode):
+    """
+    Works out the instrument span of each segment: TRACE_SWEEP_POINTS points, one grid step apart.
+    "Adaptive" mode sweeps coarse segments ADAPTIVE_COARSE_STEP_FACTOR times wider.
+    Args:
+        step_hz (float): Grid step in Hz (the RBW step size).
+        acquisition_mode (str): One of ACQUISITION_MODES.
+    Returns:
+        float: The segment span in Hz.
+    """
+    segment_span_hz = step_hz * (TRACE_SWEEP_POINTS - 1)
+    if acquisition_mode == "Adaptive":
+        segment_span_hz *= ADAPTIVE_COARSE_STEP_FACTOR
+    return segment_span_hz
+
+
+def detect_signal_regions(frequencies_hz, levels_dbm, threshold_db, guard_hz):
+    """
+    Finds the frequency ranges where a coarse trace rises above the noise floor.
+    The noise floor is the median level of the trace, so a segment that is mostly empty
+    gives a floor close to the instrument's noise.
+    Args:
+        frequencies_hz (numpy.ndarray): Coarse point frequencies in Hz, ascending.
+        levels_dbm (numpy.ndarray): Coarse point levels in dBm.
+        threshold_db (float): How far above the noise floor a point must be to count as a signal.
+        guard_hz (float): Extra range added either side of every detected point.
+    Returns:
+        tuple: (float: noise_floor_dbm, numpy.ndarray: region_starts_hz, numpy.ndarray: region_stops_hz)
+               The regions are merged where they overlap and sorted by frequency.
+    """
+    noise_floor_dbm = float(np.median(levels_dbm))
+    detected_hz = frequencies_hz[levels_dbm > noise_floor_dbm + threshold_db]
+    if detected_hz.size == 0:
+        return noise_floor_dbm, np.empty(0), np.empty(0)
+
+    starts_hz = detected_hz - guard_hz
+    stops_hz = detected_hz + guard_hz
+    # A new region begins wherever a detection's range doesn't touch the previous one
+    region_breaks = np.flatnonzero(starts_hz[1:] > stops_hz[:-1]) + 1
+    region_starts_hz = starts_hz[np.r_[0, region_breaks]]
+    region_stops_hz = stops_hz[np.r_[region_breaks - 1, detected_hz.size - 1]]
+    return noise_floor_dbm, region_starts_hz, region_stops_hz
+
+
+def frequencies_in_regions(frequencies_hz, region_starts_hz, region_stops_hz):
+    """
+    Tells which frequencies fall inside any of the given (sorted, non-overlapping) regions.
+    Args:
+        frequencies_hz (numpy.ndarray): Frequencies in Hz.
+        region_starts_hz (numpy.ndarray): Region start frequencies, ascending.
+        region_stops_hz (numpy.ndarray): Region stop frequencies (inclusive).
+    Returns:
+        numpy.ndarray: Boolean mask, True for frequencies inside a region.
+    """
+    if region_starts_hz.size == 0:
+        return np.zeros(frequencies_hz.shape, dtype=bool)
+    region_indices = np.searchsorted(region_starts_hz, frequencies_hz, side='right') - 1
+    return (region_indices >= 0) & (frequencies_hz <= region_stops_hz[np.maximum(region_indices, 0)])
+
+
+def scan_signal_regions(pipeline, region_grid_hz, segment_span_hz, max_hold_time, sweep_time_seconds=None):
+    """
+    Measures the fine grid points of the detected signal regions with as few trace sweeps as possible.
+    Each sweep starts at the next unmeasured grid point and covers one full segment span,
+    so nearby regions share a sweep.
+    Args:
+        pipeline (ScpiCommandPipeline): The command pipeline for the instrument (trace format REAL).
+        region_grid_hz (numpy.ndarray): The fine grid frequencies inside the signal regions, ascending.
+        segment_span_hz (float): Instrument span of a fine sweep (TRACE_SWEEP_POINTS points one grid step apart).
+        max_hold_time (float): Max hold dwell per sweep in seconds (see wait_for_sweep_complete).
+        sweep_time_seconds (float): Sweep time of a fine sweep, or None to ask the instrument.
+    Returns:
+        tuple: (numpy.ndarray: levels_dbm for region_grid_hz (NaN where no trace was received),
+                float: sweep_time_seconds of a fine sweep, to reuse for the next call)
+    """
+    levels_dbm = np.full(region_grid_hz.size, np.nan, dtype=np.float32)
+    sweep_start_index = 0
+    while sweep_start_index < region_grid_hz.size:
+        sweep_start_freq_hz = region_grid_hz[sweep_start_index]
+        # A tiny tolerance keeps a point landing exactly on the sweep's stop frequency in this sweep
+        sweep_end_index = np.searchsorted(region_grid_hz, sweep_start_freq_hz + segment_span_hz * (1 + 1e-9), side='right')
+        sweep_grid_hz = region_grid_hz[sweep_start_index:sweep_end_index]
+
+        pipeline.write(f":SENS:FREQ:STAR {sweep_start_freq_hz}")
+        pipeline.write(f":SENS:FREQ:STOP {sweep_start_freq_hz + segment_span_hz}")
+        if sweep_time_seconds is None:
+            sweep_time_seconds = query_sweep_time(pipeline)
+        wait_for_sweep_complete(pipeline, sweep_time_seconds, max_hold_time)
+
+        sweep_levels_dbm = read_trace_levels_at(pipeline.inst, sweep_start_freq_hz, segment_span_hz, sweep_grid_hz)
+        if sweep_levels_dbm is not None:
+            levels_dbm[sweep_start_index:sweep_end_index] = sweep_levels_dbm
+        sweep_start_index = sweep_end_index
+    return levels_dbm, sweep_time_seconds
+
+
+def estimate_scan_point_count(selected_bands, step_hz):
+    """
+    Estimates how many grid points a scan of the given bands will produce at the given step.
+    Args:
+        selected_bands (list): Band dictionaries with 'Start MHz' and 'Stop MHz'.
+        step_hz (float): Grid step in Hz.
+    Returns:
+        int: The expected number of data points.
+    """
+    total_points = 0
+    for band in selected_bands:
+        band_span_hz = (band["Stop MHz"] - band["Start MHz"]) * MHZ_TO_HZ
+        if band_span_hz >= 0:
+            total_points += int(np.floor(band_span_hz / step_hz + 1e-6)) + 1
+    return total_points
+
+
+# Predicted cost of scanning bands: see plan_band_scan and plan_scan
+ScanPlan = namedtuple("ScanPlan", ["segments", "round_trips", "bytes_transferred", "points", "scan_seconds"])
+
+
+def estimate_sweep_seconds(span_hz, rbw_hz):
+    """
+    Estimates the time of one sweep from its span and RBW (~ESTIMATED_SWEEP_TIME_FACTOR * span / RBW^2).
+    Args:
+        span_hz (float): The instrument span in Hz.
+        rbw_hz (float): The resolution bandwidth in Hz, or None if unknown.
+    Returns:
+        float: The sweep time in seconds (ESTIMATED_SWEEP_SECONDS if the RBW is unknown).
+    """
+    if not rbw_hz:
+        return ESTIMATED_SWEEP_SECONDS
+    return max(ESTIMATED_MIN_SWEEP_SECONDS, ESTIMATED_SWEEP_TIME_FACTOR * span_hz / rbw_hz ** 2)
+
+
+def supported_rbw_at_or_below(rbw_hz):
+    """
+    Snaps an RBW to the instrument's RBW settings (see SUPPORTED_RBW_HZ).
+    Args:
+        rbw_hz (float): The wanted RBW in Hz.
+    Returns:
+        float: The widest supported RBW not wider than rbw_hz (the narrowest supported RBW if rbw_hz is below it).
+    """
+    return max((supported_hz for supported_hz in SUPPORTED_RBW_HZ if supported_hz <= rbw_hz * (1 + 1e-9)), default=SUPPORTED_RBW_HZ[0])
+
+
+def estimate_sweeps_per_segment(sweep_seconds, max_hold_time):
+    """
+    Works out how many sweeps wait_for_sweep_complete makes for one segment:
+    one, or as many as it takes for max_hold_time to elapse.
+    Args:
+        sweep_seconds (float): Time of one sweep in seconds.
+        max_hold_time (float): Max hold dwell per segment in seconds.
+    Returns:
+        int: The number of sweeps (each is one ":INIT:IMM;*OPC?" round trip).
+    """
+    return max(1, int(np.ceil(max_hold_time / (sweep_seconds + ESTIMATED_ROUND_TRIP_SECONDS))))
+
+
+def plan_band_scan(band, step_hz, acquisition_mode, max_hold_time, rbw_config_val):
+    """
+    Predicts what scanning one band costs, following the segment loop of scan_bands:
+    the segment count from segment_span_for_mode, the sweeps per segment (max hold),
+    the marker batches or trace transfers, and the ESTIMATED_* per-operation costs.
+    Args:
+        band (dict): Band dictionary with 'Start MHz' and 'Stop MHz'.
+        step_hz (float): Grid step in Hz (the RBW step size).
+        acquisition_mode (str): One of ACQUISITION_MODES.
+        max_hold_time (float): Seconds each segment is held in max hold.
+        rbw_config_val (str): The instrument RBW setting (e.g. "1KHZ"), which sets the sweep time.
+    Returns:
+        ScanPlan: The band's segments, VISA round trips, bytes transferred, data points and scan time.
+    """
+    band_span_hz = max((band["Stop MHz"] - band["Start MHz"]) * MHZ_TO_HZ, 0)
+    segment_span_hz = segment_span_for_mode(step_hz, acquisition_mode)
+    segment_count = max(1, int(np.ceil(band_span_hz / segment_span_hz)))
+    point_count = estimate_scan_point_count([band], step_hz)
+    try:
+        rbw_hz = parse_scpi_number(rbw_config_val)
+    except (ValueError, AttributeError):
+        rbw_hz = None
+
+    # The band's sweep time is asked once; each segment's start and stop go out with its first sweep
+    round_trips = 1
+    sweep_count = 0
+    trace_count = 0
+    sweep_seconds_total = 0.0
+    marker_count = 0
+
+    if acquisition_mode == "Adaptive":
+        # Coarse pass: one wide trace per segment, swept with the widest supported RBW within the coarse point spacing
+        coarse_step_hz = step_hz * ADAPTIVE_COARSE_STEP_FACTOR
+        coarse_sweep_seconds = estimate_sweep_seconds(segment_span_hz, supported_rbw_at_or_below(coarse_step_hz))
+        coarse_sweeps = segment_count * estimate_sweeps_per_segment(coarse_sweep_seconds, max_hold_time)
+        sweep_count += coarse_sweeps
+        sweep_seconds_total += coarse_sweeps * coarse_sweep_seconds
+        trace_count += segment_count
+        # Fine pass: full-resolution traces over the share of the band assumed to hold signals
+        fine_span_hz = step_hz * (TRACE_SWEEP_POINTS - 1)
+        fine_trace_count = int(np.ceil(band_span_hz * ESTIMATED_ADAPTIVE_SIGNAL_FRACTION / fine_span_hz))
+        if fine_trace_count > 0:
+            fine_sweep_seconds = estimate_sweep_seconds(fine_span_hz, rbw_hz)
+            fine_sweeps = fine_trace_count * estimate_sweeps_per_segment(fine_sweep_seconds, max_hold_time)
+            round_trips += 1 # The fine sweep time is asked once
+            sweep_count += fine_sweeps
+            sweep_seconds_total += fine_sweeps * fine_sweep_seconds
+            trace_count += fine_trace_count
+        # Coarse points where the band is empty, fine points where the signals are
+        coarse_point_count = estimate_scan_point_count([band], coarse_step_hz)
+        point_count = int(round(point_count * ESTIMATED_ADAPTIVE_SIGNAL_FRACTION + coarse_point_count * (1 - ESTIMATED_ADAPTIVE_SIGNAL_FRACTION)))
+    else:
+        sweep_seconds = estimate_sweep_seconds(segment_span_hz, rbw_hz)
+        sweep_count = segment_count * estimate_sweeps_per_segment(sweep_seconds, max_hold_time)
+        sweep_seconds_total = sweep_count * sweep_seconds
+        if acquisition_mode == "Trace":
+            trace_count = segment_count
+        else:
+            # One exchange per batch of markers; every segment but the last is a full TRACE_SWEEP_POINTS - 1 points
+            full_segment_points = TRACE_SWEEP_POINTS - 1
+            last_segment_points = max(point_count - (segment_count - 1) * full_segment_points, 0)
+            round_trips += (segment_count - 1) * int(np.ceil(full_segment_points / MARKERS_PER_BATCH)) + int(np.ceil(last_segment_points / MARKERS_PER_BATCH))
+            marker_count = point_count
+
+    round_trips += sweep_count
+    return ScanPlan(
+        segments=segment_count,
+        round_trips=round_trips + trace_count,
+        bytes_transferred=round_trips * ESTIMATED_MESSAGE_BYTES + marker_count * ESTIMATED_MARKER_BYTES + trace_count * ESTIMATED_TRACE_BYTES,
+        points=point_count,
+        scan_seconds=sweep_seconds_total + round_trips * ESTIMATED_ROUND_TRIP_SECONDS + trace_count * ESTIMATED_TRACE_TRANSFER_SECONDS,
+    )
+
+
+def partition_bands(selected_bands, partition_count, band_seconds):
+    """
+    Splits the bands into partition_count groups of about equal total scan time, using the
+    longest-processing-time-first rule: bands are handed out longest first, each to the group
+    with the least time so far.
+    Args:
+        selected_bands (list): Band dictionaries.
+        partition_count (int): Number of groups (instruments).
+        band_seconds (list): Estimated scan time of each band.
+    Returns:
+        list: One list of band indices per group, each in ascending (scan) order.
+              Groups that received no band are left out.
+    """
+    group_heap = [(0.0, group_idx) for group_idx in range(partition_count)]
+    groups = [[] for _ in range(partition_count)]
+    for band_idx in sorted(range(len(selected_bands)), key=lambda idx: band_seconds[idx], reverse=True):
+        group_seconds, group_idx = heapq.heappop(group_heap)
+        groups[group_idx].append(band_idx)
+        heapq.heappush(group_heap, (group_seconds + band_seconds[band_idx], group_idx))
+    return [sorted(group) for group in groups if group]
+
+def plan_scan(selected_bands, step_hz, acquisition_mode, max_hold_time, rbw_config_val, instrument_count=1):
+    """
+    Predicts what one scan cycle of the selected bands costs (see plan_band_scan), before starting it.
+    With several instruments the bands are split as run_multi_instrument_scan_logic splits them,
+    and the scan takes as long as the slowest instrument's share.
+    Args:
+        selected_bands (list): Band dictionaries with 'Start MHz' and 'Stop MHz'.
+        step_hz (float): Grid step in Hz (the RBW step size).
+        acquisition_mode (str): One of ACQUISITION_MODES.
+        max_hold_time (float): Seconds each segment is held in max hold.
+        rbw_config_val (str): The instrument RBW setting (e.g. "1KHZ").
+        instrument_count (int): Number of analyzers scanning in parallel.
+    Returns:
+        ScanPlan: Totals for the cycle; scan_seconds is the predicted wall time of the scan (without the cycle wait).
+    """
+    band_plans = [plan_band_scan(band, step_hz, acquisition_mode, max_hold_time, rbw_config_val) for band in selected_bands]
+    band_seconds = [band_plan.scan_seconds for band_plan in band_plans]
+    partitions = partition_bands(selected_bands, max(1, instrument_count), band_seconds)
+    # Every instrument is reset and configured at the start of the cycle and reset again at its end
+    setup_round_trips = ESTIMATED_CYCLE_SETUP_ROUND_TRIPS * max(1, len(partitions))
+    return ScanPlan(
+        segments=sum(band_plan.segments for band_plan in band_plans),
+        round_trips=sum(band_plan.round_trips for band_plan in band_plans) + setup_round_trips,
+        bytes_transferred=sum(band_plan.bytes_transferred for band_plan in band_plans) + setup_round_trips * ESTIMATED_MESSAGE_BYTES,
+        points=sum(band_plan.points for band_plan in band_plans),
+        scan_seconds=max((sum(band_seconds[band_idx] for band_idx in group) for group in partitions), default=0.0)
+                     + ESTIMATED_CYCLE_SETUP_ROUND_TRIPS * ESTIMATED_ROUND_TRIP_SECONDS,
+    )
+
+
+def solve_step_size_for_cycle_time(selected_bands, target_cycle_seconds, cycle_wait_time, acquisition_mode, max_hold_time, rbw_config_val, instrument_count=1):
+    """
+    Finds the finest RBW step size whose planned scan, plus the wait between cycles, fits inside
+    target_cycle_seconds. The predicted time doesn't only grow as the step gets finer: with a fixed RBW
+    a coarser step also means wider segments, and each sweep takes longer (see estimate_sweep_seconds).
+    So every candidate step is planned, from the finest up, and the first one that fits is taken.
+    The candidates are the multiples of CSV_FREQUENCY_RESOLUTION_HZ, the finest grid the CSV files can hold,
+    up to the step that scans the widest band in a single segment.
+    Args:
+        selected_bands (list): Band dictionaries with 'Start MHz' and 'Stop MHz'.
+        target_cycle_seconds (float): The cycle time to fit in (scan plus cycle wait).
+        cycle_wait_time (float): Wait between cycles in seconds.
+        The remaining arguments are as for plan_scan.
+    Returns:
+        int: The finest step size in Hz, or None if no candidate step fits.
+    """
+    scan_budget_seconds = target_cycle_seconds - cycle_wait_time
+    widest_span_hz = max((band["Stop MHz"] - band["Start MHz"]) * MHZ_TO_HZ for band in selected_bands)
+    coarsest_step_count = max(1, int(np.ceil(widest_span_hz / segment_span_for_mode(CSV_FREQUENCY_RESOLUTION_HZ, acquisition_mode))))
+    for step_count in range(1, coarsest_step_count + 1):
+        step_hz = step_count * CSV_FREQUENCY_RESOLUTION_HZ
+        if plan_scan(selected_bands, step_hz, acquisition_mode, max_hold_time, rbw_config_val, instrument_count).scan_seconds <= scan_budget_seconds:
+            return step_hz
+    return None
+
+
+def describe_scan_plan(scan_plan, cycle_wait_time):
+    """
+    Formats a ScanPlan for the GUI and the console.
+    Args:
+        scan_plan (ScanPlan): The plan from plan_scan.
+        cycle_wait_time (float): Wait between cycles in seconds.
+    Returns:
+        str: Two lines: the segment, round trip, data and point counts, then the scan and cycle times.
+    """
+    return (
+        f"{scan_plan.segments} segments | {scan_plan.round_trips} VISA round trips | "
+        f"{scan_plan.bytes_transferred / 1e6:.2f} MB | {scan_plan.points} points\n"
+        f"Predicted scan {format_duration(scan_plan.scan_seconds)} | cycle {format_duration(scan_plan.scan_seconds + cycle_wait_time)} (with wait)"
+    )
+
+
+class ScanDataBuffer:
+    """
+    Columnar in-memory store for scan results.
+    Frequencies (float64, MHz), levels (float32, dBm), a band index (int16) and the acquisition
+    time (float64, Unix seconds) are kept in preallocated NumPy arrays that scan_bands fills in
+    place, instead of one dictionary per data point. Band names are stored once and referenced by index.
+    """
+
+    def __init__(self, band_names, initial_capacity=0):
+        """
+        Args:
+            band_names (list): Names of the bands in scan order; their positions are the band indices.
+            initial_capacity (int): Number of points to preallocate (the buffer grows if exceeded).
+        """
+        self.band_names = list(band_names)
+        self._band_indices = {band_name: band_idx for band_idx, band_name in enumerate(self.band_names)}
+        capacity = max(int(initial_capacity), 1024)
+        self.frequency_mhz = np.empty(capacity, dtype=np.float64)
+        self.level_dbm = np.empty(capacity, dtype=np.float32)
+        self.band_index = np.empty(capacity, dtype=np.int16)
+        self.timestamp = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _band_index_for(self, band_name):
+        if band_name not in self._band_indices:
+            self._band_indices[band_name] = len(self.band_names)
+            self.band_names.append(band_name)
+        return self._band_indices[band_name]
+
+    def _ensure_capacity(self, required_size):
+        capacity = self.frequency_mhz.size
+        if required_size <= capacity:
+            return
+        # Grow geometrically so repeated appends stay amortized O(1)
+        new_capacity = max(required_size, capacity * 2)
+        for column_name in ("frequency_mhz", "level_dbm", "band_index", "timestamp"):
+            old_column = getattr(self, column_name)
+            new_column = np.empty(new_capacity, dtype=old_column.dtype)
+            new_column[:self.size] = old_column[:self.size]
+            setattr(self, column_name, new_column)
+
+    def append(self, frequencies_mhz, levels_dbm, band_name, acquired_at=None):
+        """
+        Appends a block of points (e.g. one segment) belonging to one band.
+        Args:
+            frequencies_mhz (array-like): Frequencies in MHz.
+            levels_dbm (array-like): Levels in dBm, same length as frequencies_mhz.
+            band_name (str): Name of the band the points belong to.
+            acquired_at (float): Unix time the block was acquired. Defaults to now; NaN if unknown.
+        """
+        point_count = len(frequencies_mhz)
+        if point_count == 0:
+            return
+        start, stop = self.size, self.size + point_count
+        self._ensure_capacity(stop)
+        self.frequency_mhz[start:stop] = frequencies_mhz
+        self.level_dbm[start:stop] = levels_dbm
+        self.band_index[start:stop] = self._band_index_for(band_name)
+        self.timestamp[start:stop] = time.time() if acquired_at is None else acquired_at
+        self.size = stop
+
+    def view(self, start=0, stop=None):
+        """
+        Returns views (no copies) of the filled columns between two point indices.
+        Returns:
+            tuple: (frequency_mhz, level_dbm, band_index) NumPy array views.
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        return self.frequency_mhz[start:stop], self.level_dbm[start:stop], self.band_index[start:stop]
+
+    def to_dataframe(self):
+        """
+        Wraps the filled columns in a DataFrame with 'Frequency (MHz)', 'Level (dBm)' and a
+        categorical 'Band Name' column. The numeric columns share memory with the buffer.
+        Returns:
+            pd.DataFrame: The scan data.
+        """
+        import pandas as pd
+
+        frequency_mhz, level_dbm, band_index = self.view()
+        band_name_column = pd.Categorical.from_codes(band_index, categories=self.band_names)
+        return pd.DataFrame({
+            "Frequency (MHz)": frequency_mhz,
+            "Level (dBm)": level_dbm,
+            "Band Name": band_name_column,
+        }, copy=False)
+
+
+def merge_scan_data(band_names, part_scan_data):
+    """
+    Combines buffers that each hold some of the bands (e.g. one per instrument) into one buffer,
+    with the bands in band_names order.
+    Args:
+        band_names (list): Names of all the bands, in scan order.
+        part_scan_data (list): ScanDataBuffer objects to merge.
+    Returns:
+        ScanDataBuffer: The merged data.
+    """
+    merged_data = ScanDataBuffer(band_names, sum(len(part_data) for part_data in part_scan_data))
+    for band_name in band_names:
+        for part_data in part_scan_data:
+            if band_name not in part_data.band_names:
+                continue
+            frequency_mhz, level_dbm, band_index = part_data.view()
+            in_band = band_index == part_data.band_names.index(band_name)
+            merged_data.append(frequency_mhz[in_band], level_dbm[in_band], band_name, acquired_at=part_data.timestamp[:len(part_data)][in_band])
+    return merged_data
+
+
+def cycle_start_time_from_filename(cycle_filename):
+    """
+    Reads a cycle's start time from its file name (<series>_YYYYMMDD@HHMM.csv, .npz or .partN.csv).
+    Args:
+        cycle_filename (str): The cycle file's name or path.
+    Returns:
+        float: The Unix time (to the minute), or None if the name holds no time.
+    """
+    time_match = re.search(r"_(\d{8}@\d{4})(?:\.part\d+)?\.(?:csv|npz)$", os.path.basename(cycle_filename), re.IGNORECASE)
+    return datetime.strptime(time_match.group(1), "%Y%m%d@%H%M").timestamp() if time_match else None
+
+
+class StreamingScanWriter:
+    """
+    Append-only CSV writer for one scan cycle.
+    scan_bands hands it each segment as soon as the segment is acquired. The file is
+    flushed and fsync'ed every flush_interval_seconds, and after each sync a checkpoint
+    file (<csv>.checkpoint.json) records the last durable band, segment, frequency and
+    file offset, so an interrupted cycle can be resumed at segment granularity.
+    The checkpoint also keeps the cycle's start time (cycle_start_time), so a resumed cycle
+    keeps the time it was started at, not the time it was resumed.
+    """
+
+    def __init__(self, csv_filename, band_names, rbw_step_size_hz, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS, checkpoint=None, segment_span_hz=None):
+        """
+        Args:
+            csv_filename (str): Path of the cycle's CSV file.
+            band_names (list): Names of the selected bands, in scan order.
+            rbw_step_size_hz (float): Grid step of the scan (recorded so a resume uses the same grid).
+            segment_span_hz (float): Segment span of the scan (recorded so a resume uses the same segments).
+                                     Defaults to the "Marker"/"Trace" span (see segment_span_for_mode).
+            flush_interval_seconds (float): Minimum time between fsyncs (0 syncs after every segment).
+            checkpoint (dict): A checkpoint from find_scan_checkpoint to resume, or None to start a new file.
+        """
+        self.csv_filename = csv_filename
+        self.checkpoint_filename = csv_filename + CHECKPOINT_FILE_SUFFIX
+        self.band_names = list(band_names)
+        self.rbw_step_size_hz = rbw_step_size_hz
+        self.segment_span_hz = segment_span_hz if segment_span_hz is not None else segment_span_for_mode(rbw_step_size_hz, "Trace")
+        self.flush_interval_seconds = flush_interval_seconds
+
+        if checkpoint:
+            # Drop anything written after the last checkpoint; those segments will be scanned again
+            self._file = open(csv_filename, 'r+b')
+            self._file.truncate(checkpoint["file_offset"])
+            self._file.seek(checkpoint["file_offset"])
+            self.rows_written = checkpoint["rows_written"]
+            self.band_start_rows = {int(band_idx): first_row for band_idx, first_row in checkpoint["band_start_rows"].items()}
+            self._position = {key: checkpoint[key] for key in ("band_index", "segment_index", "band_complete", "last_frequency_mhz")}
+            # Checkpoints written before the start time was recorded: the file name has it to the minute
+            self.cycle_start_time = checkpoint.get("cycle_start_time") or cycle_start_time_from_filename(csv_filename) or time.time()
+        else:
+            self._file = open(csv_filename, 'wb')
+            self.rows_written = 0
+            self.band_start_rows = {}
+            self._position = None
+            self.cycle_start_time = time.time()
+        self._last_sync_time = time.monotonic()
+
+    def write_segment(self, band_index, segment_index, band_complete, frequencies_mhz, levels_dbm):
+        """
+        Appends one acquired segment to the CSV file.
+        Args:
+            band_index (int): Index of the band in the selected bands.
+            segment_index (int): Zero-based index of the segment within the band.
+            band_complete (bool): True if this was the band's last segment.
+            frequencies_mhz (numpy.ndarray): Segment frequencies in MHz.
+            levels_dbm (numpy.ndarray): Segment levels in dBm.
+        """
+        if band_index not in self.band_start_rows:
+            self.band_start_rows[band_index] = self.rows_written
+        if len(frequencies_mhz) > 0:
+            # Same "%.2f,%.2f" rows (and \r\n line ending) the csv module produced
+            rows = "".join(f"{freq_mhz:.2f},{level_dbm:.2f}\r\n" for freq_mhz, level_dbm in zip(np.asarray(frequencies_mhz).tolist(), np.asarray(levels_dbm).tolist()))
+            self._file.write(rows.encode('ascii'))
+            self.rows_written += len(frequencies_mhz)
+        self._position = {
+            "band_index": band_index,
+            "segment_index": segment_index,
+            "band_complete": bool(band_complete),
+            "last_frequency_mhz": float(frequencies_mhz[-1]) if len(frequencies_mhz) > 0 else None,
+        }
+        if time.monotonic() - self._last_sync_time >= self.flush_interval_seconds:
+            self.sync()
+
+    def sync(self):
+        """Flushes and fsyncs the CSV file, then records the checkpoint for what is now on disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync_time = time.monotonic()
+        if self._position is None:
+            return
+        checkpoint = dict(self._position)
+        checkpoint.update({
+            "csv_filename": self.csv_filename,
+            "band_names": self.band_names,
+            "rbw_step_size_hz": self.rbw_step_size_hz,
+            "segment_span_hz": self.segment_span_hz,
+            "cycle_start_time": self.cycle_start_time,
+            "file_offset": self._file.tell(),
+            "rows_written": self.rows_written,
+            "band_start_rows": {str(band_idx): first_row for band_idx, first_row in self.band_start_rows.items()},
+            "updated": datetime.now().isoformat(timespec="seconds"),
+        })
+        # Write to a temporary file and rename so a crash never leaves a half-written checkpoint
+        temp_filename = self.checkpoint_filename + ".tmp"
+        with open(temp_filename, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_filename, self.checkpoint_filename)
+
+    def load_written_data(self):
+        """
+        Reads back the rows already in the file (e.g. from before a resume) into a ScanDataBuffer,
+        so the cycle's plot still covers the whole scan.
+        Returns:
+            ScanDataBuffer: The previously written data points.
+        """
+        written_data = ScanDataBuffer(self.band_names, self.rows_written)
+        if self.rows_written == 0:
+            return written_data
+        self._file.flush()
+        rows = np.loadtxt(self.csv_filename, delimiter=',', ndmin=2, max_rows=self.rows_written)
+        band_starts = sorted(self.band_start_rows.items(), key=lambda item: item[1])
+        for position, (band_idx, first_row) in enumerate(band_starts):
+            last_row = band_starts[position + 1][1] if position + 1 < len(band_starts) else self.rows_written
+            # The CSV does not record acquisition times
+            written_data.append(rows[first_row:last_row, 0], rows[first_row:last_row, 1], self.band_names[band_idx], acquired_at=np.nan)
+        return written_data
+
+    def close(self, scan_complete):
+        """
+        Closes the CSV file.
+        Args:
+            scan_complete (bool): True if the cycle finished; its checkpoint is then removed.
+                                  Otherwise the checkpoint is kept so the cycle can be resumed.
+        """
+        if self._file.closed:
+            return
+        if scan_complete:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            if os.path.exists(self.checkpoint_filename):
+                os.remove(self.checkpoint_filename)
+        else:
+            self.sync()
+            self._file.close()
+
+
+def save_scan_npz(npz_filename, scan_data, scan_metadata):
+    """
+    Saves a cycle's data in binary NumPy .npz form alongside the CSV.
+    The archive holds the columns 'frequency_mhz' (float64), 'level_dbm' (float32),
+    'band_index' (int16) and 'timestamp' (float64 Unix seconds), the 'band_names' lookup,
+    and a 'metadata' JSON string with the scan settings (RBW, VBW, reference level, preamp, ...).
+    It is stored uncompressed so it loads as fast as the disk can read it.
+
+    Args:
+        npz_filename (str): Path of the .npz file to write.
+        scan_data (ScanDataBuffer): The cycle's data.
+        scan_metadata (dict): JSON-serializable scan settings.
+    """
+    frequency_mhz, level_dbm, band_index = scan_data.view()
+    np.savez(
+        npz_filename,
+        frequency_mhz=frequency_mhz,
+        level_dbm=level_dbm,
+        band_index=band_index,
+        timestamp=scan_data.timestamp[:len(scan_data)],
+        band_names=np.array(scan_data.band_names, dtype=str),
+        metadata=np.array(json.dumps(scan_metadata)),
+    )
+    print(f"💾 Binary scan data saved to: {npz_filename}")
+
+
+def load_scan_file(filename):
+    """
+    Loads one cycle's scan data from either of the output formats.
+    Args:
+        filename (str): A cycle .csv (two columns: frequency MHz, level dBm) or .npz file.
+    Returns:
+        tuple: (pd.DataFrame, dict) The data with 'Frequency (MHz)' and 'Level (dBm)' columns
+               (plus 'Band Name' and 'Timestamp' for .npz files), and the scan metadata
+               (empty for CSV files).
+    """
+    import pandas as pd
+
+    if filename.lower().endswith(".npz"):
+        with np.load(filename) as archive:
+            scan_df = pd.DataFrame({
+                "Frequency (MHz)": archive["frequency_mhz"],
+                "Level (dBm)": archive["level_dbm"],
+                "Band Name": pd.Categorical.from_codes(archive["band_index"], categories=archive["band_names"].tolist()),
+                "Timestamp": pd.to_datetime(archive["timestamp"], unit="s"),
+            })
+            scan_metadata = json.loads(str(archive["metadata"]))
+        return scan_df, scan_metadata
+    scan_df = pd.read_csv(filename, header=None, names=["Frequency (MHz)", "Level (dBm)"], usecols=[0, 1],
+                          dtype={"Frequency (MHz)": np.float64, "Level (dBm)": np.float32})
+    return scan_df, {}
+
+
+class ScanStatistics:
+    """
+    Running statistics of a scan series per frequency bin, updated after each cycle in O(points)
+    and saved in the series folder, so long-term averages, max hold over days and variability are
+    available at once, without rereading the cycle files.
+    Per bin it keeps the number of cycles, the mean and M2 (Welford's running variance), the minimum
+    and maximum level, and optionally a histogram of the levels (STATISTICS_HISTOGRAM_* dB steps) for percentiles.
+    Each cycle contributes one level per bin: the highest of its points in the bin.
+    """
+
+    def __init__(self, filename, bin_hz, level_histograms=False):
+        """
+        Opens the statistics file of a scan series, or starts a new one if it doesn't exist yet.
+        Args:
+            filename (str): The statistics .npz file (<series>_statistics.npz in the series folder).
+            bin_hz (float): Width of the frequency bins, normally the RBW step size. An existing file keeps its own.
+            level_histograms (bool): Whether to keep level histograms (percentile()). An existing file keeps its own choice.
+        """
+        self.filename = filename
+        self.bin_hz = float(bin_hz)
+        self.cycles = 0
+        self.last_cycle_file = None
+        self.bin_keys = np.empty(0, dtype=np.int64) # Bin centers as multiples of bin_hz, sorted
+        self.count = np.empty(0, dtype=np.int64)
+        self.mean = np.empty(0, dtype=np.float64)
+        self.m2 = np.empty(0, dtype=np.float64)
+        self.min = np.empty(0, dtype=np.float32)
+        self.max = np.empty(0, dtype=np.float32)
+        self.histogram = np.empty((0, STATISTICS_HISTOGRAM_BINS), dtype=np.uint32) if level_histograms else None
+        if os.path.exists(filename):
+            try:
+                self._load()
+            except (OSError, ValueError, KeyError) as e:
+                # Keep the unreadable file for inspection instead of overwriting it
+                os.replace(filename, filename + ".bad")
+                print(f"⚠️ Could not read the scan statistics {filename} ({e}); moved it to {filename}.bad and starting new statistics.")
+
+    def _load(self):
+        """Reads the statistics from self.filename."""
+        with np.load(self.filename) as archive:
+            metadata = json.loads(str(archive["metadata"]))
+            self.bin_hz = metadata["bin_hz"]
+            self.cycles = metadata["cycles"]
+            self.last_cycle_file = metadata["last_cycle_file"]
+            self.bin_keys = archive["bin_keys"]
+            self.count = archive["count"]
+            self.mean = archive["mean_dbm"]
+            self.m2 = archive["m2"]
+            self.min = archive["min_dbm"]
+            self.max = archive["max_dbm"]
+            self.histogram = archive["histogram"] if "histogram" in archive else None
+        print(f"📊 Loaded scan statistics of {self.cycles} cycles ({len(self.bin_keys)} frequency bins) from {self.filename}")
+
+    def _add_bins(self, new_keys):
+        """Inserts empty bins for new_keys (sorted, none of them present yet), keeping the bins sorted."""
+        all_keys = np.union1d(self.bin_keys, new_keys)
+        old_positions = np.searchsorted(all_keys, self.bin_keys)
+
+        def grown(column, fill_value):
+            new_column = np.full((len(all_keys),) + column.shape[1:], fill_value, dtype=column.dtype)
+            new_column[old_positions] = column
+            return new_column
+
+        self.count = grown(self.count, 0)
+        self.mean = grown(self.mean, 0)
+        self.m2 = grown(self.m2, 0)
+        self.min = grown(self.min, np.inf)
+        self.max = grown(self.max, -np.inf)
+        if self.histogram is not None:
+            self.histogram = grown(self.histogram, 0)
+        self.bin_keys = all_keys
+
+    def update(self, scan_data, cycle_file):
+        """
+        Adds a completed cycle.
+        Args:
+            scan_data (ScanDataBuffer): The cycle's data.
+            cycle_file (str): The cycle's CSV file name (saved as the last cycle added).
+        Returns:
+            bool: Whether the cycle was added (False if it holds no measured points).
+        """
+        if not scan_data:
+            return False
+        frequency_mhz, level_dbm, _ = scan_data.view()
+        measured = ~np.isnan(level_dbm)
+        keys = np.rint(frequency_mhz[measured] * MHZ_TO_HZ / self.bin_hz).astype(np.int64)
+        levels = level_dbm[measured].astype(np.float64)
+        if keys.size == 0:
+            return False
+
+        # One level per bin for this cycle: the highest of its points in the bin
+        order = np.argsort(keys, kind='stable')
+        keys, levels = keys[order], levels[order]
+        bin_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        cycle_keys = keys[bin_starts]
+        cycle_levels = np.maximum.reduceat(levels, bin_starts)
+
+        new_keys = np.setdiff1d(cycle_keys, self.bin_keys, assume_unique=True)
+        if new_keys.size:
+            self._add_bins(new_keys)
+        bins = np.searchsorted(self.bin_keys, cycle_keys)
+
+        # Welford's update, for every bin of the cycle at once
+        self.count[bins] += 1
+        delta = cycle_levels - self.mean[bins]
+        self.mean[bins] += delta / self.count[bins]
+        self.m2[bins] += delta * (cycle_levels - self.mean[bins])
+        self.min[bins] = np.minimum(self.min[bins], cycle_levels)
+        self.max[bins] = np.maximum(self.max[bins], cycle_levels)
+        if self.histogram is not None:
+            self.histogram[bins, self._histogram_bin(cycle_levels)] += 1
+
+        self.cycles += 1
+        self.last_cycle_file = cycle_file
+        return True
+
+    @staticmethod
+    def _histogram_bin(levels_dbm):
+        """Histogram bin of each level (levels outside the histogram range go to its first or last bin)."""
+        histogram_bins = np.floor((levels_dbm - STATISTICS_HISTOGRAM_MIN_DBM) / STATISTICS_HISTOGRAM_STEP_DB).astype(np.int64)
+        return np.clip(histogram_bins, 0, STATISTICS_HISTOGRAM_BINS - 1)
+
+    def frequencies_mhz(self):
+        """Returns the center frequency (MHz) of every bin."""
+        return self.bin_keys * self.bin_hz / MHZ_TO_HZ
+
+    def std(self):
+        """Returns the standard deviation (dB) of the cycles' levels in every bin (NaN with fewer than two cycles)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(np.where(self.count > 1, self.m2 / (self.count - 1), np.nan))
+
+    def percentile(self, percent):
+        """
+        Estimates a percentile of the cycles' levels in every bin from the level histograms,
+        to the histogram step (the center of the histogram bin it falls in).
+        Args:
+            percent (float): The percentile, 0 to 100.
+        Returns:
+            numpy.ndarray: The level (dBm) per frequency bin.
+        """
+        if self.histogram is None:
+            raise ValueError("These statistics have no level histograms.")
+        cumulative_counts = np.cumsum(self.histogram, axis=1)
+        rank = np.maximum(np.ceil(self.count * percent / 100), 1)
+        histogram_bins = np.argmax(cumulative_counts >= rank[:, np.newaxis], axis=1)
+        return STATISTICS_HISTOGRAM_MIN_DBM + (histogram_bins + 0.5) * STATISTICS_HISTOGRAM_STEP_DB
+
+    def to_dataframe(self):
+        """
+        Returns:
+            pd.DataFrame: 'Frequency (MHz)', 'Cycles', 'Mean (dBm)', 'Std (dB)', 'Min (dBm)' and 'Max (dBm)' per bin,
+                          plus a 'P<n> (dBm)' column for each of STATISTICS_PERCENTILES with level histograms.
+        """
+        import pandas as pd
+
+        columns = {
+            "Frequency (MHz)": self.frequencies_mhz(),
+            "Cycles": self.count,
+            "Mean (dBm)": self.mean,
+            "Std (dB)": self.std(),
+            "Min (dBm)": self.min,
+            "Max (dBm)": self.max,
+        }
+        if self.histogram is not None:
+            for percent in STATISTICS_PERCENTILES:
+                columns[f"P{percent} (dBm)"] = self.percentile(percent)
+        return pd.DataFrame(columns)
+
+    def save(self):
+        """Writes the statistics file, replacing the previous one only once the new one is complete."""
+        columns = {
+            "bin_keys": self.bin_keys,
+            "frequency_mhz": self.frequencies_mhz(),
+            "count": self.count,
+            "mean_dbm": self.mean,
+            "m2": self.m2,
+            "min_dbm": self.min,
+            "max_dbm": self.max,
+        }
+        if self.histogram is not None:
+            columns["histogram"] = self.histogram
+        metadata = {
+            "bin_hz": self.bin_hz,
+            "cycles": self.cycles,
+            "last_cycle_file": self.last_cycle_file,
+            "histogram_min_dbm": STATISTICS_HISTOGRAM_MIN_DBM,
+            "histogram_step_db": STATISTICS_HISTOGRAM_STEP_DB,
+            "saved": datetime.now().isoformat(timespec="seconds"),
+        }
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "wb") as statistics_file:
+            np.savez(statistics_file, metadata=np.array(json.dumps(metadata)), **columns)
+        os.replace(temporary_filename, self.filename)
+        print(f"📊 Scan statistics of {self.cycles} cycles ({len(self.bin_keys)} frequency bins) saved to {self.filename}")
+
+
+# A frequency/time window read from the spectrum store (see SpectrumStore.query):
+#   cycle_times     - Unix time each cycle started (one per row, ascending)
+#   frequencies_mhz - Center frequency (MHz) of each frequency bin (one per column)
+#   levels_dbm      - float32 matrix of levels, cycles x frequency bins (NaN where the cycle measured nothing)
+SpectrumWindow = namedtuple("SpectrumWindow", ["cycle_times", "frequencies_mhz", "levels_dbm"])
+
+
+class SpectrumStore:
+    """
+    An SQLite file holding every cycle of every scan series, indexed by (series, cycle time, frequency bin),
+    so any frequency/time window can be read back as a matrix in milliseconds (see query), without
+    finding and parsing the cycle files.
+    Each series has a fixed frequency bin width (the RBW step size of its first stored cycle); a cycle's
+    points are binned to it, keeping the highest level of a cycle per bin (as ScanStatistics does).
+    The bins of a cycle are stored in blocks of STORE_CHUNK_BINS consecutive bins (one row per block,
+    with the bins' offsets and levels as binary columns), clustered by (series, block, cycle time),
+    so a query only reads the blocks of its frequency range over its time range.
+    Cycles older than retention_days are deleted as new cycles are added; the file keeps its size
+    and reuses the freed pages, so it stops growing once it holds retention_days of cycles.
+    """
+
+    def __init__(self, filename, retention_days=STORE_RETENTION_DAYS):
+        """
+        Opens (or creates) the store. Connections can't be shared between threads; open one per thread.
+        Args:
+            filename (str): The store's SQLite file (normally STORE_FILENAME in the "N9340 Scans" folder).
+            retention_days (float): Age in days after which cycles are deleted (0 keeps every cycle).
+        """
+        self.filename = filename
+        self.retention_days = retention_days
+        self.bin_mismatch_warned = set() # Series already warned about a step size different from their bins
+        self.connection = sqlite3.connect(filename)
+        # Write-ahead logging lets queries read the store while a scan appends to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS series (name TEXT PRIMARY KEY, bin_hz REAL NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cycles (series TEXT, cycle_time REAL, cycle_file TEXT, points INTEGER, "
+                                    "PRIMARY KEY (series, cycle_time)) WITHOUT ROWID")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS chunks (series TEXT, chunk INTEGER, cycle_time REAL, offsets BLOB, levels BLOB, "
+                                    "PRIMARY KEY (series, chunk, cycle_time)) WITHOUT ROWID")
+
+    def close(self):
+        """Closes the connection."""
+        self.connection.close()
+
+    def series_bin_hz(self, series):
+        """Returns the frequency bin width (Hz) of a series, or None if it has no stored cycles."""
+        row = self.connection.execute("SELECT bin_hz FROM series WHERE name = ?", (series,)).fetchone()
+        return row[0] if row else None
+
+    def append(self, series, scan_data, cycle_file, bin_hz, cycle_time=None):
+        """
+        Stores a completed cycle. Storing a cycle with the same start time again replaces it.
+        Args:
+            series (str): The scan series (its folder name).
+            scan_data (ScanDataBuffer): The cycle's data.
+            cycle_file (str): The cycle's CSV file name.
+            bin_hz (float): Frequency bin width for a new series (normally the RBW step size).
+            cycle_time (float): Unix time the cycle started (StreamingScanWriter.cycle_start_time), or None for the
+                                time of its first measured point. Points read back after a resume have no time,
+                                so a resumed cycle needs its start time passed in.
+        Returns:
+            float: The cycle time, or None if the cycle holds no points.
+        """
+        frequency_mhz, level_dbm, _ = scan_data.view()
+        if cycle_time is None:
+            acquired_at = scan_data.timestamp[:len(scan_data)]
+            cycle_time = float(np.nanmin(acquired_at)) if np.any(~np.isnan(acquired_at)) else time.time()
+        return self.append_points(series, frequency_mhz, level_dbm, cycle_time, cycle_file, bin_hz)
+
+    def append_points(self, series, frequencies_mhz, levels_dbm, cycle_time, cycle_file, bin_hz):
+        """
+        Stores one cycle's points (see append).
+        Args:
+            series (str): The scan series.
+            frequencies_mhz (numpy.ndarray): Frequencies in MHz.
+            levels_dbm (numpy.ndarray): The level (dBm) of every frequency.
+            cycle_time (float): Unix time the cycle started.
+            cycle_file (str): The cycle's file name.
+            bin_hz (float): Frequency bin width for a new series.
+        Returns:
+            float: The cycle time, or None if the cycle holds no points (or is older than the retention).
+        """
+        retention_cutoff_time = self._retention_cutoff_time()
+        if cycle_time < retention_cutoff_time:
+            return None
+        series_bin_hz = self.series_bin_hz(series) or float(bin_hz)
+        if not np.isclose(series_bin_hz, bin_hz) and series not in self.bin_mismatch_warned:
+            self.bin_mismatch_warned.add(series)
+            print(f"⚠️ {series} is stored in {series_bin_hz:g} Hz bins (its first stored cycle); cycles scanned with a {float(bin_hz):g} Hz step "
+                  f"are re-binned to them{', losing resolution' if bin_hz < series_bin_hz else ''}. Use a new series name to store them at their own step.")
+        measured = ~np.isnan(levels_dbm)
+        keys = np.rint(np.asarray(frequencies_mhz)[measured] * MHZ_TO_HZ / series_bin_hz).astype(np.int64)
+        levels = np.asarray(levels_dbm)[measured].astype(np.float32)
+        if keys.size == 0:
+            return None
+
+        # One level per bin: the highest of the cycle's points in the bin
+        order = np.argsort(keys, kind='stable')
+        keys, levels = keys[order], levels[order]
+        bin_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        keys, levels = keys[bin_starts], np.maximum.reduceat(levels, bin_starts)
+
+        chunks = keys // STORE_CHUNK_BINS
+        chunk_starts = np.flatnonzero(np.r_[True, chunks[1:] != chunks[:-1], True])
+        chunk_rows = [
+            (series, int(chunks[first]), cycle_time,
+             (keys[first:stop] - chunks[first] * STORE_CHUNK_BINS).astype(np.uint16).tobytes(),
+             levels[first:stop].tobytes())
+            for first, stop in zip(chunk_starts[:-1], chunk_starts[1:])
+        ]
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO series (name, bin_hz) VALUES (?, ?)", (series, series_bin_hz))
+            self.connection.execute("DELETE FROM chunks WHERE series = ? AND cycle_time = ?", (series, cycle_time))
+            self.connection.execute("INSERT OR REPLACE INTO cycles (series, cycle_time, cycle_file, points) VALUES (?, ?, ?, ?)",
+                                    (series, cycle_time, cycle_file, int(keys.size)))
+            self.connection.executemany("INSERT INTO chunks (series, chunk, cycle_time, offsets, levels) VALUES (?, ?, ?, ?, ?)", chunk_rows)
+            self._delete_cycles_before(series, retention_cutoff_time)
+        return cycle_time
+
+    def _retention_cutoff_time(self):
+        """Returns the Unix time before which cycles are deleted (see retention_days), or -inf to keep every cycle."""
+        return time.time() - self.retention_days * 86400 if self.retention_days > 0 else -np.inf
+
+    def _delete_cycles_before(self, series, cutoff_time):
+        """
+        Deletes a series' cycles that started before cutoff_time (see retention_days).
+        The blocks are clustered by (series, block, cycle time), so they are deleted block number by block
+        number, each a range of the primary key, instead of scanning every block of the series.
+        """
+        if self.connection.execute("SELECT 1 FROM cycles WHERE series = ? AND cycle_time < ? LIMIT 1", (series, cutoff_time)).fetchone() is None:
+            return
+        lowest_chunk, highest_chunk = self.connection.execute("SELECT MIN(chunk), MAX(chunk) FROM chunks WHERE series = ?", (series,)).fetchone()
+        if lowest_chunk is not None:
+            self.connection.executemany("DELETE FROM chunks WHERE series = ? AND chunk = ? AND cycle_time < ?",
+                                        ((series, chunk, cutoff_time) for chunk in range(lowest_chunk, highest_chunk + 1)))
+        self.connection.execute("DELETE FROM cycles WHERE series = ? AND cycle_time < ?", (series, cutoff_time))
+
+    def cycles(self, series, start_time=None, stop_time=None):
+        """
+        Lists the stored cycles of a series.
+        Args:
+            series (str): The scan series.
+            start_time, stop_time (float or datetime): Time window (inclusive; None for no limit).
+        Returns:
+            list: (cycle time, cycle file, points) tuples, oldest first.
+        """
+        start_time, stop_time = self._time_range(start_time, stop_time)
+        return self.connection.execute("SELECT cycle_time, cycle_file, points FROM cycles WHERE series = ? AND cycle_time BETWEEN ? AND ? ORDER BY cycle_time",
+                                       (series, start_time, stop_time)).fetchall()
+
+    @staticmethod
+    def _time_range(start_time, stop_time):
+        """Converts a time window's limits to Unix times (datetime objects are accepted; None means no limit)."""
+        start_time = start_time.timestamp() if isinstance(start_time, datetime) else (-np.inf if start_time is None else start_time)
+        stop_time = stop_time.timestamp() if isinstance(stop_time, datetime) else (np.inf if stop_time is None else stop_time)
+        return float(start_time), float(stop_time)
+
+    def _stored_key_range(self, series, start_time, stop_time):
+        """
+        Finds the lowest and highest frequency bin (bin number) a series holds in a time window.
+        The lowest and highest stored bins are in the lowest and highest stored blocks, so only those blocks are read.
+        Returns:
+            tuple: (int, int) The lowest and highest bin, or None if the time window holds no blocks.
+        """
+        lowest_chunk, highest_chunk = self.connection.execute(
+            "SELECT MIN(chunk), MAX(chunk) FROM chunks WHERE series = ? AND cycle_time BETWEEN ? AND ?", (series, start_time, stop_time)).fetchone()
+        if lowest_chunk is None:
+            return None
+        lowest_offset = min(int(np.frombuffer(offsets, dtype=np.uint16).min()) for offsets, in self.connection.execute(
+            "SELECT offsets FROM chunks WHERE series = ? AND chunk = ? AND cycle_time BETWEEN ? AND ?", (series, lowest_chunk, start_time, stop_time)))
+        highest_offset = max(int(np.frombuffer(offsets, dtype=np.uint16).max()) for offsets, in self.connection.execute(
+            "SELECT offsets FROM chunks WHERE series = ? AND chunk = ? AND cycle_time BETWEEN ? AND ?", (series, highest_chunk, start_time, stop_time)))
+        return lowest_chunk * STORE_CHUNK_BINS + lowest_offset, highest_chunk * STORE_CHUNK_BINS + highest_offset
+
+    def query(self, series, start_mhz, stop_mhz, start_time=None, stop_time=None):
+        """
+        Reads a frequency/time window of a series, e.g. what happened at 615 MHz last Tuesday:
+        store.query("My_Spectrum_Scan", 614, 616, datetime(2025, 7, 1), datetime(2025, 7, 2)).
+        The frequency window is narrowed to the bins the series holds in the time window, so asking for a
+        wide range (e.g. 0 to 10000 MHz) doesn't allocate columns that can only be empty. The matrix may hold
+        at most STORE_QUERY_MAX_CELLS levels; use waterfall for an overview of a larger window.
+        Args:
+            series (str): The scan series.
+            start_mhz, stop_mhz (float): Frequency window in MHz (inclusive).
+            start_time, stop_time (float or datetime): Time window of the cycle start times (inclusive; None for no limit).
+        Returns:
+            SpectrumWindow: One row per cycle in the time window and one column per stored frequency bin in the frequency window.
+        Raises:
+            ValueError: If the window holds more than STORE_QUERY_MAX_CELLS levels.
+        """
+        bin_hz = self.series_bin_hz(series)
+        start_time, stop_time = self._time_range(start_time, stop_time)
+        stored_key_range = self._stored_key_range(series, start_time, stop_time) if bin_hz is not None else None
+        if stored_key_range is None:
+            return SpectrumWindow(np.empty(0), np.empty(0), np.empty((0, 0), dtype=np.float32))
+        first_key = max(int(np.ceil(start_mhz * MHZ_TO_HZ / bin_hz - 1e-9)), stored_key_range[0])
+        last_key = min(int(np.floor(stop_mhz * MHZ_TO_HZ / bin_hz + 1e-9)), stored_key_range[1])
+        cycle_times = np.array([row[0] for row in self.connection.execute(
+            "SELECT cycle_time FROM cycles WHERE series = ? AND cycle_time BETWEEN ? AND ? ORDER BY cycle_time",
+            (series, start_time, stop_time))], dtype=np.float64)
+        key_count = max(0, last_key - first_key + 1)
+        if len(cycle_times) * key_count > STORE_QUERY_MAX_CELLS:
+            raise ValueError(f"The window holds {len(cycle_times)} cycles x {key_count} frequency bins, more than STORE_QUERY_MAX_CELLS "
+                             f"({STORE_QUERY_MAX_CELLS}); narrow the time or frequency window, or use waterfall.")
+        levels_dbm = np.full((len(cycle_times), key_count), np.nan, dtype=np.float32)
+
+        chunk_rows = self.connection.execute(
+            "SELECT chunk, cycle_time, offsets, levels FROM chunks WHERE series = ? AND chunk BETWEEN ? AND ? AND cycle_time BETWEEN ? AND ?",
+            (series, first_key // STORE_CHUNK_BINS, last_key // STORE_CHUNK_BINS, start_time, stop_time))
+        for chunk, cycle_time, offsets, levels in chunk_rows:
+            keys = chunk * STORE_CHUNK_BINS + np.frombuffer(offsets, dtype=np.uint16).astype(np.int64)
+            inside = (keys >= first_key) & (keys <= last_key)
+            row = np.searchsorted(cycle_times, cycle_time)
+            levels_dbm[row, keys[inside] - first_key] = np.frombuffer(levels, dtype=np.float32)[inside]
+
+        frequencies_mhz = np.arange(first_key, first_key + levels_dbm.shape[1]) * bin_hz / MHZ_TO_HZ
+        return SpectrumWindow(cycle_times, frequencies_mhz, levels_dbm)
+
+    def waterfall(self, series, start_time=None, stop_time=None, start_mhz=None, stop_mhz=None,
+                  frequency_bins=WATERFALL_FREQUENCY_BINS, time_rows=WATERFALL_TIME_ROWS):
+        """
+        Reduces a series' history to a waterfall image of at most time_rows x frequency_bins cells,
+        keeping the highest level of every cell, so peaks stay visible however many cycles and points it covers.
+        The store is read block by block (WATERFALL_BATCH_ROWS stored blocks at a time) and each batch is
+        binned in one vectorized pass, so memory use follows the image size, not the history.
+        With up to time_rows cycles each cycle is a row; with more, the time window is split into
+        time_rows equal rows (a row without cycles, e.g. while the scanner was off, stays empty).
+
+        Args:
+            series (str): The scan series.
+            start_time, stop_time (float or datetime): Time window of the cycle start times (inclusive; None for no limit).
+            start_mhz, stop_mhz (float): Frequency window in MHz (None for the lowest/highest stored frequency).
+            frequency_bins (int): Most image columns.
+            time_rows (int): Most image rows.
+        Returns:
+            SpectrumWindow: The start time of each row, the center frequency of each column, and the image
+                            (NaN in cells without measurements). Empty if no stored level falls in the window.
+        """
+        bin_hz = self.series_bin_hz(series)
+        start_time, stop_time = self._time_range(start_time, stop_time)
+        cycle_times = np.array([cycle[0] for cycle in self.cycles(series, start_time, stop_time)], dtype=np.float64)
+        if bin_hz is None or cycle_times.size == 0:
+            return SpectrumWindow(np.empty(0), np.empty(0), np.empty((0, 0), dtype=np.float32))
+
+        if start_mhz is None or stop_mhz is None:
+            stored_key_range = self._stored_key_range(series, start_time, stop_time)
+            if stored_key_range is None:
+                return SpectrumWindow(np.empty(0), np.empty(0), np.empty((0, 0), dtype=np.float32))
+            if start_mhz is None:
+                start_mhz = stored_key_range[0] * bin_hz / MHZ_TO_HZ
+            if stop_mhz is None:
+                stop_mhz = stored_key_range[1] * bin_hz / MHZ_TO_HZ
+        first_key = int(np.ceil(start_mhz * MHZ_TO_HZ / bin_hz - 1e-9))
+        last_key = int(np.floor(stop_mhz * MHZ_TO_HZ / bin_hz + 1e-9))
+        key_count = max(1, last_key - first_key + 1)
+        column_count = min(frequency_bins, key_count)
+
+        if cycle_times.size <= time_rows:
+            row_times = cycle_times
+            cycle_rows = np.arange(cycle_times.size)
+        else:
+            row_edges = np.linspace(cycle_times[0], cycle_times[-1], time_rows + 1)
+            row_times = row_edges[:-1]
+            cycle_rows = np.clip(np.searchsorted(row_edges, cycle_times, side='right') - 1, 0, time_rows - 1)
+
+        image = np.full(len(row_times) * column_count, -np.inf, dtype=np.float32)
+        # Image column of every bin of the window (a lookup is faster than dividing every point's bin)
+        key_columns = np.arange(key_count, dtype=np.int64) * column_count // key_count
+        chunk_rows = self.connection.execute(
+            "SELECT cycle_time, chunk, offsets, levels FROM chunks WHERE series = ? AND chunk BETWEEN ? AND ? AND cycle_time BETWEEN ? AND ?",
+            (series, first_key // STORE_CHUNK_BINS, last_key // STORE_CHUNK_BINS, start_time, stop_time))
+        while True:
+            batch = chunk_rows.fetchmany(WATERFALL_BATCH_ROWS)
+            if not batch:
+                break
+            block_lengths = [len(chunk_offsets) // 2 for _, _, chunk_offsets, _ in batch] # uint16 offsets
+            window_keys = np.frombuffer(b"".join(chunk_offsets for _, _, chunk_offsets, _ in batch), dtype=np.uint16).astype(np.int64)
+            window_keys += np.repeat([chunk * STORE_CHUNK_BINS - first_key for _, chunk, _, _ in batch], block_lengths)
+            levels = np.frombuffer(b"".join(chunk_levels for _, _, _, chunk_levels in batch), dtype=np.float32)
+            row_offsets = np.repeat(cycle_rows[np.searchsorted(cycle_times, [cycle_time for cycle_time, _, _, _ in batch])] * column_count, block_lengths)
+            if window_keys.min() < 0 or window_keys.max() >= key_count:
+                inside = (window_keys >= 0) & (window_keys < key_count)
+                window_keys, levels, row_offsets = window_keys[inside], levels[inside], row_offsets[inside]
+                if window_keys.size == 0:
+                    continue
+            cells = row_offsets + key_columns[window_keys]
+            # Within a block the cells ascend, so runs of equal cells are reduced first and only one level per run is scattered
+            run_starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+            np.maximum.at(image, cells[run_starts], np.maximum.reduceat(levels, run_starts))
+
+        measured = ~np.isneginf(image)
+        if not measured.any(): # E.g. a frequency window the series never scanned
+            return SpectrumWindow(np.empty(0), np.empty(0), np.empty((0, 0), dtype=np.float32))
+        image[~measured] = np.nan
+        frequencies_mhz = (first_key + (np.arange(column_count) + 0.5) * key_count / column_count - 0.5) * bin_hz / MHZ_TO_HZ
+        return SpectrumWindow(row_times, frequencies_mhz, image.reshape(len(row_times), column_count))
+
+    def import_cycle_files(self, series, scan_dir, bin_hz):
+        """
+        Stores the cycle files already in a series folder (e.g. from before the store existed), skipping
+        cycle files that are already stored, unfinished cycles, empty files and cycles older than the retention.
+        The data is read from the .npz file when there is one. The cycle time is the start time in the .npz
+        metadata, or else the time in the file name (<series>_YYYYMMDD@HHMM.csv).
+        Args:
+            series (str): The scan series (its folder name).
+            scan_dir (str): The series folder.
+            bin_hz (float): Frequency bin width for a new series.
+        Returns:
+            int: The number of cycles imported.
+        """
+        stored_files = {row[1] for row in self.cycles(series)}
+        cycle_files = sorted(filename for filename in os.listdir(scan_dir)
+                             if re.fullmatch(re.escape(series) + r"_\d{8}@\d{4}\.csv", filename))
+        retention_cutoff_time = self._retention_cutoff_time()
+        imported_count = stored_count = unfinished_count = expired_count = empty_count = 0
+        for cycle_file in cycle_files:
+            cycle_path = os.path.join(scan_dir, cycle_file)
+            if cycle_file in stored_files:
+                stored_count += 1
+                continue
+            if os.path.exists(cycle_path + CHECKPOINT_FILE_SUFFIX):
+                unfinished_count += 1
+                continue
+            npz_path = os.path.splitext(cycle_path)[0] + ".npz"
+            cycle_time = None
+            if os.path.exists(npz_path):
+                with np.load(npz_path) as archive:
+                    frequencies_mhz, levels_dbm = archive["frequency_mhz"], archive["level_dbm"]
+                    cycle_time = json.loads(str(archive["metadata"])).get("cycle_start_time")
+            elif os.path.getsize(cycle_path) == 0: # E.g. a cycle that was stopped before its first segment
+                empty_count += 1
+                continue
+            else:
+                frequencies_mhz = levels_dbm = None
+            if cycle_time is None:
+                cycle_time = cycle_start_time_from_filename(cycle_file)
+            if cycle_time < retention_cutoff_time:
+                expired_count += 1
+                continue
+            if frequencies_mhz is None:
+                rows = np.loadtxt(cycle_path, delimiter=',', ndmin=2, usecols=(0, 1))
+                frequencies_mhz, levels_dbm = rows[:, 0], rows[:, 1]
+            if self.append_points(series, frequencies_mhz, levels_dbm, cycle_time, cycle_file, bin_hz) is not None:
+                imported_count += 1
+            else:
+                empty_count += 1
+        skipped_reasons = [f"{count} {reason}" for count, reason in (
+            (stored_count, "already stored"), (unfinished_count, "unfinished"),
+            (expired_count, f"older than the {self.retention_days:g}-day retention (STORE_RETENTION_DAYS)"), (empty_count, "without data")) if count]
+        print(f"🗄️ Imported {imported_count} of {len(cycle_files)} cycle files of {series} into {self.filename}"
+              + (f"; skipped {', '.join(skipped_reasons)}" if skipped_reasons else ""))
+        return imported_count
+
+
+def checkpoint_max_age_seconds(scan_plan, cycle_wait_time):
+    """
+    How old a checkpoint may be for its cycle to be resumed (see CHECKPOINT_MAX_AGE_CYCLES).
+    Args:
+        scan_plan (ScanPlan): The plan of the scan (see plan_scan).
+        cycle_wait_time (float): Wait between cycles in seconds.
+    Returns:
+        float: The maximum checkpoint age in seconds.
+    """
+    return max(CHECKPOINT_MIN_MAX_AGE_SECONDS, CHECKPOINT_MAX_AGE_CYCLES * (scan_plan.scan_seconds + cycle_wait_time))
+
+
+def find_scan_checkpoint(scan_dir, selected_bands, rbw_step_size_hz, segment_span_hz=None, max_age_seconds=None):
+    """
+    Looks for an interrupted cycle in the scan folder that can be resumed with the current settings.
+    A checkpoint older than max_age_seconds is not resumed: continuing a cycle interrupted long ago
+    would mix old data into a new cycle under the old file name. Its files are left as they are
+    (the checkpoint marks the CSV file as unfinished for the utilities and the spectrum store import).
+    Args:
+        scan_dir (str): The scan series folder.
+        selected_bands (list): The band dictionaries selected for this scan.
+        rbw_step_size_hz (float): The grid step of this scan.
+        segment_span_hz (float): The segment span of this scan (segment indices are only comparable
+                                 between scans with the same span). Defaults as in StreamingScanWriter.
+        max_age_seconds (float): Oldest checkpoint to resume (see checkpoint_max_age_seconds), or None for any age.
+    Returns:
+        dict: The most recent matching checkpoint (with 'resume_band_index' and 'resume_segment_index' added),
+              or None if there is nothing to resume.
+    """
+    band_names = [band["Band Name"] for band in selected_bands]
+    default_segment_span_hz = segment_span_for_mode(rbw_step_size_hz, "Trace")
+    if segment_span_hz is None:
+        segment_span_hz = default_segment_span_hz
+    checkpoints = []
+    for filename in os.listdir(scan_dir):
+        if not filename.endswith(CHECKPOINT_FILE_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(scan_dir, filename)) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable checkpoint {filename}: {e}")
+            continue
+        # Only resume a cycle that was scanning the same bands on the same grid
+        if checkpoint.get("band_names") != band_names or checkpoint.get("rbw_step_size_hz") != rbw_step_size_hz:
+            continue
+        if checkpoint.get("segment_span_hz", default_segment_span_hz) != segment_span_hz:
+            continue
+        if not os.path.exists(checkpoint.get("csv_filename", "")):
+            continue
+        if max_age_seconds is not None:
+            try:
+                checkpoint_age_seconds = (datetime.now() - datetime.fromisoformat(checkpoint["updated"])).total_seconds()
+            except (KeyError, ValueError):
+                continue
+            if checkpoint_age_seconds > max_age_seconds:
+                print(f"⏰ Not resuming {os.path.basename(checkpoint['csv_filename'])}: it was interrupted {format_duration(checkpoint_age_seconds)} ago.")
+                continue
+        checkpoints.append(checkpoint)
+
+    if not checkpoints:
+        return None
+    checkpoint = max(checkpoints, key=lambda item: item["updated"])
+    if checkpoint["band_complete"]:
+        checkpoint["resume_band_index"] = checkpoint["band_index"] + 1
+        checkpoint["resume_segment_index"] = 0
+    else:
+        checkpoint["resume_band_index"] = checkpoint["band_index"]
+        checkpoint["resume_segment_index"] = checkpoint["segment_index"] + 1
+    return checkpoint
+
+
+def scan_bands(inst, scan_writer, max_hold_time, rbw, selected_bands, last_scanned_band_index=0, rbw_config_val="1KHZ", vbw_config_val="1KHZ", acquisition_mode=DEFAULT_ACQUISITION_MODE, resume_segment_index=0, all_scan_data=None, instrument_settings=None, state_cache=None, pipeline=None, adaptive_threshold_db=DEFAULT_ADAPTIVE_THRESHOLD_DB, scan_control=None):
     """
     Iterates through predefined frequency bands, sets the start/stop frequencies,
     and triggers a sweep for each band. It collects data by moving Marker 1
-    across the segment's frequency range, writing data to the CSV writer,
-    and returning it for plotting.
+    across the segment's frequency range (or, in "Trace" mode, by transferring
+    the whole trace of each segment at once), streaming each segment to the
+    scan writer as soon as it is acquired, and returning the data for plotting.
     This function now dynamically segments bands to maintain a consistent
     effective resolution bandwidth per trace point.
     It also displays the time of day for each band scanned.
@@ -371,7 +2925,7 @@ def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanne
 
     Args:
         inst (pyvisa.resources.Resource): The PyVISA instrument object.
-        csv_writer (csv.writer): The CSV writer object to write data to.
+        scan_writer (StreamingScanWriter): The writer each acquired segment is appended to.
         max_hold_time (float): Duration in seconds for which MAX Hold should be active.
                                 If > 0, MAX Hold mode is enabled for the scan.
         rbw (float): Resolution Bandwidth for segmenting bands. This will now be used as the step size for marker data collection.
@@ -380,19 +2934,69 @@ def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanne
                                         Used for resuming scans after an error.
         rbw_config_val (str): Resolution Bandwidth value from GUI (e.g., "1KHZ").
         vbw_config_val (str): Video Bandwidth value from GUI (e.g., "1KHZ").
+        acquisition_mode (str): "Marker" to step the markers across each segment,
+                                "Trace" to read each segment with one :TRAC1:DATA? transfer,
+                                "Adaptive" to read wide coarse segments and only fine-scan the signal regions.
+        resume_segment_index (int): Segment of the first band (last_scanned_band_index) to start from.
+                                    Used with a checkpoint to resume a cycle mid-band.
+        all_scan_data (ScanDataBuffer): Data already collected in this cycle (e.g. before a resume)
+                                        to append to. A new buffer is created if None.
+        instrument_settings (dict): Preamp, display scale, reference level and max hold settings from the GUI
+                                    (keys as in DEFAULT_INSTRUMENT_SETTINGS). Defaults to DEFAULT_INSTRUMENT_SETTINGS.
+        state_cache (InstrumentStateCache): Settings already on the instrument, so only changed
+                                            settings are sent for each band. A new cache is used if None.
+        pipeline (ScpiCommandPipeline): Batches the band and segment setup and marker commands into as few
+                                        messages as possible. A new pipeline is created if None.
+        adaptive_threshold_db (float): In "Adaptive" mode, how far (dB) above the noise floor a coarse
+                                       point must be for its neighbourhood to be scanned at full resolution.
+        scan_control (ScanControl): Receives progress events and can pause or stop the scan between segments
+                                    (raising ScanAborted). If None, the scan can only be stopped with Ctrl+C.
     Returns:
-        tuple: (list: all_scan_data, int: last_successful_band_index)
-                all_scan_data: A list of dictionaries, where each dictionary represents a data point
+        tuple: (ScanDataBuffer: all_scan_data, int: last_successful_band_index)
+                all_scan_data: A columnar ScanDataBuffer holding every data point
                                with 'Band Name', 'Frequency (Hz)', and 'Level (dBm)'.
                 last_successful_band_index: The index of the last band that was fully
                                             or partially scanned successfully.
     """
-    all_scan_data = [] # To store all data points across all bands for plotting
+    # To store all data points across all bands for plotting, preallocated for the expected number of points
+    if all_scan_data is None:
+        all_scan_data = ScanDataBuffer(
+            [band["Band Name"] for band in selected_bands],
+            estimate_scan_point_count(selected_bands[last_scanned_band_index:], rbw) if rbw > 0 else 0
+        )
     last_successful_band_index = last_scanned_band_index
+    if instrument_settings is None:
+        instrument_settings = DEFAULT_INSTRUMENT_SETTINGS
+    if state_cache is None:
+        state_cache = InstrumentStateCache()
+    if pipeline is None:
+        pipeline = ScpiCommandPipeline(inst)
+    if scan_control is None:
+        scan_control = ScanControl()
 
     print("\n--- 📡 Starting Band Scan ---") # Moved emoji
 
-    print("💾 Using marker-based data collection by sweeping Marker 1.")
+    # Ensure rbw is not zero to prevent an endless frequency grid
+    if rbw <= 0:
+        print("🚫 RBW step size is zero or negative. Cannot collect data.")
+        return all_scan_data, last_successful_band_index
+
+    if acquisition_mode == "Trace":
+        print(f"💾 Using trace-based data collection ({TRACE_SWEEP_POINTS} points per :TRAC1:DATA? transfer).")
+    elif acquisition_mode == "Adaptive":
+        print(f"💾 Using adaptive data collection: {rbw * ADAPTIVE_COARSE_STEP_FACTOR / 1000:.0f} kHz coarse pass, {rbw / 1000:.0f} kHz where signals are {adaptive_threshold_db} dB above the noise floor.")
+    else:
+        print("💾 Using marker-based data collection by sweeping Marker 1.")
+
+    # Progress tracking for the points/sec and ETA in the progress events
+    segment_span_hz = segment_span_for_mode(rbw, acquisition_mode)
+    segments_to_scan = sum(
+        max(1, int(np.ceil((band["Stop MHz"] - band["Start MHz"]) * MHZ_TO_HZ / segment_span_hz)))
+        for band in selected_bands[last_scanned_band_index:]
+    ) - resume_segment_index
+    segments_started = 0
+    scan_start_time = time.monotonic()
+    scan_start_points = len(all_scan_data)
 
     # *** Use selected_bands for scanning the instrument ***
     # Iterate through bands starting from last_scanned_band_index
@@ -406,17 +3010,42 @@ def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanne
         print(f"\n📈 [{current_time}] Processing Band: {band_name} (Total Range: {band_start_freq_hz/MHZ_TO_HZ:.3f} MHz to {band_stop_freq_hz/MHZ_TO_HZ:.3f} MHz)") # Moved emoji
 
         # --- RE-ADDED: "Wake Up" and Initial Band Configuration ---
-
-        initialize_instrument(inst, 1, 1, 1, -30, 1, 1000)
+        # Make sure the GUI settings are on the instrument. The state cache only sends what changed,
+        # so after the first band this normally sends nothing (no *RST per band).
+        initialize_instrument(
+            inst,
+            False,
+            instrument_settings["preamplifier_on"],
+            instrument_settings["display_log"],
+            instrument_settings["ref_level"],
+            instrument_settings["max_hold_on"],
+            rbw_config_val,
+            state_cache=state_cache,
+            pipeline=pipeline
+        )
+        # Apply RBW and VBW settings from the GUI.
+        # These and the rest of the band setup are queued and go out together with the first segment.
+        if state_cache.set(pipeline, ":SENSE:BAND:RES", rbw_config_val):
+            print(f"📏 Set RBW to {rbw_config_val} for scan.")
+        if state_cache.set(pipeline, ":SENSE:BAND:VID", vbw_config_val):
+            print(f"📺 Set VBW to {vbw_config_val} for scan.")
 
         # Force a narrow span at the band's start frequency to ensure it "wakes up" and tunes
-        write_safe(inst, f":SENS:FREQ:CENT {band_start_freq_hz}")
-        write_safe(inst, ":SENS:FREQ:SPAN 1000HZ") # Set to 1 kHz span
-        print("\n--- ✅ Clear and Reset for next scan ---") # Moved emoji
+        pipeline.write(f":SENS:FREQ:CENT {band_start_freq_hz}")
+        pipeline.write(":SENS:FREQ:SPAN 1000HZ") # Set to 1 kHz span
+
+        # Single-sweep mode: each segment is swept on demand with :INIT:IMM and completion is read from *OPC?
+        state_cache.set(pipeline, ":INIT:CONT", "OFF")
+        sweep_time_seconds = None # Queried from the instrument once the first segment is set
+        fine_sweep_time_seconds = None # "Adaptive" mode: sweep time of the fine-resolution sweeps
+
+        if acquisition_mode in ("Trace", "Adaptive"):
+            if state_cache.set(pipeline, ":TRAC:FORMat", "REAL"):
+                print("💾 Set trace data format to REAL (binary) for efficient data transfer.")
         
         # Query the actual number of sweep points from the instrument for *this band*
         # The :SENSe:SWEep:POINts? command is not a real command, hardcoding to 462.
-        actual_sweep_points = 401 # Changed to 401 points for 10 divisions * 40 points/div + 1
+        actual_sweep_points = TRACE_SWEEP_POINTS # Changed to 401 points for 10 divisions * 40 points/div + 1
         print(f"📊 Using fixed {actual_sweep_points} sweep points per trace for {band_name}.")
 
 
@@ -470,54 +3099,79 @@ def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanne
             # that we set the instrument to for each sub-sweep.
             # If we want 401 points effectively, and each point is 'rbw' apart,
             # then the span should be (401 - 1) * rbw.
-            optimal_segment_span_hz = rbw * (actual_sweep_points - 1)
+            # ("Adaptive" mode sweeps coarse segments ADAPTIVE_COARSE_STEP_FACTOR times wider, see segment_span_for_mode.)
+            optimal_segment_span_hz = segment_span_for_mode(rbw, acquisition_mode)
             total_segments_in_band = int(np.ceil(full_band_span_hz / optimal_segment_span_hz))
             if total_segments_in_band == 0:
                 total_segments_in_band = 1
         print(f"🎯 Optimal segment span for instrument setting: {optimal_segment_span_hz / MHZ_TO_HZ:.3f} MHz.")
-
-        # Initialize a temporary list to hold all data points for the current band
-        current_band_data = []
+        coarse_step_hz = rbw * ADAPTIVE_COARSE_STEP_FACTOR # "Adaptive" mode: coarse pass point spacing
+        coarse_rbw_config_val = f"{supported_rbw_at_or_below(coarse_step_hz):.0f}HZ" # An RBW setting the instrument accepts
 
         # Now, explicitly set the START and STOP for the *first segment* of this new band
         current_segment_start_freq_hz = band_start_freq_hz # Initialize for the loop
         segment_counter = 0
+        if i == last_scanned_band_index and resume_segment_index > 0:
+            # Resuming from a checkpoint: skip the segments that are already in the CSV file
+            segment_counter = resume_segment_index
+            current_segment_start_freq_hz = band_start_freq_hz + resume_segment_index * optimal_segment_span_hz
+            print(f"⏩ Resuming {band_name} at segment {segment_counter + 1} ({current_segment_start_freq_hz/MHZ_TO_HZ:.3f} MHz).")
         while current_segment_start_freq_hz < band_stop_freq_hz:
+            # Pause or stop here if asked from the GUI; a paused scan continues with this segment
+            scan_control.checkpoint()
             segment_counter += 1
+
+            elapsed_seconds = time.monotonic() - scan_start_time
+            points_so_far = len(all_scan_data) - scan_start_points
+            scan_control.publish(
+                "segment",
+                band_index=i, band_count=len(selected_bands), band_name=band_name,
+                segment=segment_counter, segment_count=total_segments_in_band,
+                overall_fraction=segments_started / segments_to_scan if segments_to_scan > 0 else 0.0,
+                points=len(all_scan_data),
+                points_per_second=points_so_far / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+                eta_seconds=elapsed_seconds / segments_started * (segments_to_scan - segments_started) if segments_started else None,
+                frequency_mhz=current_segment_start_freq_hz / MHZ_TO_HZ,
+            )
+            segments_started += 1
             segment_stop_freq_hz = min(current_segment_start_freq_hz + optimal_segment_span_hz, band_stop_freq_hz)
             actual_segment_span_hz = segment_stop_freq_hz - current_segment_start_freq_hz
-
-            # Initialize current_marker_base_freq for this segment.
-            # This ensures it's always defined before the inner while loop's condition is checked.
-            current_marker_base_freq = current_segment_start_freq_hz
+            is_last_segment_of_band = segment_stop_freq_hz >= band_stop_freq_hz
 
             if actual_segment_span_hz <= 0:
                 # Avoid infinite loop if start == stop or negative span
                 print(f"⚠️ Skipping segment due to zero or negative span: {current_segment_start_freq_hz/MHZ_TO_HZ:.3f} MHz to {segment_stop_freq_hz/MHZ_TO_HZ:.3f} MHz")
                 break # Exit this segment loop, move to next band or end scan
 
-            # Set instrument frequency range for the current segment
-            write_safe(inst, f":SENS:FREQ:STAR {current_segment_start_freq_hz}")
-            write_safe(inst, f":SENS:FREQ:STOP {segment_stop_freq_hz}")
-            # Add a small delay after setting frequencies to allow instrument to configure
-            time.sleep(0.1)
-            query_safe(inst, "*OPC?") # Wait for the sweep to completed
-            inst.clear() # Flush buffer after OPC query
-            time.sleep(0.5) # Add a small delay for data processing within the instrument
-
-            # Add settling time for max hold values to show up, if max hold is enabled
-            if max_hold_time > 0:
-                for sec_wait in range(int(max_hold_time), 0, -1):
-                    display_text = f"⏳{sec_wait}"
-                    sys.stdout.write(display_text) # \r to overwrite line
-                    sys.stdout.flush()
-                    time.sleep(1)
-                sys.stdout.write("✅") # Clear the line and add newline
-                sys.stdout.flush()
-            #write_safe(inst, f":INITiate:CONTinuous 0")
-            #print("\n--- ✅ Continuous OFF SCAN FROZEN ON SCREEN ---") # Moved emoji
-            query_safe(inst, "*OPC?") # Wait for the sweep to complete
-            inst.clear() # Flush buffer after OPC query
+            # The frequencies to measure in this segment: exactly one point every 'rbw' Hz.
+            # A segment's stop frequency is the next segment's start, so it is only measured
+            # by the last segment of the band. No frequency is measured twice.
+            segment_grid_hz = build_segment_frequency_grid(current_segment_start_freq_hz, segment_stop_freq_hz, rbw, include_stop=is_last_segment_of_band)
+
+            # Set instrument frequency range for the current segment.
+            # The instrument span is always the full optimal span (even for a shorter last segment)
+            # so the trace points, and therefore the markers, sit exactly on the 'rbw' grid.
+            # These are queued and sent in the same message as the sweep (or sweep time) query.
+            if acquisition_mode == "Adaptive":
+                # The coarse pass sweeps with a wide RBW and VBW; the fine pass switches back to the GUI values
+                state_cache.set(pipeline, ":SENSE:BAND:RES", coarse_rbw_config_val)
+                state_cache.set(pipeline, ":SENSE:BAND:VID", coarse_rbw_config_val)
+            pipeline.write(f":SENS:FREQ:STAR {current_segment_start_freq_hz}")
+            pipeline.write(f":SENS:FREQ:STOP {current_segment_start_freq_hz + optimal_segment_span_hz}")
+
+            # Every segment has the same span and RBW, so the sweep time only needs to be asked once per band
+            if sweep_time_seconds is None:
+                sweep_time_seconds = query_sweep_time(pipeline)
+                if sweep_time_seconds is not None:
+                    print(f"⏱️ Instrument sweep time for {band_name}: {sweep_time_seconds * 1000:.1f} ms per segment.")
+
+            # Sweep the segment (repeatedly for max hold) and wait exactly until the instrument reports completion
+            wait_for_sweep_complete(pipeline, sweep_time_seconds, max_hold_time)
+
+            # Report anything the instrument rejected while setting up the segment, and resend rejected settings later
+            setup_errors = pipeline.take_errors()
+            report_scpi_errors(setup_errors)
+            state_cache.discard_failed(setup_errors)
 
             # Calculate progress for the emoji bar - Using more compatible ASCII characters
             progress_percentage = (segment_counter / total_segments_in_band)
@@ -529,100 +3183,116 @@ def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanne
             # Combined print statement as per user request
             print(f"{progressbar} 🔍 📈{current_segment_start_freq_hz/MHZ_TO_HZ:.3f} MHz to 📉{segment_stop_freq_hz/MHZ_TO_HZ:.3f} MHz ✅{segment_counter} of {total_segments_in_band}.")
 
-    
-            # Read and process data using markers
-            # The instrument has 401 points (0 to 400).
-            # Quarter points are at 100, 200, 300, 400.
-            # Marker positions are relative to the *current segment's start frequency*.
-
-            # Calculate the frequency step per display point for the current segment
-            if (actual_sweep_points - 1) > 0:
-                freq_step_per_display_point = actual_segment_span_hz / (actual_sweep_points - 1)
-            else:
-                freq_step_per_display_point = 0 # Should not happen with actual_sweep_points = 401
-
-            marker_offsets_percentage = [0.0, 0.2, 0.4, 0.6, 0.8] # Relative to current segment span
+            if acquisition_mode == "Trace":
+                # Pull the whole segment in one transfer instead of stepping the markers
+                segment_levels_dbm = read_trace_levels_at(inst, current_segment_start_freq_hz, optimal_segment_span_hz, segment_grid_hz)
+                if segment_levels_dbm is None:
+                    # The checkpoint moves past the segment either way, so the hole is recorded as NaN levels
+                    print(f"⚠️ The trace of this segment could not be read; its {segment_grid_hz.size} points are written as NaN.")
+                    segment_levels_dbm = np.full(segment_grid_hz.size, np.nan, dtype=np.float32)
+                segment_freqs_mhz = segment_grid_hz / MHZ_TO_HZ
+                all_scan_data.append(segment_freqs_mhz, segment_levels_dbm, band_name)
+                scan_writer.write_segment(i, segment_counter - 1, is_last_segment_of_band, segment_freqs_mhz, segment_levels_dbm)
+                scan_control.publish("segment_data", band_index=i, frequencies_mhz=segment_freqs_mhz, levels_dbm=segment_levels_dbm)
+
+                # Advance to the next segment's start frequency
+                current_segment_start_freq_hz = segment_stop_freq_hz
+                last_successful_band_index = i
+                continue
 
-            # Ensure rbw is not zero to prevent infinite loop
-            if rbw <= 0:
-                print("🚫 RBW step size is zero or negative. Cannot collect marker data.")
-                current_segment_start_freq_hz = segment_stop_freq_hz # Skip to next segment
+            if acquisition_mode == "Adaptive":
+                # The coarse pass: the wide segment just swept, one point every ADAPTIVE_COARSE_STEP_FACTOR grid steps
+                coarse_grid_hz = build_segment_frequency_grid(current_segment_start_freq_hz, segment_stop_freq_hz, coarse_step_hz, include_stop=is_last_segment_of_band)
+                coarse_levels_dbm = read_trace_levels_at(inst, current_segment_start_freq_hz, optimal_segment_span_hz, coarse_grid_hz)
+                if coarse_levels_dbm is not None:
+                    noise_floor_dbm, region_starts_hz, region_stops_hz = detect_signal_regions(
+                        coarse_grid_hz, coarse_levels_dbm, adaptive_threshold_db, ADAPTIVE_GUARD_POINTS * coarse_step_hz
+                    )
+                    # Fine pass: every grid point inside a signal region, at the full 'rbw' resolution
+                    region_grid_hz = segment_grid_hz[frequencies_in_regions(segment_grid_hz, region_starts_hz, region_stops_hz)]
+                    if region_grid_hz.size > 0:
+                        state_cache.set(pipeline, ":SENSE:BAND:RES", rbw_config_val)
+                        state_cache.set(pipeline, ":SENSE:BAND:VID", vbw_config_val)
+                    region_levels_dbm, fine_sweep_time_seconds = scan_signal_regions(
+                        pipeline, region_grid_hz, rbw * (actual_sweep_points - 1), max_hold_time, fine_sweep_time_seconds
+                    )
+                    if region_grid_hz.size > 0:
+                        print(f"🔎 {region_starts_hz.size} signal region(s) above {noise_floor_dbm + adaptive_threshold_db:.1f} dBm: {region_grid_hz.size} fine points.")
+                    received = ~np.isnan(region_levels_dbm)
+
+                    # Coarse points outside the regions plus the fine points inside them, in ascending frequency order
+                    coarse_kept = ~frequencies_in_regions(coarse_grid_hz, region_starts_hz, region_stops_hz)
+                    merged_freqs_hz = np.concatenate((coarse_grid_hz[coarse_kept], region_grid_hz[received]))
+                    merged_levels_dbm = np.concatenate((coarse_levels_dbm[coarse_kept], region_levels_dbm[received]))
+                    merged_order = np.argsort(merged_freqs_hz, kind='stable')
+                    segment_freqs_mhz = merged_freqs_hz[merged_order] / MHZ_TO_HZ
+                    segment_levels_dbm = merged_levels_dbm[merged_order]
+                    all_scan_data.append(segment_freqs_mhz, segment_levels_dbm, band_name)
+                    scan_writer.write_segment(i, segment_counter - 1, is_last_segment_of_band, segment_freqs_mhz, segment_levels_dbm)
+                    scan_control.publish("segment_data", band_index=i, frequencies_mhz=segment_freqs_mhz, levels_dbm=segment_levels_dbm)
+
+                    # Report anything the instrument rejected during the fine sweeps
+                    fine_errors = pipeline.take_errors()
+                    report_scpi_errors(fine_errors)
+                    state_cache.discard_failed(fine_errors)
+                else:
+                    # The checkpoint moves past the segment either way, so the hole is recorded as NaN levels
+                    print(f"⚠️ The coarse trace of this segment could not be read; its {coarse_grid_hz.size} coarse points are written as NaN.")
+                    segment_freqs_mhz = coarse_grid_hz / MHZ_TO_HZ
+                    segment_levels_dbm = np.full(coarse_grid_hz.size, np.nan, dtype=np.float32)
+                    all_scan_data.append(segment_freqs_mhz, segment_levels_dbm, band_name)
+                    scan_writer.write_segment(i, segment_counter - 1, is_last_segment_of_band, segment_freqs_mhz, segment_levels_dbm)
+
+                # Advance to the next coarse segment's start frequency
+                current_segment_start_freq_hz = segment_stop_freq_hz
+                last_successful_band_index = i
                 continue
 
-            # Loop to collect data points using Marker 1 as the reference
-            # The loop condition is now based on Marker 4's potential position
-            while (current_marker_base_freq + (marker_offsets_percentage[4] * actual_segment_span_hz)) <= segment_stop_freq_hz:
+            # Read and process data using markers.
+            # The grid is measured MARKERS_PER_BATCH points at a time, one grid frequency per marker,
+            # so every point in the segment is measured exactly once.
+            if segment_grid_hz.size > 0:
+                marker_batches = np.array_split(segment_grid_hz, int(np.ceil(segment_grid_hz.size / MARKERS_PER_BATCH)))
+            else:
+                marker_batches = []
+
+            # Levels for the segment's grid, filled one batch at a time (NaN until measured)
+            segment_levels_dbm = np.full(segment_grid_hz.size, np.nan, dtype=np.float32)
+            measured_point_count = 0
+
+            for marker_batch_hz in marker_batches:
+                amp_values_str = ""
                 try:
-                    marker_data_points_temp = [] # Initialize an empty list to store results
+                    marker_batch_freqs_hz = marker_batch_hz.tolist()
 
-                    # --- Construct the concatenated command strings ---
-                    set_commands = []
+                    # --- Queue the marker frequency set commands and build the amplitude query ---
                     query_commands = []
-                    for marker_idx in range(5):
+                    for marker_idx, marker_freq_hz in enumerate(marker_batch_freqs_hz):
                         marker_num = marker_idx + 1
-                        # Calculate the frequency for the current marker (same as before)
-                        marker_freq_hz = current_marker_base_freq + (marker_offsets_percentage[marker_idx] * actual_segment_span_hz)
-                        marker_freq_hz = min(marker_freq_hz, segment_stop_freq_hz) # Cap at segment stop frequency
-
-                        # Append the set command
-                        set_commands.append(f":CALC:MARK{marker_num}:X {marker_freq_hz}HZ")
+                        # Queue the set command
+                        pipeline.write(f":CALC:MARK{marker_num}:X {marker_freq_hz}HZ")
                         # Append the query command for amplitude. Note the leading colon for absolute path.
                         # We want to query all Y values in a single string.
                         query_commands.append(f":CALC:MARK{marker_num}:Y?")
-                
-
-                    # Join the commands with a semicolon
-                    
-
-
-                    full_set_command = ";".join(set_commands)
-                    full_query_command = ";".join(query_commands)
 
                     # --- Execute the commands ---
-                    # 1. Send all marker frequency set commands in one go
-                    write_safe(inst, full_set_command)
-                   
-
-                    # 2. Query all marker amplitudes in one go
+                    # The set commands and the amplitude queries go out as one message (one round trip).
                     # The instrument is expected to return the values separated by semicolons.
                     # E.g., "-10.123;-12.456;-8.901;-15.789;-20.500"
-                    amp_values_str = query_safe(inst, full_query_command)
+                    marker_reply = pipeline.query(";".join(query_commands))
+                    pipeline.take_errors()
+                    if marker_reply.errors:
+                        report_scpi_errors(marker_reply.errors)
+                        break # Don't trust the amplitudes of a batch the instrument rejected
+                    amp_values_str = marker_reply.response or ""
                     amp_values_str_list = amp_values_str.split(';')
 
-                    # Now, iterate through the received amplitudes and the original marker calculations
-                    for marker_idx in range(5):
-                        marker_num = marker_idx + 1 # Re-declare or use if in scope
-
-                        # Get the amplitude value for the current marker
-                        amp_value = float(amp_values_str_list[marker_idx])
-
-                        # Re-calculate marker_freq_hz for data point consistency (important!)
-                        # This ensures the frequency stored matches what was *commanded* to the instrument,
-                        # as the query for Y? doesn't return the X value.
-                        marker_freq_hz = current_marker_base_freq + (marker_offsets_percentage[marker_idx] * actual_segment_span_hz)
-                        marker_freq_hz = min(marker_freq_hz, segment_stop_freq_hz)
-
-                        marker_data_points_temp.append({
-                            "Frequency (MHz)": marker_freq_hz / MHZ_TO_HZ,
-                            "Level (dBm)": amp_value,
-                            "Band Name": band_name,
-                        })
-
+                    # Each received amplitude belongs to the grid frequency its marker was *commanded* to,
+                    # as the query for Y? doesn't return the X value.
+                    batch_levels_dbm = [float(amp_values_str_list[marker_idx]) for marker_idx in range(len(marker_batch_freqs_hz))]
+                    segment_levels_dbm[measured_point_count:measured_point_count + len(batch_levels_dbm)] = batch_levels_dbm
+                    measured_point_count += len(batch_levels_dbm)
 
-                    # Sort marker_data_points_temp by frequency before appending
-                    marker_data_points_temp.sort(key=lambda x: x["Frequency (MHz)"])
-
-                    # Add the sorted marker data points to the current_band_data
-                    current_band_data.extend(marker_data_points_temp)
-
-                    # Advance current_marker_base_freq by the step size
-                    current_marker_base_freq += rbw # Advance by the desired resolution bandwidth (step size)
-
-                except pyvisa.VisaIOError as e:
-                    print(f"❌ VISA Error during marker data collection: {e}")
-                    # Decide if this error is critical enough to stop the whole scan
-                    # For now, we'll just break out of the current marker loop and try the next segment/band
-                    break
                 except ValueError as e:
                     print(f"❌ Data parsing error (e.g., non-float amplitude received): {e}. Raw: '{amp_values_str}'")
                     # Break out of the current marker loop and try the next segment/band
@@ -631,44 +3301,188 @@ def scan_bands(inst, csv_writer, max_hold_time, rbw, selected_bands, last_scanne
                     print(f"❌ Not enough marker amplitude values received: {e}. Raw: '{amp_values_str}'")
                     # Break out of the current marker loop and try the next segment/band
                     break
+                except pyvisa.VisaIOError:
+                    # A lost connection or timeout must not be written as a (short) finished segment:
+                    # the checkpoint stays at the last measured segment, and the scan reconnects and resumes there
+                    raise
                 except Exception as e:
                     print(f"💥 An unexpected error occurred during marker data collection: {e}")
                     break # Exit current marker loop, try next segment/band
+
+            # Keep every point measured before any error. The checkpoint moves past the segment, so the points
+            # after the error are written too, with NaN levels: the hole stays visible in the files and the utilities.
+            if measured_point_count < segment_grid_hz.size:
+                print(f"⚠️ {segment_grid_hz.size - measured_point_count} of {segment_grid_hz.size} points of this segment were not measured; they are written as NaN.")
+            segment_freqs_mhz = segment_grid_hz / MHZ_TO_HZ
+            all_scan_data.append(segment_freqs_mhz, segment_levels_dbm, band_name)
+            scan_writer.write_segment(i, segment_counter - 1, is_last_segment_of_band, segment_freqs_mhz, segment_levels_dbm)
+            scan_control.publish("segment_data", band_index=i, frequencies_mhz=segment_freqs_mhz, levels_dbm=segment_levels_dbm)
     
             # Advance to the next segment's start frequency
             current_segment_start_freq_hz = segment_stop_freq_hz
             # Update the last successfully scanned band index after each segment completes
             last_successful_band_index = i
         
-        # After processing all segments for the current band, sort current_band_data
-        current_band_data.sort(key=lambda x: x["Frequency (MHz)"])
-
-        # Write the sorted current_band_data to CSV and add to all_scan_data
-        for data_point in current_band_data:
-            all_scan_data.append(data_point) # Add to overall list for plotting
-            csv_writer.writerow([
-                f"{data_point['Frequency (MHz)']:.2f}",
-                f"{data_point['Level (dBm)']:.2f}",
-            ])
-        print(f"✅ Band '{band_name}' data collected, sorted, and written to CSV.") # Add confirmation
+        # Segments are scanned in ascending order on a non-overlapping grid and were streamed to the CSV as they landed
+        print(f"✅ Band '{band_name}' data collected and written to CSV.") # Add confirmation
+        scan_control.publish("band", band_index=i, band_name=band_name, points=len(all_scan_data))
     
     print("\n--- ✅ Band Scan Complete ---") # Moved emoji
     print("\n--- ✅ Clear and Reset for next scan ---") # Moved emoji
-    write_safe(inst, "*CLS")
-    write_safe(inst, "*RST")
-    query_safe(inst, "*OPC?") # Wait for operations to complete
+    state_cache.hard_reset(pipeline)
             
 
 
-    return all_scan_data, last_successful_band_index
+    return all_scan_data, last_successful_band_index
+
+
+
+
+def minmax_bins(frequencies, levels, range_start, range_stop, bin_count):
+    """
+    Splits a frequency range into bin_count equal-width bins (e.g. one per screen pixel) and returns
+    the lowest and highest level in each bin. Drawing each bin from its min to its max keeps every
+    peak visible however many points fall into one pixel. Points outside the range are ignored.
+    Args:
+        frequencies (numpy.ndarray): Point frequencies (any unit, same as the range).
+        levels (numpy.ndarray): Point levels in dBm.
+        range_start (float): Frequency at the left edge of the first bin.
+        range_stop (float): Frequency at the right edge of the last bin.
+        bin_count (int): Number of bins.
+    Returns:
+        tuple: (numpy.ndarray: bin_min, numpy.ndarray: bin_max), float64 arrays of length bin_count,
+               NaN for bins without points.
+    """
+    bin_min = np.full(bin_count, np.nan)
+    bin_max = np.full(bin_count, np.nan)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    inside = (frequencies >= range_start) & (frequencies <= range_stop) & ~np.isnan(levels)
+    if bin_count <= 0 or range_stop <= range_start or not inside.any():
+        return bin_min, bin_max
+
+    bin_indices = ((frequencies[inside] - range_start) / (range_stop - range_start) * bin_count).astype(np.int64)
+    bin_indices = np.minimum(bin_indices, bin_count - 1) # The range stop belongs to the last bin
+    levels = levels[inside]
+    # Scan data is already in ascending frequency order, so sorting is normally skipped
+    if bin_indices.size > 1 and np.any(bin_indices[1:] < bin_indices[:-1]):
+        order = np.argsort(bin_indices, kind='stable')
+        bin_indices = bin_indices[order]
+        levels = levels[order]
+    occupied_bins, first_point_indices = np.unique(bin_indices, return_index=True)
+    bin_min[occupied_bins] = np.minimum.reduceat(levels, first_point_indices)
+    bin_max[occupied_bins] = np.maximum.reduceat(levels, first_point_indices)
+    return bin_min, bin_max
+
+
+def minmax_downsample_indices(x_values, y_values, series_codes, range_start, range_stop, bucket_count):
+    """
+    Picks the points to draw so a line plot looks the same as with every point:
+    the x range is split into bucket_count equal buckets (roughly one or two per screen pixel)
+    and, for every series, only the lowest and highest point of each bucket are kept.
+    Peaks and dips survive however many points fall into one bucket.
+    Args:
+        x_values (numpy.ndarray): Point positions on the plot's x axis (e.g. log10 of the frequency for a log axis).
+        y_values (numpy.ndarray): Point levels.
+        series_codes (numpy.ndarray): Integer series (band) of every point; each series is reduced separately.
+        range_start (float): x at the left edge of the first bucket.
+        range_stop (float): x at the right edge of the last bucket.
+        bucket_count (int): Number of buckets across the x range.
+    Returns:
+        numpy.ndarray: Indices of the points to keep, in their original order.
+    """
+    x_values = np.asarray(x_values, dtype=np.float64)
+    if x_values.size <= 2 * bucket_count or range_stop <= range_start:
+        return np.arange(x_values.size)
+
+    bucket_indices = np.clip(((x_values - range_start) / (range_stop - range_start) * bucket_count).astype(np.int64), 0, bucket_count - 1)
+    bucket_keys = np.asarray(series_codes, dtype=np.int64) * bucket_count + bucket_indices
+    # Sort by bucket, then by level: the first point of each bucket is its minimum and the last its maximum
+    order = np.lexsort((y_values, bucket_keys))
+    sorted_keys = bucket_keys[order]
+    bucket_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    bucket_ends = np.r_[bucket_starts[1:], sorted_keys.size] - 1
+    return np.unique(np.concatenate((order[bucket_starts], order[bucket_ends])))
+
+
+def plot_waterfall(spectrum_window, output_html_filename, plot_title, open_html_after_complete):
+    """
+    Draws a waterfall (see SpectrumStore.waterfall) as an interactive Plotly heatmap of level over
+    frequency and time, and saves it as an HTML file. The color scale spans the 1st to the 99.5th
+    percentile of the levels, so the noise floor and the carriers both get contrast.
 
+    Args:
+        spectrum_window (SpectrumWindow): The waterfall image.
+        output_html_filename (str): The name of the HTML file to save the plot to.
+        plot_title (str): The title for the Plotly chart.
+        open_html_after_complete (bool): Whether to automatically open the generated HTML file.
+    """
+    # Imported here so scans that don't plot (e.g. the headless mode) never load plotly
+    import plotly.graph_objects as go
+
+    print(f"\n--- 🌊 Generating Waterfall: {output_html_filename} ---")
+    levels_dbm = spectrum_window.levels_dbm
+    color_low, color_high = np.nanpercentile(levels_dbm, WATERFALL_COLOR_PERCENTILES) if np.any(~np.isnan(levels_dbm)) else (None, None)
+    fig = go.Figure(go.Heatmap(
+        z=levels_dbm,
+        x=spectrum_window.frequencies_mhz,
+        y=[datetime.fromtimestamp(row_time) for row_time in spectrum_window.cycle_times],
+        zmin=color_low,
+        zmax=color_high,
+        colorscale="Viridis",
+        colorbar=dict(title="Level (dBm)"),
+        hoverongaps=False,
+        hovertemplate="%{x:.3f} MHz<br>%{y}<br>%{z:.1f} dBm<extra></extra>",
+    ))
+    fig.update_layout(title=plot_title, template="plotly_dark")
+    fig.update_xaxes(title="Frequency (MHz)")
+    fig.update_yaxes(title="Cycle Time")
+    fig.write_html(output_html_filename, auto_open=open_html_after_complete)
+    print(f"🖼️ --- Waterfall of {levels_dbm.shape[0]} rows x {levels_dbm.shape[1]} frequencies saved to {output_html_filename} ---")
 
 
+def render_series_waterfall(series, start_time=None, stop_time=None, start_mhz=None, stop_mhz=None, output_html_filename=None, open_html_after_complete=True):
+    """
+    Renders the waterfall of a scan series' history in the spectrum store as an HTML file
+    (see SpectrumStore.waterfall and plot_waterfall).
 
-def plot_spectrum_data(df: pd.DataFrame, output_html_filename: str, plot_title: str, include_gov_markers: bool, include_tv_markers: bool, open_html_after_complete: bool):
+    Args:
+        series (str): The scan series (its folder name).
+        start_time, stop_time (float or datetime): Time window (None for the whole history).
+        start_mhz, stop_mhz (float): Frequency window in MHz (None for every stored frequency).
+        output_html_filename (str): The HTML file (default: <series>_waterfall.html in the series folder).
+        open_html_after_complete (bool): Whether to open it in the browser.
+    Returns:
+        str: The HTML file, or None if the store holds no cycles of the series in the window.
+    """
+    store_filename = os.path.join(os.getcwd(), "N9340 Scans", STORE_FILENAME)
+    if not os.path.exists(store_filename):
+        print(f"❌ No spectrum store at {store_filename}.")
+        return None
+    spectrum_store = SpectrumStore(store_filename)
+    try:
+        render_start_time = time.perf_counter()
+        spectrum_window = spectrum_store.waterfall(series, start_time, stop_time, start_mhz, stop_mhz)
+        cycle_count = len(spectrum_store.cycles(series, start_time, stop_time))
+    finally:
+        spectrum_store.close()
+    if spectrum_window.levels_dbm.size == 0:
+        print(f"❌ The spectrum store holds no measurements of {series} in this time and frequency window.")
+        return None
+    print(f"🌊 Binned {cycle_count} cycles of {series} in {time.perf_counter() - render_start_time:.2f} s.")
+    if output_html_filename is None:
+        output_html_filename = os.path.join(os.getcwd(), "N9340 Scans", series, series + WATERFALL_FILE_SUFFIX)
+    plot_waterfall(spectrum_window, output_html_filename, f"{series} Waterfall", open_html_after_complete)
+    return output_html_filename
+
+
+def plot_spectrum_data(df, output_html_filename: str, plot_title: str, include_gov_markers: bool, include_tv_markers: bool, open_html_after_complete: bool, point_budget: int = DEFAULT_PLOT_POINT_BUDGET):
     """
     Generates an interactive Plotly Express line plot from the spectrum analyzer data.
     The plot is saved as an HTML file.
+    Scans with more than point_budget points are drawn from a min/max envelope of each band
+    (see minmax_downsample_indices), and the band markers are added as one list of shapes
+    and one text trace, so the HTML stays small however large the scan is.
 
     Args:
         df (pd.DataFrame): DataFrame containing 'Frequency (MHz)', 'Level (dBm)',
@@ -678,17 +3492,39 @@ def plot_spectrum_data(df: pd.DataFrame, output_html_filename: str, plot_title:
         include_gov_markers (bool): Whether to include Government frequency band markers.
         include_tv_markers (bool): Whether to include TV channel band markers.
         open_html_after_complete (bool): Whether to automatically open the generated HTML file.
+        point_budget (int): Most points to draw (0 or None to draw every point).
     """
+    # Imported here so scans that don't plot (e.g. the headless mode) never load plotly
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+
     print(f"\n--- 📊 Generating Interactive Plot: {output_html_filename} ---") # Moved emoji
 
+    # Reduce large scans to the min/max envelope on the (logarithmic) frequency axis
+    plot_df = df
+    if point_budget and len(df) > point_budget:
+        log_frequencies = np.log10(df['Frequency (MHz)'].to_numpy(dtype=np.float64))
+        band_codes, _ = pd.factorize(df['Band Name'])
+        kept_indices = minmax_downsample_indices(
+            log_frequencies, df['Level (dBm)'].to_numpy(), band_codes,
+            log_frequencies.min(), log_frequencies.max(), point_budget // 2
+        )
+        plot_df = df.iloc[kept_indices]
+        print(f"📉 Drawing {len(plot_df)} of {len(df)} points (min/max envelope for a {point_budget}-point budget).")
+
+    # Tag only the drawn points with their allocation and TV channel, for the hover text
+    plot_df = tag_band_allocations(plot_df)
+
     # Create Interactive Plot with Plotly Express
-    fig = px.line(df,
+    fig = px.line(plot_df,
                   x="Frequency (MHz)",
                   y="Level (dBm)",
                   color="Band Name",  # Differentiate lines by band name
                   title=plot_title, # Use the dynamic plot_title here
                   labels={"Frequency (MHz)": "Frequency (MHz)", "Level (dBm)": "Amplitude (dBm)"},
-                  hover_data={"Frequency (MHz)": ':.2f', "Level (dBm)": ':.2f', "Band Name": True}
+                  hover_data={"Frequency (MHz)": ':.2f', "Level (dBm)": ':.2f', "Band Name": True,
+                              "Allocation": True, "TV Channel": True}
                  )
 
     # Determine the full Y-axis range
@@ -719,6 +3555,14 @@ def plot_spectrum_data(df: pd.DataFrame, output_html_filename: str, plot_title:
                      tickformat=None,
                      range=[np.log10(x_min_data), np.log10(x_max_data)]) # Apply dynamic range here
 
+    # The band markers are collected first and added in one go:
+    # one list of rectangles and a single text trace for all labels
+    marker_shapes = []
+    label_x = []
+    label_y = []
+    label_text = []
+    label_color = []
+
     # --- Add TV Band Markers ---
     if include_tv_markers:
         # Define colors for the TV band markers and text
@@ -726,42 +3570,30 @@ def plot_spectrum_data(df: pd.DataFrame, output_html_filename: str, plot_title:
         tv_marker_text_color = "yellow"
         tv_band_fill_color = "rgba(255, 255, 0, 0.05)"   # Very light yellow, highly transparent fill
 
-        for band in TV_PLOT_BAND_MARKERS:
-            # Only add markers if they are within the actual scanned frequency range
-            if band["Start MHz"] < x_max_data and band["Stop MHz"] > x_min_data:
-                # Add a shaded rectangle to represent the frequency band allocation
-                fig.add_shape(
-                    type="rect",
-                    x0=band["Start MHz"],
-                    y0=y_range_min,  # Span full Y-axis range
-                    x1=band["Stop MHz"],
-                    y1=y_range_max,  # Span full Y-axis range
-                    line=dict(
-                        color=tv_marker_line_color,
-                        width=0.3,
-                        dash="dot",
-                    ),
-                    fillcolor=tv_band_fill_color,
-                    layer="below",
-                )
-
-                # Add text markers using go.Scatter with mode='text'
-                x_center = (band["Start MHz"] + band["Stop MHz"]) / 2
-                y_text_position = y_range_max - (y_range_max - y_range_min) * 0.05
-
-                fig.add_trace(go.Scatter(
-                    x=[x_center],
-                    y=[y_text_position],
-                    mode='text',
-                    text=[f"{band['Band Name']}<br>{band['Start MHz']:.1f}-{band['Stop MHz']:.1f} MHz"],
-                    textfont=dict(
-                        size=8,
-                        color=tv_marker_text_color
-                    ),
-                    showlegend=False,
-                    hoverinfo='text',
-                    name=f"Band Label: {band['Band Name']}"
-                ))
+        # Only the channels overlapping the actual scanned frequency range are looked at
+        for channel_index in TV_CHANNEL_INDEX.overlapping(x_min_data, x_max_data):
+            band = TV_CHANNEL_INDEX.band(channel_index)
+            # A shaded rectangle to represent the frequency band allocation
+            marker_shapes.append(dict(
+                type="rect",
+                x0=band["Start MHz"],
+                y0=y_range_min,  # Span full Y-axis range
+                x1=band["Stop MHz"],
+                y1=y_range_max,  # Span full Y-axis range
+                line=dict(
+                    color=tv_marker_line_color,
+                    width=0.3,
+                    dash="dot",
+                ),
+                fillcolor=tv_band_fill_color,
+                layer="below",
+            ))
+
+            # The label, centred over the band near the top of the plot
+            label_x.append((band["Start MHz"] + band["Stop MHz"]) / 2)
+            label_y.append(y_range_max - (y_range_max - y_range_min) * 0.05)
+            label_text.append(f"{band['Band Name']}<br>{band['Start MHz']:.1f}-{band['Stop MHz']:.1f} MHz")
+            label_color.append(tv_marker_text_color)
 
     # --- Add Government Band Markers ---
     if include_gov_markers:
@@ -777,45 +3609,47 @@ def plot_spectrum_data(df: pd.DataFrame, output_html_filename: str, plot_title:
         y_offset_level_4 = 0.35
         y_offset_levels = [y_offset_level_1, y_offset_level_2, y_offset_level_3, y_offset_level_4]
 
-        for i, band in enumerate(GOV_PLOT_BAND_MARKERS):
-            # Only add markers if they are within the actual scanned frequency range
-            if band["Start MHz"] < x_max_data and band["Stop MHz"] > x_min_data:
-                # Add a shaded rectangle to represent the frequency band allocation
-                fig.add_shape(
-                    type="rect",
-                    x0=band["Start MHz"],
-                    y0=y_range_min,
-                    x1=band["Stop MHz"],
-                    y1=y_range_max,
-                    line=dict(
-                        color=gov_marker_line_color,
-                        width=0.3,
-                        dash="dot",
-                    ),
-                    fillcolor=gov_band_fill_color,
-                    layer="below",
-                )
-
-                # Add text markers using go.Scatter with mode='text'
-                x_center = (band["Start MHz"] + band["Stop MHz"]) / 2
-
-                # Determine the Y position based on staggering using modulo for 4 levels
-                current_y_offset = y_offset_levels[i % len(y_offset_levels)]
-                y_text_position = y_range_max - (y_range_max - y_range_min) * current_y_offset
-
-                fig.add_trace(go.Scatter(
-                    x=[x_center],
-                    y=[y_text_position],
-                    mode='text',
-                    text=[f"{band['Band Name']}<br>{band['Start MHz']:.1f}-{band['Stop MHz']:.1f} MHz"],
-                    textfont=dict(
-                        size=8,
-                        color=gov_marker_text_color
-                    ),
-                    showlegend=False,
-                    hoverinfo='text',
-                    name=f"Band Label: {band['Band Name']}"
-                ))
+        # Only the allocations overlapping the actual scanned frequency range are looked at
+        for i in GOV_BAND_INDEX.overlapping(x_min_data, x_max_data):
+            band = GOV_BAND_INDEX.band(i)
+            # A shaded rectangle to represent the frequency band allocation
+            marker_shapes.append(dict(
+                type="rect",
+                x0=band["Start MHz"],
+                y0=y_range_min,
+                x1=band["Stop MHz"],
+                y1=y_range_max,
+                line=dict(
+                    color=gov_marker_line_color,
+                    width=0.3,
+                    dash="dot",
+                ),
+                fillcolor=gov_band_fill_color,
+                layer="below",
+            ))
+
+            # Determine the Y position based on staggering using modulo for 4 levels
+            current_y_offset = y_offset_levels[i % len(y_offset_levels)]
+            label_x.append((band["Start MHz"] + band["Stop MHz"]) / 2)
+            label_y.append(y_range_max - (y_range_max - y_range_min) * current_y_offset)
+            label_text.append(f"{band['Band Name']}<br>{band['Start MHz']:.1f}-{band['Stop MHz']:.1f} MHz")
+            label_color.append(gov_marker_text_color)
+
+    if marker_shapes:
+        fig.update_layout(shapes=marker_shapes)
+        fig.add_trace(go.Scatter(
+            x=label_x,
+            y=label_y,
+            mode='text',
+            text=label_text,
+            textfont=dict(
+                size=8,
+                color=label_color
+            ),
+            showlegend=False,
+            hoverinfo='text',
+            name="Band Labels"
+        ))
 
     # Apply Dark Mode Theme
     fig.update_layout(template="plotly_dark")
@@ -825,14 +3659,135 @@ def plot_spectrum_data(df: pd.DataFrame, output_html_filename: str, plot_title:
     print(f"🖼️ --- Plotly Express Interactive Plot Generated and saved to {output_html_filename} ---") # Moved emoji
 
 
-def wait_with_interrupt(wait_time_seconds):
+class ScanAborted(Exception):
+    """Raised inside the scan when a stop was requested through ScanControl."""
+
+
+class ScanControl:
+    """
+    Channel between the scan engine (run_spectrum_scan_logic / scan_bands, running in a worker thread)
+    and the GUI. The scan publishes progress events to a queue that the Tk window polls with after(),
+    and checks in with checkpoint() before every segment so it can be paused, resumed or stopped.
+
+    Events are dictionaries with a "type" key:
+        "cycle"    - a scan cycle started (cycle)
+        "segment"  - a segment is about to be scanned (band_index, band_count, band_name, segment, segment_count,
+                     overall_fraction, points, points_per_second, eta_seconds, frequency_mhz)
+        "segment_data" - a segment's data landed (band_index, frequencies_mhz, levels_dbm; the arrays are not modified later)
+        "band"     - a band finished (band_index, band_name, points)
+        "cycle_complete" - a cycle's files were written (cycle, csv_filename, points)
+        "waiting"  - the countdown to the next cycle (seconds_remaining)
+        "status"   - a message for the status line (message)
+        "metrics"  - the periodic VISA metrics summary, when recording them (summary)
+        "error"    - an error the GUI should show (title, message)
+        "paused" / "resumed" / "stopped" / "finished"
+    Without an event queue (console use) events are simply dropped.
+    In multi-instrument scans each instrument's thread gets its own control from for_instrument(),
+    whose events also carry the instrument's address ("instrument").
+    """
+
+    def __init__(self, events=None):
+        """
+        Args:
+            events (queue.Queue): Queue the progress events are put on, or None to drop them.
+        """
+        self.events = events
+        self.stop_event = threading.Event()
+        self.resume_event = threading.Event() # Set while running, cleared while paused
+        self.resume_event.set()
+        self.skip_wait_event = threading.Event()
+        self.event_fields = {} # Added to every published event
+
+    def for_instrument(self, instrument_address):
+        """
+        Returns a control for one instrument's scan thread. It shares this control's queue and
+        its stop, pause and skip-wait requests, and tags its events with instrument=instrument_address.
+        """
+        instrument_control = ScanControl(self.events)
+        instrument_control.stop_event = self.stop_event
+        instrument_control.resume_event = self.resume_event
+        instrument_control.skip_wait_event = self.skip_wait_event
+        instrument_control.event_fields = {"instrument": instrument_address}
+        return instrument_control
+
+    def publish(self, event_type, **fields):
+        """Puts an event on the queue (if there is one)."""
+        if self.events is not None:
+            fields.update(self.event_fields)
+            fields["type"] = event_type
+            self.events.put(fields)
+
+    def request_stop(self):
+        """Asks the scan to stop at the next checkpoint (a paused scan is released so it can stop)."""
+        self.stop_event.set()
+        self.resume_event.set()
+
+    def pause(self):
+        self.resume_event.clear()
+        self.publish("paused")
+
+    def resume(self):
+        self.resume_event.set()
+        self.publish("resumed")
+
+    def skip_wait(self):
+        """Ends the wait between cycles early."""
+        self.skip_wait_event.set()
+
+    @property
+    def paused(self):
+        return not self.resume_event.is_set()
+
+    def checkpoint(self):
+        """
+        Called by the scan between segments: blocks while paused and raises ScanAborted if a stop was requested.
+        """
+        self.resume_event.wait()
+        if self.stop_event.is_set():
+            raise ScanAborted()
+
+
+class BenchmarkScanControl(ScanControl):
+    """
+    ScanControl for run_acquisition_benchmark: instead of queueing events, it notes when each band
+    finishes and how many points the scan had by then, for the per-band points/second.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.band_finishes = [] # (band_index, perf_counter time, total points so far)
+
+    def publish(self, event_type, **fields):
+        if event_type == "band":
+            self.band_finishes.append((fields["band_index"], time.perf_counter(), fields["points"]))
+
+
+def wait_with_interrupt(wait_time_seconds, scan_control=None):
     """
     Provides a timed delay with user interruption capability.
     Allows skipping the wait, quitting the program, or resuming.
+    With a scan_control (GUI mode) the countdown is published as "waiting" events instead,
+    and the GUI's skip, pause and stop buttons replace the Ctrl+C prompt.
 
     Args:
         wait_time_seconds (int): The total time to wait in seconds.
+        scan_control (ScanControl): The GUI's control channel, or None for the console prompt.
     """
+    if scan_control is not None and scan_control.events is not None:
+        scan_control.skip_wait_event.clear()
+        seconds_remaining = int(wait_time_seconds)
+        while seconds_remaining > 0:
+            scan_control.checkpoint()
+            scan_control.publish("waiting", seconds_remaining=seconds_remaining)
+            # Wait one second, or less if the skip button is pressed
+            if scan_control.skip_wait_event.wait(1):
+                print("⏩ Skipping remaining wait time. Starting next scan shortly...")
+                break
+            if not scan_control.paused:
+                seconds_remaining -= 1
+        scan_control.checkpoint()
+        return
+
     print("\n" + "="*50)
     print(f"⏰ Next full scan cycle in {wait_time_seconds // 60} minutes and {wait_time_seconds % 60} seconds.") # Moved emoji
     print("🛑 Press Ctrl+C at any time during the countdown to interact.") # Moved emoji
@@ -870,23 +3825,41 @@ def wait_with_interrupt(wait_time_seconds):
         sys.stdout.flush()
 
 
-def check_and_install_dependencies():
+def format_duration(seconds):
+    """
+    Formats a number of seconds as HH:MM:SS for the progress display.
+    Args:
+        seconds (float): The duration in seconds.
+    Returns:
+        str: The duration, e.g. "00:03:12".
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def check_and_install_dependencies(include_plotting=True, interactive=True):
     """
     Checks if required Python modules are installed and offers to install them.
     If modules are missing and the user agrees, it attempts to install them via pip.
+    The modules are only looked up, not imported, so the check doesn't slow down the start.
+
+    Args:
+        include_plotting (bool): Whether plotly is required (not for a headless scan without plots).
+        interactive (bool): Whether to offer the installation. If False (headless mode), missing modules
+                            are listed and the program exits, instead of waiting for an answer.
     """
     required_modules = {
         "pyvisa": "pyvisa",
         "numpy": "numpy",
         "pandas": "pandas",
-        "plotly": "plotly",
     }
+    if include_plotting:
+        required_modules["plotly"] = "plotly"
 
     missing_modules = []
     for module_name, pip_name in required_modules.items():
-        try:
-            __import__(module_name)
-        except ImportError:
+        if importlib.util.find_spec(module_name) is None:
             missing_modules.append(pip_name)
 
     if missing_modules:
@@ -895,6 +3868,10 @@ def check_and_install_dependencies():
         for module in missing_modules:
             print(f"📦 - {module}") # Moved emoji
         print("----------------------------")
+        if not interactive:
+            for module in missing_modules:
+                print(f"pip install {module}")
+            sys.exit(1)
 
         install_choice = input("Do you want to attempt to install them now? (y/n): ").strip().lower()
         if install_choice == 'y':
@@ -922,18 +3899,170 @@ def check_and_install_dependencies():
     else:
         print("\n✨ All required Python modules are already installed.") # Moved emoji
 
+def load_gui_modules():
+    """Imports tkinter for the GUI (LiveSpectrumView and ScanApp). The headless mode never calls it."""
+    global tk, messagebox, ttk
+    import tkinter as tk
+    from tkinter import messagebox
+    from tkinter import ttk
+
+
+class LiveSpectrumView:
+    """
+    A window that draws the spectrum while the scan is running.
+    Every segment that lands is folded into a per-pixel min/max envelope (see minmax_bins),
+    so a redraw only draws one vertical line per pixel column, however many points the cycle has.
+    """
+
+    def __init__(self, master, range_start_mhz, range_stop_mhz, title):
+        """
+        Args:
+            master (tk.Tk): The main window.
+            range_start_mhz (float): Lowest frequency of the selected bands.
+            range_stop_mhz (float): Highest frequency of the selected bands.
+            title (str): Window title (the scan series name).
+        """
+        self.range_start_mhz = range_start_mhz
+        self.range_stop_mhz = range_stop_mhz
+        self.window = tk.Toplevel(master)
+        self.window.title(f"Live Spectrum - {title}")
+        self.window.geometry(LIVE_VIEW_GEOMETRY)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.canvas = tk.Canvas(self.window, bg="white", highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True)
+        self.canvas.bind("<Configure>", self.on_resize)
+
+        self.segments = [] # (frequencies_mhz, levels_dbm) of every segment this cycle, to re-bin after a resize
+        self.point_count = 0
+        self.bin_count = 0
+        self.bin_min = np.empty(0)
+        self.bin_max = np.empty(0)
+        self.needs_redraw = True
+        self.last_redraw_ms = 0.0
+
+    @property
+    def is_open(self):
+        return self.window is not None
+
+    def close(self):
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+
+    def clear(self):
+        """Starts a new cycle: forgets all points."""
+        self.segments = []
+        self.point_count = 0
+        self.bin_min[:] = np.nan
+        self.bin_max[:] = np.nan
+        self.needs_redraw = True
+
+    def add_segment(self, frequencies_mhz, levels_dbm):
+        """Folds a newly acquired segment into the envelope; the window is redrawn on the next redraw_if_needed()."""
+        self.segments.append((frequencies_mhz, levels_dbm))
+        self.point_count += len(frequencies_mhz)
+        if self.bin_count > 0:
+            segment_min, segment_max = minmax_bins(frequencies_mhz, levels_dbm, self.range_start_mhz, self.range_stop_mhz, self.bin_count)
+            self.bin_min = np.fmin(self.bin_min, segment_min)
+            self.bin_max = np.fmax(self.bin_max, segment_max)
+        self.needs_redraw = True
+
+    def on_resize(self, event):
+        """Rebuilds the envelope for the new plot width (one bin per pixel column)."""
+        bin_count = max(event.width - LIVE_VIEW_MARGINS[0] - LIVE_VIEW_MARGINS[2], 1)
+        if bin_count == self.bin_count:
+            self.needs_redraw = True
+            return
+        self.bin_count = bin_count
+        self.bin_min = np.full(bin_count, np.nan)
+        self.bin_max = np.full(bin_count, np.nan)
+        if self.segments:
+            segment_min, segment_max = minmax_bins(
+                np.concatenate([frequencies for frequencies, _ in self.segments]),
+                np.concatenate([levels for _, levels in self.segments]),
+                self.range_start_mhz, self.range_stop_mhz, bin_count
+            )
+            self.bin_min, self.bin_max = segment_min, segment_max
+        self.needs_redraw = True
+
+    def redraw_if_needed(self):
+        """Redraws the canvas if data arrived or the window changed size since the last redraw."""
+        if self.window is None or not self.needs_redraw or self.bin_count == 0:
+            return
+        redraw_start_time = time.perf_counter()
+        self.needs_redraw = False
+        canvas = self.canvas
+        canvas.delete("all")
+        left, top, right, bottom = LIVE_VIEW_MARGINS
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        plot_bottom = height - bottom
+        plot_height = max(plot_bottom - top, 1)
+
+        # Level axis: 10 dB steps around the data (or a default range before any data arrives)
+        if np.all(np.isnan(self.bin_max)):
+            level_low, level_high = -110.0, -20.0
+        else:
+            level_low = np.floor((np.nanmin(self.bin_min) - 5) / 10) * 10
+            level_high = np.ceil((np.nanmax(self.bin_max) + 5) / 10) * 10
+
+        def level_to_y(level_dbm):
+            return plot_bottom - (level_dbm - level_low) / (level_high - level_low) * plot_height
+
+        for level_dbm in np.arange(level_low, level_high + 1, 10):
+            y = level_to_y(level_dbm)
+            canvas.create_line(left, y, width - right, y, fill="gray90")
+            canvas.create_text(left - 4, y, text=f"{level_dbm:.0f}", anchor="e", font=("TkDefaultFont", 8))
+        for tick_mhz in np.linspace(self.range_start_mhz, self.range_stop_mhz, LIVE_VIEW_FREQUENCY_TICKS):
+            x = left + (tick_mhz - self.range_start_mhz) / (self.range_stop_mhz - self.range_start_mhz) * self.bin_count
+            canvas.create_line(x, top, x, plot_bottom, fill="gray90")
+            canvas.create_text(x, plot_bottom + 4, text=f"{tick_mhz:.0f}", anchor="n", font=("TkDefaultFont", 8))
+        canvas.create_text(left, 4, text="dBm", anchor="nw", font=("TkDefaultFont", 8))
+
+        # The envelope: one min-to-max stroke per pixel column, as one polyline per run of filled columns
+        filled = ~np.isnan(self.bin_max)
+        if filled.any():
+            column_x = left + np.arange(self.bin_count, dtype=np.float64)
+            y_max = level_to_y(self.bin_max)
+            y_min = level_to_y(self.bin_min)
+            run_edges = np.flatnonzero(np.diff(np.r_[0, filled.astype(np.int8), 0]))
+            for run_start, run_stop in zip(run_edges[::2], run_edges[1::2]):
+                run_points_xy = np.empty(((run_stop - run_start) * 2, 2), dtype=np.float64)
+                run_points_xy[0::2, 0] = column_x[run_start:run_stop]
+                run_points_xy[1::2, 0] = column_x[run_start:run_stop]
+                run_points_xy[0::2, 1] = y_max[run_start:run_stop]
+                run_points_xy[1::2, 1] = y_min[run_start:run_stop]
+                if run_points_xy.shape[0] == 2:
+                    run_points_xy = np.vstack((run_points_xy, run_points_xy[-1] + (1, 0))) # A single column still needs a visible stroke
+                canvas.create_line(*run_points_xy.ravel().tolist(), fill="blue", width=1)
+
+        self.last_redraw_ms = (time.perf_counter() - redraw_start_time) * 1000
+        canvas.create_text(width - right, 4, anchor="ne", font=("TkDefaultFont", 8), fill="gray40",
+                           text=f"{self.point_count} points | redraw {self.last_redraw_ms:.1f} ms")
+
+
 class ScanApp:
     def __init__(self, master):
         self.master = master
         master.title("Spectrum Analyzer Scan Configuration")
-        master.geometry("700x700") # Adjusted width to 700 pixels, height to 700 pixels
+        master.geometry("700x900") # Adjusted width to 700 pixels, height to 900 pixels (room for the progress and plan panels)
 
         # Variables to hold input values
         self.scan_name_var = tk.StringVar(value="My_Spectrum_Scan")
         self.rbw_step_size_var = tk.StringVar(value=str(DEFAULT_RBW_STEP_SIZE_HZ))
         self.max_hold_time_var = tk.StringVar(value=str(DEFAULT_MAXHOLD_TIME_SECONDS)) # Changed to StringVar for OptionMenu
         self.cycle_wait_time_var = tk.StringVar(value=str(DEFAULT_CYCLE_WAIT_TIME_SECONDS))
+        self.acquisition_mode_var = tk.StringVar(value=DEFAULT_ACQUISITION_MODE) # "Marker", "Trace" or "Adaptive" data collection
+        self.adaptive_threshold_var = tk.StringVar(value=str(DEFAULT_ADAPTIVE_THRESHOLD_DB)) # dB above the noise floor ("Adaptive" mode)
+        self.output_format_var = tk.StringVar(value=DEFAULT_OUTPUT_FORMAT) # "CSV" or "CSV + NPZ"
         self.visa_address_var = tk.StringVar(value="Not Connected") # To display the VISA address
+        self.use_simulator_var = tk.BooleanVar(value=False) # Run against SimulatedN9340B instead of a real instrument
+        self.multi_instrument_var = tk.BooleanVar(value=False) # Split the bands across every connected analyzer
+        self.record_visa_metrics_var = tk.BooleanVar(value=False) # Record VISA statistics and a timeline of each cycle
+        self.update_statistics_var = tk.BooleanVar(value=True) # Keep running statistics of the series per frequency
+        self.level_histograms_var = tk.BooleanVar(value=False) # ... with level histograms for percentiles
+        self.update_store_var = tk.BooleanVar(value=False) # Add every cycle to the spectrum store (opt-in, it grows by ~0.3 GB a day)
+        self.instrument_addresses = [] # Analyzers found in multi-instrument mode
         self.instrument_instance = None # To hold the instrument object
 
         # New variables for instrument configuration controls
@@ -957,7 +4086,28 @@ class ScanApp:
         self.include_tv_markers_var = tk.BooleanVar(value=True)
         self.open_html_after_complete_var = tk.BooleanVar(value=True) # New variable for "Open HTML after complete"
 
+        # The scan runs in a worker thread and reports back through a ScanControl queue
+        self.scan_thread = None
+        self.scan_control = None
+        self.live_view = None # LiveSpectrumView window of the running (or last) scan
+        self.scan_status_var = tk.StringVar(value="Idle")
+        self.scan_detail_var = tk.StringVar(value="")
+        self.visa_metrics_var = tk.StringVar(value="") # Latest VISA metrics summary (with record_visa_metrics_var)
+        self.scan_progress_var = tk.DoubleVar(value=0.0) # Percent of the current cycle
+        self.instrument_progress = {} # Multi-instrument scans: fraction of its part each instrument has done
+
+        # Scan planner: predicted cost of a cycle with the current settings (see plan_scan)
+        self.scan_plan_var = tk.StringVar(value="")
+        self.target_cycle_time_var = tk.StringVar(value="3600") # Seconds, for "Fit Step Size to Target"
+
         self.create_widgets()
+
+        # Re-plan whenever a setting that changes the scan's duration changes
+        for plan_var in (self.rbw_step_size_var, self.max_hold_time_var, self.cycle_wait_time_var, self.acquisition_mode_var, self.rbw_config_var):
+            plan_var.trace_add("write", self.update_scan_plan)
+        for _, band_var in self.band_vars:
+            band_var.trace_add("write", self.update_scan_plan)
+        master.protocol("WM_DELETE_WINDOW", self.quit_app) # Closing the window stops a running scan cleanly
         self.connect_and_display_visa() # Attempt connection on startup
 
     def create_widgets(self):
@@ -967,6 +4117,10 @@ class ScanApp:
         tk.Label(visa_info_frame, text="Connected Instrument:").pack(side=tk.LEFT)
         self.visa_address_label = tk.Label(visa_info_frame, textvariable=self.visa_address_var, fg="blue")
         self.visa_address_label.pack(side=tk.LEFT)
+        self.use_simulator_checkbutton = tk.Checkbutton(visa_info_frame, text="Use Simulated Instrument (offline)", variable=self.use_simulator_var, command=self.connect_and_display_visa)
+        self.use_simulator_checkbutton.pack(side=tk.LEFT, padx=(10, 0))
+        self.multi_instrument_checkbutton = tk.Checkbutton(visa_info_frame, text="Use All Analyzers", variable=self.multi_instrument_var, command=self.connect_and_display_visa)
+        self.multi_instrument_checkbutton.pack(side=tk.LEFT, padx=(10, 0))
 
         # Frame for buttons (Start Scan, System Restart, Reset, Quit)
         button_row_frame = tk.Frame(self.master)
@@ -976,10 +4130,42 @@ class ScanApp:
         self.start_scan_button = tk.Button(button_row_frame, text="Start Scan", command=self.start_scan, state=tk.DISABLED, bg="green", fg="white") # Set fg to white
         self.start_scan_button.pack(side=tk.LEFT, padx=5)
         
-        tk.Button(button_row_frame, text="System Restart", command=self.system_restart).pack(side=tk.LEFT, padx=5)
-        tk.Button(button_row_frame, text="Reset Instrument", command=self.reset_instrument).pack(side=tk.LEFT, padx=5)
+        self.system_restart_button = tk.Button(button_row_frame, text="System Restart", command=self.system_restart)
+        self.system_restart_button.pack(side=tk.LEFT, padx=5)
+        self.reset_instrument_button = tk.Button(button_row_frame, text="Reset Instrument", command=self.reset_instrument)
+        self.reset_instrument_button.pack(side=tk.LEFT, padx=5)
+        tk.Button(button_row_frame, text="Waterfall", command=self.show_waterfall).pack(side=tk.LEFT, padx=5)
         tk.Button(button_row_frame, text="Quit", command=self.quit_app).pack(side=tk.LEFT, padx=5)
 
+        # --- Scan Progress (live while the scan runs in the background) ---
+        progress_frame = tk.LabelFrame(self.master, text="Scan Progress")
+        progress_frame.pack(fill="x", padx=10, pady=(0, 5))
+
+        progress_buttons_frame = tk.Frame(progress_frame)
+        progress_buttons_frame.pack(anchor="w", pady=(5, 2))
+        self.pause_button = tk.Button(progress_buttons_frame, text="Pause", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.stop_button = tk.Button(progress_buttons_frame, text="Stop Scan", command=self.stop_scan, state=tk.DISABLED)
+        self.stop_button.pack(side=tk.LEFT, padx=5)
+        self.skip_wait_button = tk.Button(progress_buttons_frame, text="Skip Wait", command=self.skip_wait, state=tk.DISABLED)
+        self.skip_wait_button.pack(side=tk.LEFT, padx=5)
+
+        ttk.Progressbar(progress_frame, variable=self.scan_progress_var, maximum=100).pack(fill="x", padx=5, pady=2)
+        tk.Label(progress_frame, textvariable=self.scan_status_var, anchor="w").pack(fill="x", padx=5)
+        tk.Label(progress_frame, textvariable=self.scan_detail_var, anchor="w", fg="gray25").pack(fill="x", padx=5, pady=(0, 5))
+        tk.Label(progress_frame, textvariable=self.visa_metrics_var, anchor="w", justify=tk.LEFT, fg="gray25", font=("Courier", 8)).pack(fill="x", padx=5)
+
+        # --- Scan Plan (predicted before the scan starts) ---
+        plan_frame = tk.LabelFrame(self.master, text="Scan Plan")
+        plan_frame.pack(fill="x", padx=10, pady=(0, 5))
+        tk.Label(plan_frame, textvariable=self.scan_plan_var, anchor="w", justify=tk.LEFT).pack(fill="x", padx=5, pady=(5, 2))
+
+        target_frame = tk.Frame(plan_frame)
+        target_frame.pack(anchor="w", pady=(0, 5))
+        tk.Label(target_frame, text="Target Cycle Time (seconds):").pack(side=tk.LEFT, padx=(5, 2))
+        tk.Entry(target_frame, textvariable=self.target_cycle_time_var, width=10).pack(side=tk.LEFT)
+        tk.Button(target_frame, text="Fit Step Size to Target", command=self.fit_step_size_to_target).pack(side=tk.LEFT, padx=5)
+
 
         # Main frame for left and right columns (rest of the inputs)
         main_layout_frame = tk.Frame(self.master)
@@ -1012,6 +4198,31 @@ class ScanApp:
         self.cycle_wait_time_entry = tk.Entry(scan_params_frame, textvariable=self.cycle_wait_time_var, width=20)
         self.cycle_wait_time_entry.pack(pady=2, anchor="w")
 
+        # --- Acquisition Mode (Dropdown) ---
+        tk.Label(scan_params_frame, text="Acquisition Mode:").pack(pady=(10, 2), anchor="w")
+        self.acquisition_mode_menu = tk.OptionMenu(scan_params_frame, self.acquisition_mode_var, *ACQUISITION_MODES)
+        self.acquisition_mode_menu.pack(pady=2, anchor="w")
+        self.acquisition_mode_menu.config(width=10)
+
+        # --- Adaptive Threshold ---
+        tk.Label(scan_params_frame, text="Adaptive Threshold (dB above floor):").pack(pady=(10, 2), anchor="w")
+        self.adaptive_threshold_entry = tk.Entry(scan_params_frame, textvariable=self.adaptive_threshold_var, width=20)
+        self.adaptive_threshold_entry.pack(pady=2, anchor="w")
+
+        # --- Output Format (Dropdown) ---
+        tk.Label(scan_params_frame, text="Output Format:").pack(pady=(10, 2), anchor="w")
+        self.output_format_menu = tk.OptionMenu(scan_params_frame, self.output_format_var, *OUTPUT_FORMATS)
+        self.output_format_menu.pack(pady=2, anchor="w")
+        self.output_format_menu.config(width=10)
+
+        # --- VISA Metrics ---
+        tk.Checkbutton(scan_params_frame, text="Record VISA metrics and timeline", variable=self.record_visa_metrics_var).pack(pady=(10, 2), anchor="w")
+
+        # --- Running Statistics ---
+        tk.Checkbutton(scan_params_frame, text="Keep running statistics per frequency", variable=self.update_statistics_var).pack(pady=(2, 2), anchor="w")
+        tk.Checkbutton(scan_params_frame, text="Include level percentiles", variable=self.level_histograms_var).pack(pady=(0, 2), anchor="w")
+        tk.Checkbutton(scan_params_frame, text="Add cycles to the spectrum store", variable=self.update_store_var).pack(pady=(0, 2), anchor="w")
+
         # --- Instrument Configuration Options (Middle Column) ---
         config_frame = tk.LabelFrame(main_layout_frame, text="Instrument Initial Configuration")
         config_frame.pack(side=tk.LEFT, padx=(0, 10), anchor="nw", fill="y") # Anchor North-West for top-left alignment
@@ -1076,6 +4287,56 @@ class ScanApp:
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
     
+    def scan_plan_settings(self):
+        """
+        Reads the settings the scan planner needs from the GUI.
+        Returns:
+            dict: plan_scan's arguments (without the step size) plus "cycle_wait_time".
+        Raises:
+            ValueError: If a numeric field is not a number.
+        """
+        return {
+            "selected_bands": [band for band, var in self.band_vars if var.get()],
+            "acquisition_mode": self.acquisition_mode_var.get(),
+            "max_hold_time": float(self.max_hold_time_var.get()),
+            "rbw_config_val": self.rbw_config_var.get(),
+            "instrument_count": max(1, len(self.instrument_addresses)) if self.multi_instrument_var.get() else 1,
+            "cycle_wait_time": float(self.cycle_wait_time_var.get()),
+        }
+
+    def update_scan_plan(self, *_):
+        """Shows the predicted segments, round trips, data and time of a cycle with the current settings."""
+        try:
+            plan_settings = self.scan_plan_settings()
+            rbw = float(self.rbw_step_size_var.get())
+        except ValueError:
+            self.scan_plan_var.set("Enter valid numbers to see the scan plan.")
+            return
+        cycle_wait_time = plan_settings.pop("cycle_wait_time")
+        if rbw <= 0 or not plan_settings["selected_bands"]:
+            self.scan_plan_var.set("Select at least one band and a positive RBW step size to see the scan plan.")
+            return
+        self.scan_plan_var.set(describe_scan_plan(plan_scan(step_hz=rbw, **plan_settings), cycle_wait_time))
+
+    def fit_step_size_to_target(self):
+        """Sets the RBW step size to the finest one (a multiple of CSV_FREQUENCY_RESOLUTION_HZ) whose cycle fits in the target cycle time."""
+        try:
+            plan_settings = self.scan_plan_settings()
+            target_cycle_seconds = float(self.target_cycle_time_var.get())
+        except ValueError:
+            messagebox.showerror("Input Error", "Please ensure the target cycle time and all numerical inputs are valid numbers.")
+            return
+        if not plan_settings["selected_bands"]:
+            messagebox.showerror("Input Error", "Please select at least one frequency band to scan.")
+            return
+        step_hz = solve_step_size_for_cycle_time(target_cycle_seconds=target_cycle_seconds, **plan_settings)
+        if step_hz is None:
+            messagebox.showwarning("Scan Plan", f"No step size fits a {format_duration(target_cycle_seconds)} cycle with these settings. "
+                                                "Try a shorter max hold time or cycle wait, a wider RBW, or fewer bands.")
+            return
+        self.rbw_step_size_var.set(str(step_hz)) # Re-plans through the variable trace
+        print(f"🗓️ Finest step size for a {format_duration(target_cycle_seconds)} cycle: {step_hz} Hz.")
+
     def validate_numeric_input(self, P):
         """Validates that the input is a valid number (integer or float), including negative signs."""
         if P.strip() == "": # Allow empty string for temporary input clearing
@@ -1087,18 +4348,39 @@ class ScanApp:
             return False
 
     def connect_and_display_visa(self):
-        """Attempts to connect to the VISA instrument and display its address."""
-        rm = pyvisa.ResourceManager()
-        available_resources = rm.list_resources()
+        """Attempts to connect to the VISA instrument (or the simulated one) and display its address."""
+        # Close any previous connection, e.g. when switching between real and simulated instruments
+        if self.instrument_instance:
+            try:
+                self.instrument_instance.close()
+            except Exception as e:
+                print(f"Error closing previous instrument connection: {e}")
+            self.instrument_instance = None
+
+        if self.use_simulator_var.get():
+            rm = None # The simulated instrument does not need a VISA backend
+            available_resources = simulated_instrument_addresses(SIMULATED_INSTRUMENT_COUNT if self.multi_instrument_var.get() else 1)
+        else:
+            rm = pyvisa.ResourceManager()
+            available_resources = rm.list_resources()
+
+        # In multi-instrument mode only the analyzers that answer *IDN? as an N9340 are used
+        self.instrument_addresses = []
+        if self.multi_instrument_var.get():
+            self.instrument_addresses = [address for address, _ in discover_instruments(rm, available_resources)]
+            available_resources = self.instrument_addresses
 
         if available_resources:
             instrument_address = available_resources[0]
-            self.visa_address_var.set(instrument_address)
+            if len(self.instrument_addresses) > 1:
+                self.visa_address_var.set(f"{instrument_address} (+{len(self.instrument_addresses) - 1} more)")
+            else:
+                self.visa_address_var.set(instrument_address)
             print(f"🔌 Automatically selected instrument: {instrument_address}")
             
             # Attempt to open the resource (without full initialization) to check connectivity
             try:
-                temp_inst = rm.open_resource(instrument_address)
+                temp_inst = open_instrument(rm, instrument_address)
                 # Now, perform the full initialization with GUI settings
                 if initialize_instrument(
                     temp_inst,
@@ -1142,6 +4424,7 @@ class ScanApp:
             self.visa_address_label.config(fg="red")
             self.start_scan_button.config(state=tk.DISABLED, bg="lightgray") # Disable and color grey
             print("🚫 Error: No VISA instruments found. Please ensure your instrument is connected and drivers are installed.")
+        self.update_scan_plan() # The number of analyzers changes the multi-instrument plan
 
     def system_restart(self): # Renamed from system_power_off
         """Sends a system restart command to the connected instrument."""
@@ -1177,6 +4460,14 @@ class ScanApp:
         else:
             messagebox.showwarning("No Instrument", "No instrument connected to send reset command.")
 
+    def show_waterfall(self):
+        """Renders the waterfall of the scan series' history in the spectrum store and opens it (in the background, as it may take seconds)."""
+        scan_name = self.scan_name_var.get().strip()
+        if not scan_name:
+            messagebox.showerror("Input Error", "Scan Series Name cannot be empty.")
+            return
+        threading.Thread(target=render_series_waterfall, args=(scan_name.replace(" ", "_"),), daemon=True).start()
+
     def start_scan(self):
         try:
             # Ensure instrument is connected before starting scan
@@ -1192,6 +4483,7 @@ class ScanApp:
             rbw = float(self.rbw_step_size_var.get())
             max_hold_time = float(self.max_hold_time_var.get())
             cycle_wait_time = float(self.cycle_wait_time_var.get())
+            adaptive_threshold_db = float(self.adaptive_threshold_var.get())
 
             # Get the RBW and VBW configuration values from the GUI
             rbw_config = self.rbw_config_var.get()
@@ -1207,6 +4499,9 @@ class ScanApp:
             if cycle_wait_time < 0:
                 messagebox.showerror("Input Error", "Cycle Wait Time cannot be negative.")
                 return
+            if adaptive_threshold_db <= 0:
+                messagebox.showerror("Input Error", "Adaptive Threshold must be a positive number of dB.")
+                return
 
             selected_bands = [band for band, var in self.band_vars if var.get()]
             if not selected_bands:
@@ -1216,12 +4511,23 @@ class ScanApp:
             include_gov = self.include_gov_markers_var.get()
             include_tv = self.include_tv_markers_var.get()
             open_html = self.open_html_after_complete_var.get() # Get the new checkbox value
-
-            # Close the GUI window before starting the scan
-            self.master.destroy()
-
-            # Call the main scan logic with the collected parameters
-            run_spectrum_scan_logic(
+            acquisition_mode = self.acquisition_mode_var.get()
+            instrument_settings = {
+                "clear_reset": self.clear_reset_var.get(),
+                "preamplifier_on": self.preamplifier_var.get(),
+                "display_log": self.display_log_var.get(),
+                "ref_level": float(self.ref_level_var.get()),
+                "max_hold_on": self.max_hold_var.get(),
+            }
+
+            # The scan opens its own connection, so release the GUI's one while it runs
+            self.instrument_instance.close()
+            self.instrument_instance = None
+
+            # Run the main scan logic in a worker thread so the window stays responsive;
+            # progress comes back through the ScanControl queue (see poll_scan_events)
+            self.scan_control = ScanControl(queue.Queue())
+            self.scan_thread = threading.Thread(target=run_spectrum_scan_logic, daemon=True, kwargs=dict(
                 scan_name=scan_name,
                 rbw_step_size=rbw,
                 max_hold_time=max_hold_time,
@@ -1231,15 +4537,152 @@ class ScanApp:
                 include_tv_markers=include_tv,
                 rbw_config_val=rbw_config, # Pass new parameters
                 vbw_config_val=vbw_config,  # Pass new parameters
-                open_html_after_complete=open_html # Pass the new parameter
+                open_html_after_complete=open_html, # Pass the new parameter
+                acquisition_mode=acquisition_mode,
+                use_simulator=self.use_simulator_var.get(),
+                output_format=self.output_format_var.get(),
+                instrument_settings=instrument_settings,
+                adaptive_threshold_db=adaptive_threshold_db,
+                scan_control=self.scan_control,
+                multi_instrument=self.multi_instrument_var.get(),
+                record_visa_metrics=self.record_visa_metrics_var.get(),
+                update_statistics=self.update_statistics_var.get(),
+                level_histograms=self.level_histograms_var.get(),
+                update_store=self.update_store_var.get()
+            ))
+            # Open the live spectrum window over the selected bands' frequency range
+            if self.live_view is not None:
+                self.live_view.close()
+            self.live_view = LiveSpectrumView(
+                self.master,
+                min(band["Start MHz"] for band in selected_bands),
+                max(band["Stop MHz"] for band in selected_bands),
+                scan_name
             )
 
+            self.visa_metrics_var.set("")
+            self.scan_thread.start()
+            self.set_scan_running(True)
+            self.scan_status_var.set(f"Scanning '{scan_name}'...")
+            self.master.after(SCAN_EVENT_POLL_MS, self.poll_scan_events)
+
         except ValueError:
             messagebox.showerror("Input Error", "Please ensure all numerical inputs are valid numbers.")
         except Exception as e:
             messagebox.showerror("An Error Occurred", f"An unexpected error occurred: {e}")
 
+    def set_scan_running(self, running):
+        """Enables the pause/stop controls while a scan runs and the instrument controls when it doesn't."""
+        scan_state = tk.NORMAL if running else tk.DISABLED
+        idle_state = tk.DISABLED if running else tk.NORMAL
+        self.pause_button.config(state=scan_state, text="Pause")
+        self.stop_button.config(state=scan_state)
+        self.skip_wait_button.config(state=tk.DISABLED)
+        self.start_scan_button.config(state=idle_state, bg="lightgray" if running else "green")
+        self.system_restart_button.config(state=idle_state)
+        self.reset_instrument_button.config(state=idle_state)
+        self.use_simulator_checkbutton.config(state=idle_state)
+        self.multi_instrument_checkbutton.config(state=idle_state)
+
+    def poll_scan_events(self):
+        """Applies the scan thread's progress events to the progress panel; reschedules itself while the scan runs."""
+        if self.scan_control is None:
+            return
+        scan_finished = False
+        while True:
+            try:
+                event = self.scan_control.events.get_nowait()
+            except queue.Empty:
+                break
+            event_type = event["type"]
+            if event_type == "segment_data":
+                if self.live_view is not None and self.live_view.is_open:
+                    self.live_view.add_segment(event["frequencies_mhz"], event["levels_dbm"])
+            elif event_type == "cycle":
+                if self.live_view is not None and self.live_view.is_open:
+                    self.live_view.clear()
+                self.scan_progress_var.set(0.0)
+                self.instrument_progress = {}
+                self.scan_status_var.set(f"Scan cycle #{event['cycle']} started")
+                self.skip_wait_button.config(state=tk.DISABLED)
+            elif event_type == "segment":
+                # The parts of a multi-instrument scan take about the same time, so the cycle's progress is their mean
+                self.instrument_progress[event.get("instrument")] = event["overall_fraction"]
+                self.scan_progress_var.set(sum(self.instrument_progress.values()) / len(self.instrument_progress) * 100)
+                instrument_prefix = f"{event['instrument']}: " if "instrument" in event else ""
+                self.scan_status_var.set(
+                    f"{instrument_prefix}Band {event['band_index'] + 1}/{event['band_count']}: {event['band_name']} - "
+                    f"segment {event['segment']}/{event['segment_count']} at {event['frequency_mhz']:.3f} MHz"
+                )
+                eta_text = format_duration(event["eta_seconds"]) if event["eta_seconds"] is not None else "--:--:--"
+                self.scan_detail_var.set(f"{event['points']} points | {event['points_per_second']:.0f} points/sec | ETA {eta_text}")
+            elif event_type == "band":
+                self.scan_detail_var.set(f"Band {event['band_name']} complete ({event['points']} points)")
+            elif event_type == "cycle_complete":
+                self.scan_progress_var.set(100.0)
+                self.scan_status_var.set(f"Cycle #{event['cycle']} complete: {event['points']} points in {os.path.basename(event['csv_filename'])}")
+            elif event_type == "waiting":
+                self.skip_wait_button.config(state=tk.NORMAL)
+                self.scan_detail_var.set(f"Next scan cycle in {format_duration(event['seconds_remaining'])}")
+            elif event_type == "status":
+                self.scan_detail_var.set(event["message"])
+            elif event_type == "metrics":
+                self.visa_metrics_var.set(event["summary"])
+            elif event_type == "error":
+                messagebox.showerror(event["title"], event["message"])
+            elif event_type == "paused":
+                self.pause_button.config(text="Resume")
+                self.scan_detail_var.set("Paused")
+            elif event_type == "resumed":
+                self.pause_button.config(text="Pause")
+            elif event_type == "stopped":
+                self.scan_status_var.set("Scan stopped")
+            elif event_type == "finished":
+                scan_finished = True
+
+        # Redraw the live spectrum once per poll, however many segments arrived since the last one
+        if self.live_view is not None and self.live_view.is_open:
+            self.live_view.redraw_if_needed()
+
+        if scan_finished:
+            self.scan_thread.join()
+            self.scan_thread = None
+            self.scan_control = None
+            self.set_scan_running(False)
+            self.scan_detail_var.set("")
+            self.connect_and_display_visa() # Take the instrument back for the GUI's controls
+        else:
+            self.master.after(SCAN_EVENT_POLL_MS, self.poll_scan_events)
+
+    def toggle_pause(self):
+        """Pauses the scan before its next segment, or resumes it."""
+        if self.scan_control is None:
+            return
+        if self.scan_control.paused:
+            self.scan_control.resume()
+        else:
+            self.scan_control.pause()
+            self.scan_status_var.set("Pausing after the current segment...")
+
+    def stop_scan(self):
+        """Stops the scan after the current segment (the unfinished cycle keeps its checkpoint for resuming)."""
+        if self.scan_control is None:
+            return
+        self.scan_control.request_stop()
+        self.stop_button.config(state=tk.DISABLED)
+        self.pause_button.config(state=tk.DISABLED)
+        self.scan_status_var.set("Stopping after the current segment...")
+
+    def skip_wait(self):
+        """Starts the next scan cycle without waiting for the countdown."""
+        if self.scan_control is not None:
+            self.scan_control.skip_wait()
+
     def quit_app(self):
+        # Stop a running scan first so its files and checkpoint are closed properly
+        if self.scan_thread is not None:
+            self.scan_control.request_stop()
+            self.scan_thread.join(timeout=30)
         # Ensure the instrument connection is closed before quitting
         if self.instrument_instance:
             try:
@@ -1250,40 +4693,178 @@ class ScanApp:
         self.master.destroy()
         sys.exit(0) # Ensure the program exits properly
 
+def save_cycle_outputs(scan_data, csv_filename, scan_metadata, output_format, plot_title, include_gov_markers, include_tv_markers, open_html_after_complete, plot_point_budget, save_plot=True, scan_statistics=None, spectrum_store=None, cycle_start_time=None):
+    """
+    Writes a finished cycle's files next to its CSV file: the binary .npz file (with output_format "CSV + NPZ")
+    and the interactive HTML plot (with save_plot), and adds the cycle to the series' running statistics and the spectrum store.
+    Args:
+        scan_data (ScanDataBuffer): The cycle's data (None or empty if nothing was collected).
+        csv_filename (str): The cycle's CSV file; the other files get the same name with their own extension.
+        scan_metadata (dict): Scan settings for the .npz file (the cycle file name and save time are added).
+        output_format (str): One of OUTPUT_FORMATS.
+        plot_title (str): Title of the plot.
+        include_gov_markers (bool): Whether to include Government frequency band markers.
+        include_tv_markers (bool): Whether to include TV channel band markers.
+        open_html_after_complete (bool): Whether to open the plot in the browser.
+        plot_point_budget (int): Most points drawn in the plot (see plot_spectrum_data).
+        save_plot (bool): Whether to write the HTML plot.
+        scan_statistics (ScanStatistics): The series' running statistics to update and save, or None.
+        spectrum_store (SpectrumStore): The store to add the cycle to (under the series' folder name), or None.
+        cycle_start_time (float): Unix time the cycle started (also for a resumed cycle), saved in the .npz metadata
+                                  and used as the cycle's time in the store. None for the time of its first measured point.
+    """
+    if scan_statistics is not None and scan_statistics.update(scan_data, os.path.basename(csv_filename)):
+        scan_statistics.save()
+    if spectrum_store is not None and scan_data:
+        series = os.path.basename(os.path.dirname(csv_filename))
+        spectrum_store.append(series, scan_data, os.path.basename(csv_filename), scan_metadata["rbw_step_size_hz"], cycle_start_time)
+        print(f"🗄️ Cycle added to the spectrum store {spectrum_store.filename} (series {series})")
+
+    if output_format == "CSV + NPZ" and scan_data:
+        save_scan_npz(os.path.splitext(csv_filename)[0] + ".npz", scan_data, dict(
+            scan_metadata,
+            cycle_file=os.path.basename(csv_filename),
+            cycle_start_time=cycle_start_time,
+            saved=datetime.now().isoformat(timespec="seconds"),
+        ))
+
+    if not save_plot:
+        return
+    if not scan_data:
+        print("📉 No scan data collected in this cycle. Skipping plotting.")
+    else:
+        # Wrap the collected columns in a pandas DataFrame without copying them
+        df = scan_data.to_dataframe()
+        # Call the plotting function with GUI parameters
+        plot_spectrum_data(df, os.path.splitext(csv_filename)[0] + ".html", plot_title, include_gov_markers, include_tv_markers, open_html_after_complete, plot_point_budget)
+
+
+def save_cycle_visa_metrics(visa_metrics, csv_filename, metrics_filename):
+    """
+    Writes a completed cycle's VISA timeline next to its CSV file (<cycle>.trace.json, for chrome://tracing
+    or Perfetto), updates the scan series' cumulative metrics file and prints the summary.
+    Args:
+        visa_metrics (VisaMetrics): The recorder of the scan.
+        csv_filename (str): The cycle's CSV file.
+        metrics_filename (str): The metrics JSON file to (over)write.
+    """
+    timeline_filename = os.path.splitext(csv_filename)[0] + VISA_TIMELINE_FILE_SUFFIX
+    visa_metrics.save_timeline(timeline_filename)
+    visa_metrics.save_metrics(metrics_filename)
+    visa_metrics.print_summary()
+    print(f"💾 VISA timeline saved to {timeline_filename}, metrics to {metrics_filename}")
+
+
 # The main instrument initialization function, now accepting GUI parameters
-def run_spectrum_scan_logic(scan_name, rbw_step_size, max_hold_time, cycle_wait_time, selected_bands, include_gov_markers, include_tv_markers, rbw_config_val, vbw_config_val, open_html_after_complete):
+def run_spectrum_scan_logic(scan_name, rbw_step_size, max_hold_time, cycle_wait_time, selected_bands, include_gov_markers, include_tv_markers, rbw_config_val, vbw_config_val, open_html_after_complete, acquisition_mode=DEFAULT_ACQUISITION_MODE, use_simulator=False, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS, output_format=DEFAULT_OUTPUT_FORMAT, instrument_settings=None, max_message_length=None, adaptive_threshold_db=DEFAULT_ADAPTIVE_THRESHOLD_DB, scan_control=None, plot_point_budget=DEFAULT_PLOT_POINT_BUDGET, multi_instrument=False, record_visa_metrics=False, save_plot=True, update_statistics=True, level_histograms=False, update_store=False):
     """
     Main function to connect to the N9340B Spectrum Analyzer,
     run initial setup, perform band scans, and then read final configuration.
     This now runs in a continuous loop with an interruptible wait time.
     Parameters are passed from the GUI.
+    If use_simulator is True, the scan runs against SimulatedN9340B instead of a VISA instrument.
+    Each cycle is streamed to its CSV file (fsync'ed every flush_interval_seconds); an interrupted
+    cycle, from this run or an earlier crash, is resumed from its checkpoint at segment granularity.
+    With output_format "CSV + NPZ" each cycle is also saved as a binary .npz file (see save_scan_npz).
+    instrument_settings holds the GUI's clear/reset, preamp, display, reference level and max hold
+    settings (see DEFAULT_INSTRUMENT_SETTINGS).
+    Commands are batched by a ScpiCommandPipeline into messages of at most max_message_length
+    characters (looked up from the instrument model if None, see SCPI_MAX_MESSAGE_LENGTH_BY_MODEL).
+    adaptive_threshold_db is the signal detection threshold for the "Adaptive" acquisition mode.
+    With a scan_control the scan reports its progress through it and can be paused or stopped
+    (the GUI runs this function in a worker thread); without one, Ctrl+C interrupts it as before.
+    plot_point_budget limits the points drawn in each cycle's HTML plot (see plot_spectrum_data).
+    With multi_instrument, every analyzer found (see discover_instruments) scans a share of the bands
+    in parallel (see run_multi_instrument_scan_logic); with only one analyzer found the scan runs as usual.
+    With record_visa_metrics, every instrument transaction is recorded (see VisaMetrics): a summary is
+    printed (and sent to the GUI as a "metrics" event) periodically, and each completed cycle writes its
+    timeline next to its CSV file and updates the scan series' metrics file (see save_cycle_visa_metrics).
+    save_plot=False skips the HTML plot of each cycle (plotly is then never imported).
+    With update_statistics, each completed cycle is added to the series' running statistics per frequency
+    (see ScanStatistics, with level percentiles if level_histograms), saved in <series>_statistics.npz.
+    With update_store, each completed cycle is also added to the spectrum store (see SpectrumStore)
+    in "N9340 Scans/spectrum_store.sqlite", for time/frequency window queries.
     """
+    if instrument_settings is None:
+        instrument_settings = DEFAULT_INSTRUMENT_SETTINGS
+    if scan_control is None:
+        scan_control = ScanControl()
+    visa_metrics = VisaMetrics(on_summary=lambda summary_text: scan_control.publish("metrics", summary=summary_text)) if record_visa_metrics else None
+    scan_statistics = None
+    if update_statistics:
+        statistics_name_folder = scan_name.replace(" ", "_") # The scan series folder name, as for the cycle files
+        statistics_dir = os.path.join(os.getcwd(), "N9340 Scans", statistics_name_folder)
+        os.makedirs(statistics_dir, exist_ok=True)
+        scan_statistics = ScanStatistics(os.path.join(statistics_dir, statistics_name_folder + STATISTICS_FILE_SUFFIX), rbw_step_size, level_histograms)
+    spectrum_store = None
+    if update_store:
+        os.makedirs(os.path.join(os.getcwd(), "N9340 Scans"), exist_ok=True)
+        spectrum_store = SpectrumStore(os.path.join(os.getcwd(), "N9340 Scans", STORE_FILENAME))
     # check_and_install_dependencies() # This should ideally be run once at the very start of the script
 
-    # Determine instrument address dynamically by listing resources and picking the first one
-    rm = pyvisa.ResourceManager()
-    available_resources = rm.list_resources()
+    # Settings saved with every cycle's .npz file
+    scan_metadata = {
+        "scan_name": scan_name,
+        "bands": selected_bands,
+        "rbw_step_size_hz": rbw_step_size,
+        "rbw": rbw_config_val,
+        "vbw": vbw_config_val,
+        "ref_level_dbm": instrument_settings["ref_level"],
+        "preamplifier_on": instrument_settings["preamplifier_on"],
+        "display_log": instrument_settings["display_log"],
+        "max_hold_on": instrument_settings["max_hold_on"],
+        "max_hold_time_seconds": max_hold_time,
+        "acquisition_mode": acquisition_mode,
+        "adaptive_threshold_db": adaptive_threshold_db,
+    }
 
     instrument_address = None
+    if use_simulator:
+        rm = None
+        available_resources = simulated_instrument_addresses(SIMULATED_INSTRUMENT_COUNT if multi_instrument else 1)
+    else:
+        # Determine instrument address dynamically by listing resources and picking the first one
+        rm = pyvisa.ResourceManager()
+        available_resources = rm.list_resources()
+
+    if multi_instrument:
+        instrument_addresses = [address for address, _ in discover_instruments(rm, available_resources)]
+        if len(instrument_addresses) > 1:
+            run_multi_instrument_scan_logic(
+                rm, instrument_addresses, scan_name, rbw_step_size, max_hold_time, cycle_wait_time, selected_bands,
+                include_gov_markers, include_tv_markers, rbw_config_val, vbw_config_val, open_html_after_complete,
+                acquisition_mode, flush_interval_seconds, output_format, instrument_settings, max_message_length,
+                adaptive_threshold_db, scan_control, plot_point_budget, scan_metadata, visa_metrics, save_plot, scan_statistics, spectrum_store
+            )
+            return
+        print(f"ℹ️ Multi-instrument mode found {len(instrument_addresses)} {INSTRUMENT_MODEL_PATTERN} analyzer(s); scanning with a single instrument.")
+        available_resources = instrument_addresses or available_resources
+
     if available_resources:
         # Assuming only one VISA instrument is connected, take the first one
         instrument_address = available_resources[0]
         print(f"🔌 Automatically selected instrument: {instrument_address}")
     else:
         print("🚫 Error: No VISA instruments found. Please ensure your instrument is connected and drivers are installed.")
-        messagebox.showerror("Instrument Error", "No VISA instruments found. Please ensure your instrument is connected and drivers are installed.")
+        scan_control.publish("error", title="Instrument Error", message="No VISA instruments found. Please ensure your instrument is connected and drivers are installed.")
+        if spectrum_store is not None:
+            spectrum_store.close()
+        scan_control.publish("finished")
         return
 
+    scan_plan = plan_scan(selected_bands, rbw_step_size, acquisition_mode, max_hold_time, rbw_config_val)
+    print(f"🗓️ Scan plan:\n{describe_scan_plan(scan_plan, cycle_wait_time)}")
 
     inst = None
+    state_cache = None # Tracks the settings on the instrument; recreated whenever the connection is re-opened
+    pipeline = None # Batches commands to the instrument; recreated with the connection
     scan_cycle_count = 0
-    # Keep track of the last successfully scanned band index for recovery
-    last_successful_band_index = 0
 
     try:
         while True: # This loop makes the program repeat indefinitely
             scan_cycle_count += 1
             print(f"\n--- 🔄 Starting Scan Cycle #{scan_cycle_count} ---")
+            scan_control.publish("cycle", cycle=scan_cycle_count)
             
             # This flag controls if we should skip to plotting/waiting or re-run the scan
             restart_scan_from_beginning_of_band = False 
@@ -1291,40 +4872,46 @@ def run_spectrum_scan_logic(scan_name, rbw_step_size, max_hold_time, cycle_wait_
             # Initialize/re-initialize the instrument. This function now handles retries.
             try:
                 # Re-open the resource for the main scan loop if it was closed or not passed
-                if inst is None:
-                    inst = rm.open_resource(instrument_address)
+                reopened_connection = inst is None
+                if reopened_connection:
+                    inst = open_instrument(rm, instrument_address, visa_metrics)
                     inst.timeout = 30000 # Reset timeout
+                    state_cache = InstrumentStateCache()
+                    pipeline = ScpiCommandPipeline(inst, max_message_length)
                     print(f"🔄 Re-opened instrument connection for scan cycle #{scan_cycle_count}.")
                 
                 # The RBW and VBW settings are now applied in scan_bands,
                 # so initialize_instrument doesn't need them for setting the instrument.
                 # However, other settings (preamp, display, ref level, max hold) are still applied here.
-                # The parameters rbw_config_val and vbw_config_val are passed to initialize_instrument
-                # but are effectively ignored there for setting the instrument.
+                # A freshly (re-)opened connection is always hard reset so its state is known.
                 if not initialize_instrument(
                     inst,
-                    True, # Always clear and reset on re-init in the loop for consistency
-                    True, # Assuming preamplifier on for re-init in loop
-                    True, # Assuming display log for re-init in loop
-                    -30,  # Assuming -30 dBm for re-init in loop
-                    True, # Assuming max hold for re-init in loop
-                    rbw_config_val # Pass rbw_config_val here
+                    instrument_settings["clear_reset"] or reopened_connection,
+                    instrument_settings["preamplifier_on"],
+                    instrument_settings["display_log"],
+                    instrument_settings["ref_level"],
+                    instrument_settings["max_hold_on"],
+                    rbw_config_val, # Pass rbw_config_val here
+                    state_cache=state_cache,
+                    pipeline=pipeline
                 ):
                     print(f"⏳ Instrument re-initialization failed in cycle #{scan_cycle_count}. Waiting and retrying...")
-                    wait_with_interrupt(cycle_wait_time)
+                    wait_with_interrupt(cycle_wait_time, scan_control)
                     continue # Skip to the next cycle attempt
 
+            except ScanAborted:
+                raise
             except pyvisa.VisaIOError as e:
                 print(f"❌ VISA Error during re-connection in main loop: {e}")
                 inst = None
                 print(f"⏳ Instrument re-connection failed in cycle #{scan_cycle_count}. Waiting and retrying...")
-                wait_with_interrupt(cycle_wait_time)
+                wait_with_interrupt(cycle_wait_time, scan_control)
                 continue # Skip to the next cycle attempt
             except Exception as e:
                 print(f"💥 An unexpected error occurred during instrument setup in main loop: {e}")
                 inst = None
                 print(f"⏳ Instrument setup failed in cycle #{scan_cycle_count}. Waiting and retrying...")
-                wait_with_interrupt(cycle_wait_time)
+                wait_with_interrupt(cycle_wait_time, scan_control)
                 continue # Skip to the next cycle attempt
 
 
@@ -1342,35 +4929,70 @@ def run_spectrum_scan_logic(scan_name, rbw_step_size, max_hold_time, cycle_wait_
             os.makedirs(scan_dir, exist_ok=True)
             print(f"📁 Data will be saved in: {scan_dir}")
 
-            timestamp = datetime.now().strftime("%Y%m%d@%H%M")
-            csv_filename = os.path.join(scan_dir, f"{name_folder}_{timestamp}.csv")
-            html_plot_filename = os.path.join(scan_dir, f"{name_folder}_{timestamp}.html")
+            # Resume an interrupted cycle (from an error in this run or a previous crash) in its original file
+            segment_span_hz = segment_span_for_mode(rbw_step_size, acquisition_mode)
+            checkpoint = find_scan_checkpoint(scan_dir, selected_bands, rbw_step_size, segment_span_hz, checkpoint_max_age_seconds(scan_plan, cycle_wait_time))
+            if checkpoint:
+                csv_filename = checkpoint["csv_filename"]
+                resume_band_index = checkpoint["resume_band_index"]
+                resume_segment_index = checkpoint["resume_segment_index"]
+                print(f"♻️ Resuming interrupted scan {os.path.basename(csv_filename)} after {checkpoint['last_frequency_mhz']} MHz (band {resume_band_index + 1}, segment {resume_segment_index + 1}).")
+            else:
+                timestamp = datetime.now().strftime("%Y%m%d@%H%M")
+                csv_filename = os.path.join(scan_dir, f"{name_folder}_{timestamp}.csv")
+                resume_band_index = 0
+                resume_segment_index = 0
 
-            all_scan_data_current_cycle = [] # Collect data for the current cycle's plot
+            all_scan_data_current_cycle = None # Collect data (a ScanDataBuffer) for the current cycle's plot
+            scan_writer = None
 
             try:
                 print(f"📝 Opening CSV file for writing: {csv_filename}")
-                with open(csv_filename, mode='w', newline='') as csvfile:
-                    csv_writer = csv.writer(csvfile)
-
-                    # Pass the selected_bands list and RBW/VBW config values from GUI
-                    all_scan_data_current_cycle, last_successful_band_index = \
-                        scan_bands(inst, csv_writer, max_hold_time, rbw_step_size, selected_bands, last_successful_band_index, rbw_config_val, vbw_config_val)
-                
-                # If scan_bands completes without raising an error, reset last_successful_band_index
-                # for the next full cycle.
-                last_successful_band_index = 0 
+                scan_writer = StreamingScanWriter(csv_filename, [band["Band Name"] for band in selected_bands], rbw_step_size, flush_interval_seconds, checkpoint, segment_span_hz)
+
+                # Data of a resumed cycle that is already in the CSV file (also shown in the live view)
+                resumed_scan_data = scan_writer.load_written_data() if checkpoint else None
+                if resumed_scan_data:
+                    resumed_freqs_mhz, resumed_levels_dbm, resumed_band_indices = resumed_scan_data.view()
+                    scan_control.publish("segment_data", band_index=int(resumed_band_indices[-1]), frequencies_mhz=resumed_freqs_mhz.copy(), levels_dbm=resumed_levels_dbm.copy())
+
+                # Pass the selected_bands list and RBW/VBW config values from GUI
+                scan_start_time = time.perf_counter()
+                all_scan_data_current_cycle, _ = scan_bands(
+                    inst, scan_writer, max_hold_time, rbw_step_size, selected_bands, resume_band_index, rbw_config_val, vbw_config_val, acquisition_mode,
+                    resume_segment_index=resume_segment_index,
+                    all_scan_data=resumed_scan_data,
+                    instrument_settings=instrument_settings,
+                    state_cache=state_cache,
+                    pipeline=pipeline,
+                    adaptive_threshold_db=adaptive_threshold_db,
+                    scan_control=scan_control
+                )
 
-                if not all_scan_data_current_cycle:
-                    print("📉 No scan data collected in this cycle. Skipping plotting.")
-                else:
-                    # Convert collected data to pandas DataFrame
-                    df = pd.DataFrame(all_scan_data_current_cycle)
-                    # Call the plotting function with GUI parameters
-                    plot_spectrum_data(df, html_plot_filename, scan_name, include_gov_markers, include_tv_markers, open_html_after_complete)
+                # The cycle completed, so its checkpoint is no longer needed
+                scan_writer.close(scan_complete=True)
+
+                save_start_time = time.perf_counter()
+                save_cycle_outputs(all_scan_data_current_cycle, csv_filename, scan_metadata, output_format, scan_name,
+                                   include_gov_markers, include_tv_markers, open_html_after_complete, plot_point_budget, save_plot, scan_statistics, spectrum_store,
+                                   scan_writer.cycle_start_time)
+                if visa_metrics is not None:
+                    visa_metrics.add_span(f"Scan cycle #{scan_cycle_count}", scan_start_time, save_start_time - scan_start_time)
+                    visa_metrics.add_span("Save CSV/NPZ/plot", save_start_time, time.perf_counter() - save_start_time)
+                    save_cycle_visa_metrics(visa_metrics, csv_filename, os.path.join(scan_dir, name_folder + VISA_METRICS_FILE_SUFFIX))
+                scan_control.publish("cycle_complete", cycle=scan_cycle_count, csv_filename=csv_filename,
+                                     points=len(all_scan_data_current_cycle) if all_scan_data_current_cycle else 0)
+
+            except ScanAborted:
+                if scan_writer:
+                    scan_writer.close(scan_complete=False) # Keep the checkpoint so the cycle can be resumed
+                raise
 
             except pyvisa.VisaIOError as e:
+                if scan_writer:
+                    scan_writer.close(scan_complete=False) # Keep the checkpoint for the resume
                 print(f"🚨 !!! CRITICAL VISA I/O ERROR during scan: {e} !!!")
+                scan_control.publish("status", message=f"VISA I/O error, reconnecting and resuming: {e}")
                 print("🩹 Attempting to close instrument, re-initialize, and resume scan from last successful point.")
                 if inst:
                     try:
@@ -1385,27 +5007,869 @@ def run_spectrum_scan_logic(scan_name, rbw_step_size, max_hold_time, cycle_wait_
                 continue # Immediately go to the next cycle to try and reconnect/resume
 
             except Exception as e:
+                if scan_writer:
+                    scan_writer.close(scan_complete=False)
                 print(f"🛑 An unexpected error occurred during scan cycle #{scan_cycle_count}: {e}")
+                scan_control.publish("status", message=f"Error in cycle #{scan_cycle_count}: {e}")
                 print("😴 Proceeding to wait period.")
 
             # CALLING THE INTERRUPTIBLE WAIT FUNCTION
-            wait_with_interrupt(cycle_wait_time) # Uses the GUI provided wait time
+            wait_with_interrupt(cycle_wait_time, scan_control) # Uses the GUI provided wait time
 
+    except ScanAborted:
+        print("\n🛑 Scan stopped by user. An unfinished cycle resumes from its checkpoint on the next start.")
+        scan_control.publish("stopped")
     except KeyboardInterrupt:
         print("\n👋 Program interrupted by user (Ctrl+C) outside of wait period. Exiting.")
     except Exception as e:
         print(f"🚨 An unexpected critical error occurred in the main loop: {e}")
+        scan_control.publish("error", title="Scan Error", message=f"An unexpected critical error occurred in the main loop: {e}")
     finally:
         if inst and inst.session: # Check if inst object exists and has an active session
             inst.close()
             print("\n🔌 Connection to N9340B closed.")
+        if spectrum_store is not None:
+            spectrum_store.close()
+        scan_control.publish("finished")
+
+def assign_instrument_partitions(selected_bands, instrument_addresses, band_seconds):
+    """
+    Splits the bands across the instruments (see partition_bands) and prints which instrument scans what.
+    Args:
+        selected_bands (list): Band dictionaries to scan.
+        instrument_addresses (list): Addresses of the instruments to use.
+        band_seconds (list): Estimated scan time of each band.
+    Returns:
+        tuple: (list: the addresses of the instruments that received bands (more instruments than bands
+                leaves some idle), list: the band indices of each of those instruments)
+    """
+    partitions = partition_bands(selected_bands, len(instrument_addresses), band_seconds)
+    instrument_addresses = instrument_addresses[:len(partitions)]
+    print(f"\n--- 🧩 Scanning with {len(instrument_addresses)} instruments ---")
+    for instrument_address, band_indices in zip(instrument_addresses, partitions):
+        part_names = ", ".join(selected_bands[band_idx]["Band Name"] for band_idx in band_indices)
+        print(f"📡 {instrument_address}: {part_names} (~{format_duration(sum(band_seconds[band_idx] for band_idx in band_indices))})")
+    return instrument_addresses, partitions
+
+
+def load_unfinished_part(part_csv_filename, part_bands, rbw_step_size_hz, segment_span_hz):
+    """
+    Reads back what a failed part file holds up to its checkpoint, so a cycle can be merged without it.
+    Args:
+        part_csv_filename (str): The part's CSV file.
+        part_bands (list): The band dictionaries of the part, in scan order.
+        rbw_step_size_hz (float): The grid step of the scan.
+        segment_span_hz (float): The segment span of the scan.
+    Returns:
+        tuple: (ScanDataBuffer: the part's data, list: names of the part's bands it did not finish)
+    """
+    band_names = [band["Band Name"] for band in part_bands]
+    checkpoint = find_scan_checkpoint(os.path.dirname(part_csv_filename), part_bands, rbw_step_size_hz, segment_span_hz)
+    if not checkpoint or os.path.abspath(checkpoint["csv_filename"]) != os.path.abspath(part_csv_filename):
+        return ScanDataBuffer(band_names), band_names
+    part_writer = StreamingScanWriter(part_csv_filename, band_names, rbw_step_size_hz, float("inf"), checkpoint, segment_span_hz)
+    part_scan_data = part_writer.load_written_data()
+    part_writer.close(scan_complete=False)
+    return part_scan_data, band_names[checkpoint["resume_band_index"]:]
+
+
+def scan_instrument_partition(rm, instrument_address, part_csv_filename, part_bands, checkpoint, scan_result, scan_control, rbw_step_size, max_hold_time, rbw_config_val, vbw_config_val, acquisition_mode, flush_interval_seconds, instrument_settings, max_message_length, adaptive_threshold_db, visa_metrics=None):
+    """
+    Scans one instrument's share of the bands for one cycle, in its own thread with its own VISA session.
+    The part is streamed to its own CSV file. Its checkpoint is kept even when the part completes,
+    so a finished part is not scanned again if another instrument fails; the coordinator
+    (run_multi_instrument_scan_logic) removes the part files once all parts are merged.
+
+    Args:
+        rm (pyvisa.ResourceManager): The resource manager (None for simulated instruments).
+        instrument_address (str): The instrument to open.
+        part_csv_filename (str): The part's CSV file.
+        part_bands (list): The band dictionaries this instrument scans, in scan order.
+        checkpoint (dict): The part's checkpoint from find_scan_checkpoint to resume, or None.
+        scan_result (dict): Receives "scan_data" (ScanDataBuffer) on success or "error" (the exception) on failure.
+        scan_control (ScanControl): This instrument's control (see ScanControl.for_instrument).
+        visa_metrics (VisaMetrics): Records this instrument's transactions (shared by all instruments), or None.
+        The remaining arguments are the scan settings, as for run_spectrum_scan_logic.
+    """
+    inst = None
+    scan_writer = None
+    try:
+        inst = open_instrument(rm, instrument_address, visa_metrics)
+        inst.timeout = 30000
+        state_cache = InstrumentStateCache()
+        pipeline = ScpiCommandPipeline(inst, max_message_length)
+        # A freshly opened connection is always hard reset so its state is known
+        if not initialize_instrument(
+            inst,
+            True,
+            instrument_settings["preamplifier_on"],
+            instrument_settings["display_log"],
+            instrument_settings["ref_level"],
+            instrument_settings["max_hold_on"],
+            rbw_config_val,
+            state_cache=state_cache,
+            pipeline=pipeline
+        ):
+            raise RuntimeError(f"Initialization of {instrument_address} failed")
+
+        scan_writer = StreamingScanWriter(part_csv_filename, [band["Band Name"] for band in part_bands], rbw_step_size, flush_interval_seconds, checkpoint, segment_span_for_mode(rbw_step_size, acquisition_mode))
+        resumed_scan_data = scan_writer.load_written_data() if checkpoint else None
+        if resumed_scan_data:
+            resumed_freqs_mhz, resumed_levels_dbm, resumed_band_indices = resumed_scan_data.view()
+            scan_control.publish("segment_data", band_index=int(resumed_band_indices[-1]), frequencies_mhz=resumed_freqs_mhz.copy(), levels_dbm=resumed_levels_dbm.copy())
+
+        scan_result["scan_data"], _ = scan_bands(
+            inst, scan_writer, max_hold_time, rbw_step_size, part_bands,
+            checkpoint["resume_band_index"] if checkpoint else 0, rbw_config_val, vbw_config_val, acquisition_mode,
+            resume_segment_index=checkpoint["resume_segment_index"] if checkpoint else 0,
+            all_scan_data=resumed_scan_data,
+            instrument_settings=instrument_settings,
+            state_cache=state_cache,
+            pipeline=pipeline,
+            adaptive_threshold_db=adaptive_threshold_db,
+            scan_control=scan_control
+        )
+        scan_writer.close(scan_complete=False) # The checkpoint marks the part as finished until the merge
+    except Exception as e:
+        # ScanAborted included: the part keeps its checkpoint and resumes in the next cycle (or the next start)
+        scan_result["error"] = e
+        if scan_writer:
+            scan_writer.close(scan_complete=False)
+        if not isinstance(e, ScanAborted):
+            print(f"❌ Scan on {instrument_address} failed: {e}")
+    finally:
+        if inst is not None:
+            try:
+                inst.close()
+            except Exception as close_e:
+                print(f"💥 Error closing {instrument_address}: {close_e}")
+
+
+def run_multi_instrument_scan_logic(rm, instrument_addresses, scan_name, rbw_step_size, max_hold_time, cycle_wait_time, selected_bands, include_gov_markers, include_tv_markers, rbw_config_val, vbw_config_val, open_html_after_complete, acquisition_mode, flush_interval_seconds, output_format, instrument_settings, max_message_length, adaptive_threshold_db, scan_control, plot_point_budget, scan_metadata, visa_metrics=None, save_plot=True, scan_statistics=None, spectrum_store=None):
+    """
+    Scan loop of run_spectrum_scan_logic for several analyzers at once.
+    The selected bands are split across the instruments so each has about the same estimated scan time
+    (see partition_bands), and every cycle each instrument scans its bands in its own thread into its own
+    part file (<cycle>.partN.csv). When all parts are done they are merged, in band order, into the cycle's
+    CSV file, and the .npz file and plot are written from the merged data as for a single instrument.
+    If any part fails, the finished parts are kept and the failed ones resume from their checkpoints in the next cycle.
+    An instrument whose part fails MULTI_INSTRUMENT_MAX_FAILED_CYCLES cycles in a row is dropped: the cycle is merged
+    from what was scanned (the bands it did not finish are reported as missing and recorded in the .npz metadata),
+    and from the next cycle on its bands are partitioned over the remaining instruments.
+
+    Args:
+        rm (pyvisa.ResourceManager): The resource manager (None for simulated instruments).
+        instrument_addresses (list): Addresses of the instruments to use (see discover_instruments).
+        scan_metadata (dict): Scan settings saved with each cycle's .npz file (the instruments are added).
+        visa_metrics (VisaMetrics): Records every instrument's transactions (each instrument's thread is a row
+                                    of the timeline), or None.
+        scan_statistics (ScanStatistics): The series' running statistics, updated with each merged cycle, or None.
+        spectrum_store (SpectrumStore): The store each merged cycle is added to, or None. It is closed when the scan ends.
+        The remaining arguments are as for run_spectrum_scan_logic.
+    """
+    band_seconds = [plan_band_scan(band, rbw_step_size, acquisition_mode, max_hold_time, rbw_config_val).scan_seconds for band in selected_bands]
+    instrument_addresses, partitions = assign_instrument_partitions(selected_bands, instrument_addresses, band_seconds)
+    scan_plan = plan_scan(selected_bands, rbw_step_size, acquisition_mode, max_hold_time, rbw_config_val, len(instrument_addresses))
+    print(f"🗓️ Scan plan:\n{describe_scan_plan(scan_plan, cycle_wait_time)}")
+    segment_span_hz = segment_span_for_mode(rbw_step_size, acquisition_mode)
+    failed_cycle_counts = {instrument_address: 0 for instrument_address in instrument_addresses} # Cycles in a row each instrument's part failed
+    scan_cycle_count = 0
+
+    try:
+        while True: # This loop makes the program repeat indefinitely
+            scan_cycle_count += 1
+            print(f"\n--- 🔄 Starting Scan Cycle #{scan_cycle_count} ---")
+            scan_control.publish("cycle", cycle=scan_cycle_count)
+
+            base_scan_dir = os.path.join(os.getcwd(), "N9340 Scans")
+            name_folder = scan_name.replace(" ", "_")
+            scan_dir = os.path.join(base_scan_dir, name_folder)
+            os.makedirs(scan_dir, exist_ok=True)
+            print(f"📁 Data will be saved in: {scan_dir}")
+
+            # Resume the parts of an interrupted cycle. All parts of a cycle share its file name,
+            # so only checkpoints of the most recently interrupted cycle are used.
+            part_bands = [[selected_bands[band_idx] for band_idx in band_indices] for band_indices in partitions]
+            checkpoints = [find_scan_checkpoint(scan_dir, bands, rbw_step_size, segment_span_hz, checkpoint_max_age_seconds(scan_plan, cycle_wait_time)) for bands in part_bands]
+            resumable = [checkpoint for checkpoint in checkpoints if checkpoint]
+            if resumable:
+                latest_checkpoint = max(resumable, key=lambda checkpoint: checkpoint["updated"])
+                cycle_base = re.sub(r"\.part\d+\.csv$", "", latest_checkpoint["csv_filename"])
+                checkpoints = [checkpoint if checkpoint and checkpoint["csv_filename"].startswith(cycle_base + ".part") else None for checkpoint in checkpoints]
+                print(f"♻️ Resuming interrupted scan {os.path.basename(cycle_base)} ({sum(1 for checkpoint in checkpoints if checkpoint)} of {len(partitions)} parts started).")
+                # The cycle started with its earliest part
+                cycle_start_time = min(checkpoint.get("cycle_start_time") or cycle_start_time_from_filename(checkpoint["csv_filename"]) or time.time()
+                                       for checkpoint in checkpoints if checkpoint)
+            else:
+                timestamp = datetime.now().strftime("%Y%m%d@%H%M")
+                cycle_base = os.path.join(scan_dir, f"{name_folder}_{timestamp}")
+                cycle_start_time = time.time()
+            csv_filename = cycle_base + ".csv"
+            part_csv_filenames = [cycle_base + MULTI_INSTRUMENT_PART_SUFFIX.format(part_number) for part_number in range(1, len(partitions) + 1)]
+
+            # One thread (and VISA session) per instrument
+            scan_start_time = time.perf_counter()
+            scan_results = [{} for _ in partitions]
+            scan_threads = []
+            for part_idx, instrument_address in enumerate(instrument_addresses):
+                scan_thread = threading.Thread(target=scan_instrument_partition, daemon=True, name=f"scan-{instrument_address}", args=(
+                    rm, instrument_address, part_csv_filenames[part_idx], part_bands[part_idx], checkpoints[part_idx], scan_results[part_idx],
+                    scan_control.for_instrument(instrument_address), rbw_step_size, max_hold_time, rbw_config_val, vbw_config_val,
+                    acquisition_mode, flush_interval_seconds, instrument_settings, max_message_length, adaptive_threshold_db, visa_metrics
+                ))
+                scan_thread.start()
+                scan_threads.append(scan_thread)
+            for scan_thread in scan_threads:
+                scan_thread.join()
+
+            if scan_control.stop_event.is_set():
+                raise ScanAborted()
+
+            failed_parts = [(instrument_address, scan_result["error"]) for instrument_address, scan_result in zip(instrument_addresses, scan_results) if "error" in scan_result]
+            for instrument_address, scan_result in zip(instrument_addresses, scan_results):
+                failed_cycle_counts[instrument_address] = failed_cycle_counts[instrument_address] + 1 if "error" in scan_result else 0
+            for instrument_address, error in failed_parts:
+                print(f"🚨 Part on {instrument_address} did not complete (failed {failed_cycle_counts[instrument_address]} of {MULTI_INSTRUMENT_MAX_FAILED_CYCLES} cycles in a row): {error}")
+            dropped_addresses = [instrument_address for instrument_address, _ in failed_parts if failed_cycle_counts[instrument_address] >= MULTI_INSTRUMENT_MAX_FAILED_CYCLES]
+            if failed_parts and not dropped_addresses:
+                scan_control.publish("status", message=f"{len(failed_parts)} instrument(s) failed in cycle #{scan_cycle_count}; their parts resume in the next cycle.")
+                print("😴 Proceeding to wait period.")
+                wait_with_interrupt(cycle_wait_time, scan_control)
+                continue
+
+            # An instrument that keeps failing doesn't hold up the series: the cycle is merged from what was scanned
+            missing_band_names = []
+            for part_idx, scan_result in enumerate(scan_results):
+                if "error" in scan_result:
+                    scan_result["scan_data"], unfinished_band_names = load_unfinished_part(part_csv_filenames[part_idx], part_bands[part_idx], rbw_step_size, segment_span_hz)
+                    missing_band_names.extend(unfinished_band_names)
+            if missing_band_names:
+                print(f"⚠️ Cycle #{scan_cycle_count} is saved without (all of) these bands: {', '.join(missing_band_names)}")
+                scan_control.publish("status", message=f"Cycle #{scan_cycle_count} is missing {len(missing_band_names)} band(s): {', '.join(missing_band_names)}")
+
+            # Merge the parts, in band order, into the cycle's CSV file
+            save_start_time = time.perf_counter()
+            all_scan_data_current_cycle = merge_scan_data([band["Band Name"] for band in selected_bands], [scan_result["scan_data"] for scan_result in scan_results])
+            print(f"🧩 Merging {len(partitions)} parts into {os.path.basename(csv_filename)}")
+            merged_writer = StreamingScanWriter(csv_filename, all_scan_data_current_cycle.band_names, rbw_step_size, float("inf"), segment_span_hz=segment_span_hz)
+            frequency_mhz, level_dbm, band_index = all_scan_data_current_cycle.view()
+            band_boundaries = np.flatnonzero(np.r_[True, band_index[1:] != band_index[:-1], True]) if band_index.size else []
+            for first_point, stop_point in zip(band_boundaries[:-1], band_boundaries[1:]):
+                merged_writer.write_segment(int(band_index[first_point]), 0, True, frequency_mhz[first_point:stop_point], level_dbm[first_point:stop_point])
+            merged_writer.close(scan_complete=True)
+            for part_csv_filename in part_csv_filenames:
+                for part_filename in (part_csv_filename, part_csv_filename + CHECKPOINT_FILE_SUFFIX):
+                    if os.path.exists(part_filename):
+                        os.remove(part_filename)
+
+            cycle_metadata = dict(scan_metadata, instruments=instrument_addresses)
+            if missing_band_names:
+                cycle_metadata["missing_bands"] = missing_band_names
+            save_cycle_outputs(all_scan_data_current_cycle, csv_filename, cycle_metadata, output_format, scan_name,
+                               include_gov_markers, include_tv_markers, open_html_after_complete, plot_point_budget, save_plot, scan_statistics, spectrum_store,
+                               cycle_start_time)
+            if visa_metrics is not None:
+                visa_metrics.add_span(f"Scan cycle #{scan_cycle_count}", scan_start_time, save_start_time - scan_start_time)
+                visa_metrics.add_span("Merge and save CSV/NPZ/plot", save_start_time, time.perf_counter() - save_start_time)
+                save_cycle_visa_metrics(visa_metrics, csv_filename, os.path.join(scan_dir, name_folder + VISA_METRICS_FILE_SUFFIX))
+            scan_control.publish("cycle_complete", cycle=scan_cycle_count, csv_filename=csv_filename, points=len(all_scan_data_current_cycle))
+
+            if dropped_addresses:
+                instrument_addresses = [instrument_address for instrument_address in instrument_addresses if instrument_address not in dropped_addresses]
+                if not instrument_addresses:
+                    raise RuntimeError(f"Every instrument failed {MULTI_INSTRUMENT_MAX_FAILED_CYCLES} cycles in a row")
+                print(f"🔌 Dropping {', '.join(dropped_addresses)}; its bands are scanned by the other instruments from now on.")
+                scan_control.publish("status", message=f"Dropped {', '.join(dropped_addresses)} after {MULTI_INSTRUMENT_MAX_FAILED_CYCLES} failed cycles.")
+                instrument_addresses, partitions = assign_instrument_partitions(selected_bands, instrument_addresses, band_seconds)
+                scan_plan = plan_scan(selected_bands, rbw_step_size, acquisition_mode, max_hold_time, rbw_config_val, len(instrument_addresses))
+                failed_cycle_counts = {instrument_address: 0 for instrument_address in instrument_addresses}
+
+            # CALLING THE INTERRUPTIBLE WAIT FUNCTION
+            wait_with_interrupt(cycle_wait_time, scan_control) # Uses the GUI provided wait time
+
+    except ScanAborted:
+        print("\n🛑 Scan stopped by user. Unfinished parts resume from their checkpoints on the next start.")
+        scan_control.publish("stopped")
+    except KeyboardInterrupt:
+        print("\n👋 Program interrupted by user (Ctrl+C) outside of wait period. Exiting.")
+    except Exception as e:
+        print(f"🚨 An unexpected critical error occurred in the main loop: {e}")
+        scan_control.publish("error", title="Scan Error", message=f"An unexpected critical error occurred in the main loop: {e}")
+    finally:
+        if spectrum_store is not None:
+            spectrum_store.close()
+        scan_control.publish("finished")
+
+
+class BenchmarkRecorder:
+    """
+    Recorder for InstrumentedResource that keeps every transaction's latency per SCPI mnemonic.
+    Messages that wait for a sweep to complete (":INIT:IMM;*OPC?") are counted as sweep wait,
+    everything else as I/O.
+    """
+
+    def __init__(self):
+        self.latencies = {} # mnemonic -> list of seconds
+        self.errors = {} # mnemonic -> number of VISA errors (e.g. timeouts)
+        self.io_seconds = 0.0
+        self.sweep_wait_seconds = 0.0
+
+    def record(self, mnemonic, start_time, seconds, bytes_sent, bytes_received, error):
+        self.latencies.setdefault(mnemonic, []).append(seconds)
+        if error is not None:
+            self.errors[mnemonic] = self.errors.get(mnemonic, 0) + 1
+        if ":INIT:IMM" in mnemonic:
+            self.sweep_wait_seconds += seconds
+        else:
+            self.io_seconds += seconds
+
+    def command_summary(self):
+        """
+        Returns:
+            dict: mnemonic -> count, errors, total seconds and the BENCHMARK_LATENCY_PERCENTILES and maximum in milliseconds.
+        """
+        summary = {}
+        for mnemonic, latencies in sorted(self.latencies.items(), key=lambda item: -sum(item[1])):
+            latencies_ms = np.array(latencies) * 1000
+            command_stats = {"count": len(latencies), "errors": self.errors.get(mnemonic, 0), "total_seconds": round(float(latencies_ms.sum()) / 1000, 6)}
+            for percentile, latency_ms in zip(BENCHMARK_LATENCY_PERCENTILES, np.percentile(latencies_ms, BENCHMARK_LATENCY_PERCENTILES)):
+                command_stats[f"p{percentile}_ms"] = round(float(latency_ms), 3)
+            command_stats["max_ms"] = round(float(latencies_ms.max()), 3)
+            summary[mnemonic] = command_stats
+        return summary
+
+
+def benchmark_acquisition_mode(inst, selected_bands, acquisition_mode, rbw_step_size, rbw_config_val, vbw_config_val, max_hold_time, instrument_settings, adaptive_threshold_db, scan_dir):
+    """
+    Benchmarks one acquisition mode: a full initialize_instrument (*CLS; *RST and every setting)
+    followed by one scan of the selected bands through scan_bands, streamed to a CSV file as in a real cycle.
+    Args:
+        inst (pyvisa.resources.Resource): The opened instrument (real or simulated).
+        selected_bands (list): Band dictionaries to scan.
+        acquisition_mode (str): One of ACQUISITION_MODES.
+        scan_dir (str): Directory for the scan's CSV file.
+        The remaining arguments are the scan settings, as for run_spectrum_scan_logic.
+    Returns:
+        dict: The "initialize" and "scan" timings, per-band rates and per-command latencies (see run_acquisition_benchmark).
+    """
+    recorder = BenchmarkRecorder()
+    timed_inst = InstrumentedResource(inst, recorder)
+
+    # Phase 1: connect (*IDN? for the message length) and fully initialize the instrument
+    initialize_start = time.perf_counter()
+    pipeline = ScpiCommandPipeline(timed_inst)
+    state_cache = InstrumentStateCache()
+    initialize_instrument(
+        timed_inst, True, instrument_settings["preamplifier_on"], instrument_settings["display_log"],
+        instrument_settings["ref_level"], instrument_settings["max_hold_on"], rbw_config_val,
+        state_cache=state_cache, pipeline=pipeline
+    )
+    initialize_result = {
+        "seconds": round(time.perf_counter() - initialize_start, 6),
+        "commands": recorder.command_summary(),
+    }
+
+    # Phase 2: one scan of the bands (segment setup, sweeps, marker batches or trace transfers, CSV streaming)
+    recorder = BenchmarkRecorder()
+    timed_inst.recorder = recorder
+    scan_control = BenchmarkScanControl()
+    segment_span_hz = segment_span_for_mode(rbw_step_size, acquisition_mode)
+    csv_filename = os.path.join(scan_dir, f"benchmark_{acquisition_mode}.csv")
+    scan_writer = StreamingScanWriter(csv_filename, [band["Band Name"] for band in selected_bands], rbw_step_size, DEFAULT_FLUSH_INTERVAL_SECONDS, None, segment_span_hz)
+    scan_start = time.perf_counter()
+    scan_data, _ = scan_bands(
+        timed_inst, scan_writer, max_hold_time, rbw_step_size, selected_bands, 0, rbw_config_val, vbw_config_val, acquisition_mode,
+        instrument_settings=instrument_settings,
+        state_cache=state_cache,
+        pipeline=pipeline,
+        adaptive_threshold_db=adaptive_threshold_db,
+        scan_control=scan_control
+    )
+    scan_writer.close(scan_complete=True)
+    scan_seconds = time.perf_counter() - scan_start
+
+    band_results = []
+    band_start, band_start_points = scan_start, 0
+    for band_index, band_finish, total_points in scan_control.band_finishes:
+        band_seconds = band_finish - band_start
+        band_results.append({
+            "band_name": selected_bands[band_index]["Band Name"],
+            "points": total_points - band_start_points,
+            "seconds": round(band_seconds, 6),
+            "points_per_second": round((total_points - band_start_points) / band_seconds, 1) if band_seconds > 0 else None,
+        })
+        band_start, band_start_points = band_finish, total_points
+
+    return {
+        "acquisition_mode": acquisition_mode,
+        "initialize": initialize_result,
+        "scan": {
+            "seconds": round(scan_seconds, 6),
+            "predicted_seconds": round(plan_scan(selected_bands, rbw_step_size, acquisition_mode, max_hold_time, rbw_config_val).scan_seconds, 3),
+            "points": len(scan_data),
+            "points_per_second": round(len(scan_data) / scan_seconds, 1) if scan_seconds > 0 else None,
+            # Where the wall time went: waiting for sweeps (the status-driven replacement for fixed sleeps),
+            # other instrument I/O, and everything else (Python processing, CSV streaming)
+            "sweep_wait_seconds": round(recorder.sweep_wait_seconds, 6),
+            "io_seconds": round(recorder.io_seconds, 6),
+            "python_seconds": round(scan_seconds - recorder.sweep_wait_seconds - recorder.io_seconds, 6),
+            "bands": band_results,
+            "commands": recorder.command_summary(),
+        },
+    }
+
+
+def run_acquisition_benchmark(instrument_address, selected_bands, acquisition_modes, rbw_step_size, rbw_config_val, vbw_config_val, max_hold_time, output_filename, instrument_settings=None, adaptive_threshold_db=DEFAULT_ADAPTIVE_THRESHOLD_DB, simulator_time_scale=1.0):
+    """
+    Benchmarks the acquisition of the selected bands in each acquisition mode on a real or simulated
+    instrument (a fresh connection per mode), and saves the results as JSON so runs of different
+    versions, settings and modes can be compared.
+    For each mode the JSON has the initialization time, the scan time (measured and predicted by plan_scan),
+    points/second overall and per band, the split of the scan time into sweep wait, instrument I/O and
+    Python processing, and the latency percentiles of every SCPI mnemonic (see BenchmarkRecorder).
+
+    Args:
+        instrument_address (str): VISA address, or one of simulated_instrument_addresses().
+        selected_bands (list): Band dictionaries to scan.
+        acquisition_modes (list): The ACQUISITION_MODES to benchmark, in order.
+        output_filename (str): The JSON file to write.
+        simulator_time_scale (float): Time scale of a simulated instrument's modelled delays (see SimulatedN9340B).
+        The remaining arguments are the scan settings, as for run_spectrum_scan_logic.
+    Returns:
+        dict: The benchmark results, as saved.
+    """
+    if instrument_settings is None:
+        instrument_settings = DEFAULT_INSTRUMENT_SETTINGS
+    rm = None if instrument_address.startswith("SIM::N9340B::") else pyvisa.ResourceManager()
+    results = {
+        "script": os.path.basename(__file__),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "instrument": {"address": instrument_address},
+        "settings": {
+            "bands": selected_bands,
+            "rbw_step_size_hz": rbw_step_size,
+            "rbw": rbw_config_val,
+            "vbw": vbw_config_val,
+            "max_hold_time_seconds": max_hold_time,
+            "adaptive_threshold_db": adaptive_threshold_db,
+            "instrument_settings": instrument_settings,
+            "simulator_time_scale": simulator_time_scale if rm is None else None,
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as scan_dir:
+        for acquisition_mode in acquisition_modes:
+            print(f"\n--- ⏱️ Benchmarking {acquisition_mode} mode on {instrument_address} ---")
+            if rm is None:
+                inst = SimulatedN9340B(time_scale=simulator_time_scale, resource_name=instrument_address)
+            else:
+                inst = open_instrument(rm, instrument_address)
+            try:
+                results["instrument"]["idn"] = query_safe(inst, "*IDN?")
+                run_result = benchmark_acquisition_mode(
+                    inst, selected_bands, acquisition_mode, rbw_step_size, rbw_config_val, vbw_config_val,
+                    max_hold_time, instrument_settings, adaptive_threshold_db, scan_dir
+                )
+            finally:
+                inst.close()
+            results["runs"].append(run_result)
+            scan_result = run_result["scan"]
+            print(f"⏱️ {acquisition_mode}: {scan_result['points']} points in {scan_result['seconds']:.2f} s "
+                  f"(predicted {scan_result['predicted_seconds']:.2f} s), {scan_result['points_per_second']} points/sec; "
+                  f"sweep wait {scan_result['sweep_wait_seconds']:.2f} s, I/O {scan_result['io_seconds']:.2f} s, Python {scan_result['python_seconds']:.2f} s.")
+
+    output_dir = os.path.dirname(output_filename)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_filename, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\n💾 Benchmark results saved to {output_filename}")
+    return results
+
+
+def run_startup_probe(probe, scan_settings):
+    """
+    Runs in a probe process started by run_startup_benchmark, and prints the seconds from the launch
+    of the process to each milestone, with the tracked modules loaded by then, as one JSON line.
+    The "gui" probe opens the scan configuration window and closes it once it is drawn.
+    The "scan" probe starts a scan in a temporary folder and stops it after the first segment.
+
+    Args:
+        probe (str): One of STARTUP_PROBES.
+        scan_settings (dict): Keyword arguments for run_spectrum_scan_logic, for the "scan" probe.
+    """
+    launch_time = float(os.environ.get(STARTUP_LAUNCH_TIME_VARIABLE, time.time()))
+    milestones = {}
+
+    def reach(milestone):
+        milestones[milestone] = {
+            "seconds": round(time.time() - launch_time, 4),
+            "modules": [module_name for module_name in STARTUP_TRACKED_MODULES if module_name in sys.modules],
+        }
+
+    reach("imports")
+    error = None
+    if probe == "gui":
+        try:
+            load_gui_modules()
+            root = tk.Tk()
+            ScanApp(root)
+            root.update()
+            reach("gui")
+            root.destroy()
+        except Exception as e: # e.g. no display
+            error = str(e)
+    else:
+        scan_control = ScanControl(queue.Queue())
+        with tempfile.TemporaryDirectory() as scan_dir:
+            os.chdir(scan_dir) # Keeps the scan files (and the checkpoint of the stopped cycle) out of the real scans
+            scan_thread = threading.Thread(target=run_spectrum_scan_logic, name="scan", kwargs=dict(scan_settings, scan_control=scan_control))
+            scan_thread.start()
+            while True:
+                event = scan_control.events.get()
+                if event["type"] == "segment_data":
+                    reach("first_segment")
+                    scan_control.request_stop()
+                elif event["type"] == "error":
+                    error = event["message"]
+                elif event["type"] == "finished":
+                    break
+            scan_thread.join()
+            os.chdir(os.path.dirname(scan_dir))
+    print(STARTUP_PROBE_RESULT_PREFIX + json.dumps({"probe": probe, "milestones": milestones, "error": error}))
+
+
+def run_startup_benchmark(probe_arguments, runs, output_filename):
+    """
+    Measures how long the script takes to start: the imports, the time to the open GUI and the time to
+    the first measured segment of a scan. Every run starts each of STARTUP_PROBES in a fresh Python
+    process (see run_startup_probe), so the imports are timed cold, as when the script is launched.
+    Saves the milestones of every run and their median, minimum and maximum as JSON.
+
+    Args:
+        probe_arguments (list): Command-line arguments passed on to the probes (the scan settings).
+        runs (int): How many times to start each probe.
+        output_filename (str): The JSON file to write.
+    Returns:
+        dict: The benchmark results, as saved.
+    """
+    results = {
+        "script": os.path.basename(__file__),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "arguments": probe_arguments,
+        "runs": [],
+        "milestones": {},
+    }
+    # The probes print emoji, which the default encoding of a pipe cannot encode on Windows
+    probe_env = dict(os.environ, PYTHONIOENCODING="utf-8")
+
+    for run_number in range(1, runs + 1):
+        run_result = {}
+        for probe in STARTUP_PROBES:
+            probe_env[STARTUP_LAUNCH_TIME_VARIABLE] = repr(time.time())
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--startup-probe", probe] + probe_arguments,
+                                       capture_output=True, text=True, encoding="utf-8", errors="replace", env=probe_env)
+            result_lines = [line for line in completed.stdout.splitlines() if line.startswith(STARTUP_PROBE_RESULT_PREFIX)]
+            if not result_lines:
+                print(f"❌ The {probe} probe failed (exit status {completed.returncode}):\n{completed.stderr.strip()}")
+                continue
+            probe_result = json.loads(result_lines[-1][len(STARTUP_PROBE_RESULT_PREFIX):])
+            if probe_result["error"]:
+                print(f"⚠️ The {probe} probe reported: {probe_result['error']}")
+            run_result[probe] = probe_result
+        results["runs"].append(run_result)
+        print(f"⏱️ Run {run_number}: " + ", ".join(
+            f"{probe} {milestone} {milestone_result['seconds']:.3f} s"
+            for probe, probe_result in run_result.items()
+            for milestone, milestone_result in probe_result["milestones"].items()
+        ))
+
+    for run_result in results["runs"]:
+        for probe, probe_result in run_result.items():
+            for milestone, milestone_result in probe_result["milestones"].items():
+                results["milestones"].setdefault(f"{probe}:{milestone}", []).append(milestone_result["seconds"])
+    for milestone_name, seconds in results["milestones"].items():
+        results["milestones"][milestone_name] = {
+            "median_seconds": round(float(np.median(seconds)), 4),
+            "min_seconds": min(seconds),
+            "max_seconds": max(seconds),
+            "runs": len(seconds),
+        }
+        print(f"⏱️ {milestone_name}: median {results['milestones'][milestone_name]['median_seconds']:.3f} s "
+              f"(min {min(seconds):.3f} s, max {max(seconds):.3f} s)")
+
+    output_dir = os.path.dirname(output_filename)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_filename, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\n💾 Startup benchmark results saved to {output_filename}")
+    return results
+
+
+def run_headless_scan(**scan_settings):
+    """
+    Runs run_spectrum_scan_logic without the GUI, for unattended scanning (e.g. as a service on a rack PC).
+    The scan runs in a worker thread, as from the GUI; this thread reports cycle results and errors
+    and turns Ctrl+C or SIGTERM into a clean stop after the current segment (an unfinished cycle keeps
+    its checkpoint and resumes on the next start), instead of the interactive console prompts.
+
+    Args:
+        scan_settings: Keyword arguments for run_spectrum_scan_logic (except scan_control).
+    Returns:
+        int: Exit status for the process: 0, or 1 if the scan reported an error.
+    """
+    scan_control = ScanControl(queue.Queue())
+    scan_thread = threading.Thread(target=run_spectrum_scan_logic, name="scan", kwargs=dict(scan_settings, scan_control=scan_control))
+
+    def request_stop(signal_number, frame):
+        print(f"\n🛑 {signal.Signals(signal_number).name} received. Stopping after the current segment...")
+        scan_control.request_stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    exit_status = 0
+    scan_thread.start()
+    while True:
+        # Wake up every second so the signal handlers get to run
+        try:
+            event = scan_control.events.get(timeout=1)
+        except queue.Empty:
+            if not scan_thread.is_alive():
+                break
+            continue
+        event_type = event["type"]
+        if event_type == "cycle_complete":
+            print(f"✅ Cycle #{event['cycle']} complete: {event['points']} points in {event['csv_filename']}")
+        elif event_type == "error":
+            print(f"❌ {event['title']}: {event['message']}")
+            exit_status = 1
+        elif event_type == "finished":
+            break
+    scan_thread.join()
+    return exit_status
+
+
+def config_settings_to_argv(parser, config_settings):
+    """
+    Turns the settings of a --config JSON file into command line arguments, so they are parsed (and their
+    type and choices checked) exactly like options typed on the command line.
+    Args:
+        parser (argparse.ArgumentParser): The script's parser.
+        config_settings (dict): The settings, keyed by option name with '_' for '-' (e.g. "scan_name").
+    Returns:
+        list: The arguments, e.g. ["--scan-name=Rack", "--bands", "Low VHF+FM", "--no-preamp"].
+    Raises:
+        ValueError: For an unknown setting or a switch whose value isn't true or false.
+    """
+    actions = {action.dest: action for action in parser._actions if action.option_strings and action.dest not in ("help", "config")}
+    argv = []
+    for setting, value in config_settings.items():
+        action = actions.get(setting)
+        if action is None:
+            raise ValueError(f"Unknown setting '{setting}'")
+        option = next(option for option in action.option_strings if option.startswith("--") and not option.startswith("--no-"))
+        if value is None:
+            continue
+        if action.nargs == 0: # A switch (store_true or --x/--no-x)
+            if not isinstance(value, bool):
+                raise ValueError(f"Setting '{setting}' must be true or false, not {json.dumps(value)}")
+            if isinstance(action, argparse.BooleanOptionalAction):
+                argv.append(option if value else "--no-" + option[2:])
+            elif value == action.const:
+                argv.append(option)
+        elif action.nargs in ("+", "*"):
+            argv += [option] + [str(item) for item in (value if isinstance(value, list) else [value])]
+        else:
+            if isinstance(value, (list, dict)):
+                raise ValueError(f"Setting '{setting}' must be a single value, not {json.dumps(value)}")
+            argv.append(f"{option}={value}")
+    return argv
+
 
 # The actual entry point of the script
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="N9340B spectrum scanner. Without options, the scan configuration GUI opens.")
+    parser.add_argument("--headless", action="store_true", help="Scan without the GUI (tkinter is not loaded), e.g. as a service. Stop with Ctrl+C or SIGTERM.")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark the acquisition modes and save the timings as JSON instead of opening the GUI.")
+    parser.add_argument("--startup-benchmark", action="store_true", help="Time the imports, the time to the open GUI and the time to the first segment of a scan "
+                                                                         "with the given settings, in fresh processes, and save the timings as JSON.")
+    parser.add_argument("--waterfall", action="store_true", help="Render the waterfall of --scan-name's history in the spectrum store as HTML and exit "
+                                                                 "(--bands limits the frequencies, --open-html opens it).")
+    parser.add_argument("--import-store", action="store_true", help=f"Add the cycle files already in the folder of --scan-name to the spectrum store (N9340 Scans/{STORE_FILENAME}) and exit.")
+    parser.add_argument("--startup-probe", choices=STARTUP_PROBES, help=argparse.SUPPRESS) # A process started by --startup-benchmark
+    parser.add_argument("--config", metavar="FILE", help="JSON file of settings, keyed by the option names below with '_' for '-' "
+                                                         "(e.g. {\"scan_name\": \"Rack\", \"bands\": [\"Low VHF+FM\"], \"mode\": \"Trace\"}). "
+                                                         "Options given on the command line override it.")
+
+    scan_group = parser.add_argument_group("scan parameters")
+    scan_group.add_argument("--scan-name", default="My_Spectrum_Scan", help="Scan series name (output folder and file prefix).")
+    scan_group.add_argument("--bands", nargs="+", metavar="BAND", help="Band names from SCAN_BAND_RANGES to scan (default: all bands; the first band for --benchmark).")
+    scan_group.add_argument("--step", type=float, default=DEFAULT_RBW_STEP_SIZE_HZ, help="RBW step size in Hz.")
+    scan_group.add_argument("--max-hold", type=float, help=f"Max hold time per segment in seconds (default {DEFAULT_MAXHOLD_TIME_SECONDS}; 0 for --benchmark and --startup-benchmark, so the timings show the acquisition itself).")
+    scan_group.add_argument("--cycle-wait", type=float, default=DEFAULT_CYCLE_WAIT_TIME_SECONDS, help="Wait between scan cycles in seconds.")
+    scan_group.add_argument("--mode", choices=ACQUISITION_MODES, default=DEFAULT_ACQUISITION_MODE, help="Acquisition mode.")
+    scan_group.add_argument("--adaptive-threshold", type=float, default=DEFAULT_ADAPTIVE_THRESHOLD_DB, help="dB above the noise floor for a fine scan in Adaptive mode.")
+    scan_group.add_argument("--output-format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help="Files written for each cycle.")
+    scan_group.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL_SECONDS, help="Seconds between CSV fsyncs and checkpoint updates.")
+    scan_group.add_argument("--record-visa-metrics", action=argparse.BooleanOptionalAction, default=False, help="Record VISA metrics and a timeline of each cycle.")
+    scan_group.add_argument("--statistics", action=argparse.BooleanOptionalAction, default=True, help="Keep running statistics of the series per frequency (<series>_statistics.npz).")
+    scan_group.add_argument("--level-histograms", action=argparse.BooleanOptionalAction, default=False, help="Keep level histograms in the statistics, for percentiles.")
+    scan_group.add_argument("--store", action=argparse.BooleanOptionalAction, default=False, help=f"Add every cycle to the spectrum store (N9340 Scans/{STORE_FILENAME}), keeping the last {STORE_RETENTION_DAYS} days.")
+
+    instrument_group = parser.add_argument_group("instrument")
+    instrument_group.add_argument("--simulate", action="store_true", help="Use the simulated instrument instead of the first VISA instrument found.")
+    instrument_group.add_argument("--multi-instrument", action=argparse.BooleanOptionalAction, default=False, help="Split the bands across every connected analyzer.")
+    instrument_group.add_argument("--address", help="VISA address of the instrument to benchmark (default: the first one found).")
+    instrument_group.add_argument("--clear-reset", action=argparse.BooleanOptionalAction, default=True, help="*CLS; *RST at the start of every cycle.")
+    instrument_group.add_argument("--rbw", default="1KHZ", help="Instrument RBW setting, e.g. 1KHZ.")
+    instrument_group.add_argument("--vbw", default="1KHZ", help="Instrument VBW setting, e.g. 1KHZ.")
+    instrument_group.add_argument("--preamp", action=argparse.BooleanOptionalAction, default=True, help="Preamplifier ON for high sensitivity.")
+    instrument_group.add_argument("--display-log", action=argparse.BooleanOptionalAction, default=True, help="Logarithmic display scale.")
+    instrument_group.add_argument("--ref-level", type=float, default=-30, help="Display reference level in dBm.")
+    instrument_group.add_argument("--max-hold-trace", action=argparse.BooleanOptionalAction, default=True, help="Trace 1 in max hold.")
+
+    plot_group = parser.add_argument_group("plot options")
+    plot_group.add_argument("--plot", action=argparse.BooleanOptionalAction, default=False, help="Write the HTML plot of each cycle in headless mode (loads plotly).")
+    plot_group.add_argument("--gov-markers", action=argparse.BooleanOptionalAction, default=True, help="Government band markers in the plot.")
+    plot_group.add_argument("--tv-markers", action=argparse.BooleanOptionalAction, default=True, help="TV channel markers in the plot.")
+    plot_group.add_argument("--open-html", action=argparse.BooleanOptionalAction, default=False, help="Open each plot in the browser.")
+    plot_group.add_argument("--plot-point-budget", type=int, default=DEFAULT_PLOT_POINT_BUDGET, help="Most points drawn in a plot (0 draws every point).")
+
+    plot_group.add_argument("--waterfall-start", type=datetime.fromisoformat, help="First cycle time of the waterfall, e.g. 2025-07-01 or 2025-07-01T12:00 (default: the first stored cycle).")
+    plot_group.add_argument("--waterfall-stop", type=datetime.fromisoformat, help="Last cycle time of the waterfall (default: the last stored cycle).")
+    plot_group.add_argument("--waterfall-output", help=f"HTML file of the waterfall (default: N9340 Scans/<series>/<series>{WATERFALL_FILE_SUFFIX}).")
+
+    benchmark_group = parser.add_argument_group("benchmark")
+    benchmark_group.add_argument("--modes", nargs="+", choices=ACQUISITION_MODES, default=ACQUISITION_MODES, help="Acquisition modes to benchmark (default: all).")
+    benchmark_group.add_argument("--time-scale", type=float, default=1.0, help="Time scale of the simulated instrument's modelled delays (0 runs as fast as possible).")
+    benchmark_group.add_argument("--runs", type=int, default=STARTUP_BENCHMARK_RUNS, help="Runs of the startup benchmark.")
+    benchmark_group.add_argument("--output", help="JSON file for the results (default: N9340 Scans/Benchmarks/benchmark_<timestamp>.json or startup_<timestamp>.json).")
+
+    # Settings from the config file are parsed as arguments placed before the command line ones,
+    # so they are checked like typed options and the command line still overrides them
+    config_args, _ = parser.parse_known_args()
+    config_argv = []
+    if config_args.config:
+        try:
+            with open(config_args.config) as config_file:
+                config_settings = json.load(config_file)
+            if not isinstance(config_settings, dict):
+                raise ValueError("expected a JSON object of settings")
+            config_argv = config_settings_to_argv(parser, config_settings)
+        except (OSError, ValueError) as e:
+            parser.error(f"Cannot use config file {config_args.config}: {e}")
+        # Values argparse rejects (e.g. "mode": "trace") are reported by their option
+        parser.parse_args(config_argv)
+    args = parser.parse_args(config_argv + sys.argv[1:])
+
+    bands_by_name = {band["Band Name"]: band for band in SCAN_BAND_RANGES}
+    unknown_bands = [band_name for band_name in args.bands or [] if band_name not in bands_by_name]
+    if unknown_bands:
+        parser.error(f"Unknown band(s): {', '.join(unknown_bands)}. Choose from: {', '.join(bands_by_name)}")
+    selected_bands = [bands_by_name[band_name] for band_name in args.bands] if args.bands else None
+    # The same checks as ScanApp.start_scan
+    if args.step <= 0:
+        parser.error("RBW Step Size must be a positive number.")
+    if args.max_hold is not None and args.max_hold < 0:
+        parser.error("Max Hold Time cannot be negative.")
+    if args.cycle_wait < 0:
+        parser.error("Cycle Wait Time cannot be negative.")
+    if args.adaptive_threshold <= 0:
+        parser.error("Adaptive Threshold must be a positive number of dB.")
+
+    scan_settings = dict(
+        scan_name=args.scan_name,
+        rbw_step_size=args.step,
+        max_hold_time=(0 if args.startup_probe else DEFAULT_MAXHOLD_TIME_SECONDS) if args.max_hold is None else args.max_hold,
+        cycle_wait_time=args.cycle_wait,
+        selected_bands=selected_bands or SCAN_BAND_RANGES,
+        include_gov_markers=args.gov_markers,
+        include_tv_markers=args.tv_markers,
+        rbw_config_val=args.rbw,
+        vbw_config_val=args.vbw,
+        open_html_after_complete=args.open_html,
+        acquisition_mode=args.mode,
+        use_simulator=args.simulate,
+        flush_interval_seconds=args.flush_interval,
+        output_format=args.output_format,
+        instrument_settings={
+            "clear_reset": args.clear_reset,
+            "preamplifier_on": args.preamp,
+            "display_log": args.display_log,
+            "ref_level": args.ref_level,
+            "max_hold_on": args.max_hold_trace,
+        },
+        adaptive_threshold_db=args.adaptive_threshold,
+        plot_point_budget=args.plot_point_budget,
+        multi_instrument=args.multi_instrument,
+        record_visa_metrics=args.record_visa_metrics,
+        save_plot=args.plot,
+        update_statistics=args.statistics,
+        level_histograms=args.level_histograms,
+        update_store=args.store,
+    )
+
+    if args.startup_probe:
+        run_startup_probe(args.startup_probe, scan_settings)
+        sys.exit(0)
+
+    if args.waterfall:
+        check_and_install_dependencies(interactive=False)
+        rendered_filename = render_series_waterfall(
+            args.scan_name.replace(" ", "_"), args.waterfall_start, args.waterfall_stop,
+            min(band["Start MHz"] for band in selected_bands) if selected_bands else None,
+            max(band["Stop MHz"] for band in selected_bands) if selected_bands else None,
+            args.waterfall_output, args.open_html
+        )
+        sys.exit(0 if rendered_filename else 1)
+
+    if args.import_store:
+        series = args.scan_name.replace(" ", "_")
+        scan_dir = os.path.join(os.getcwd(), "N9340 Scans", series)
+        if not os.path.isdir(scan_dir):
+            parser.error(f"No scan series folder {scan_dir}.")
+        spectrum_store = SpectrumStore(os.path.join(os.getcwd(), "N9340 Scans", STORE_FILENAME))
+        spectrum_store.import_cycle_files(series, scan_dir, args.step)
+        spectrum_store.close()
+        sys.exit(0)
+
+    if args.headless:
+        check_and_install_dependencies(include_plotting=args.plot, interactive=False)
+        sys.exit(run_headless_scan(**scan_settings))
+
     # Check dependencies first
     check_and_install_dependencies()
-    
+
+    if args.benchmark:
+        if args.simulate:
+            benchmark_address = SIMULATED_INSTRUMENT_ADDRESS
+        else:
+            benchmark_address = args.address or next(iter(pyvisa.ResourceManager().list_resources()), None)
+            if benchmark_address is None:
+                parser.error("No VISA instruments found. Connect the instrument or use --simulate.")
+        output_filename = args.output or os.path.join(os.getcwd(), "N9340 Scans", BENCHMARK_SUBFOLDER, f"benchmark_{datetime.now().strftime('%Y%m%d@%H%M%S')}.json")
+
+        run_acquisition_benchmark(
+            benchmark_address, selected_bands or SCAN_BAND_RANGES[:1], args.modes, args.step, args.rbw, args.vbw,
+            0 if args.max_hold is None else args.max_hold, output_filename,
+            simulator_time_scale=args.time_scale
+        )
+        sys.exit(0)
+
+    if args.startup_benchmark:
+        if args.runs < 1:
+            parser.error("--runs must be at least 1.")
+        output_filename = args.output or os.path.join(os.getcwd(), "N9340 Scans", BENCHMARK_SUBFOLDER, f"startup_{datetime.now().strftime('%Y%m%d@%H%M%S')}.json")
+        probe_arguments = [argument for argument in sys.argv[1:] if argument != "--startup-benchmark"]
+        run_startup_benchmark(probe_arguments, args.runs, output_filename)
+        sys.exit(0)
+
     # Then launch the GUI
+    load_gui_modules()
     root = tk.Tk()
     app = ScanApp(root)
     root.mainloop()
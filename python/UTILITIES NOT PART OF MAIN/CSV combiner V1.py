@@ -2,79 +2,292 @@
 #NB you need to pip install pandas
 
 import os
+import sys
+import argparse
+import tempfile
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from scan_files import BENCHMARK_WORKER_COUNTS, benchmark_workers, list_scan_files, has_header_row, read_npz_scan_file
 
-def process_csv_files(folder_path):
+CHUNK_ROWS = 100_000 # Rows read (and written) at a time, so memory use doesn't grow with the size or number of files
+FREQUENCY_DECIMALS = 6 # Grid frequencies in MHz are rounded to 1 Hz
+LEVEL_DECIMALS = 2 # Levels in dBm are written with the scanner's own precision
+OUTPUT_PREFIXES = ("Mashed-", "Average-") # Our own output files, never read back as scan files
+DEFAULT_WORKERS = os.cpu_count() or 1 # Processes reading and binning files in parallel
+PROGRESS_INTERVAL_FILES = 100 # Progress is printed every this many files, instead of for every file
+
+
+def iter_scan_chunks(file_path, chunk_rows=CHUNK_ROWS):
+    """
+    Reads one scan output file in chunks. Handles both the scanner's CSV files and its binary
+    .npz files ("CSV + NPZ" output format). CSV files are parsed straight to floats by pandas'
+    C engine; a header row is skipped, and from a chunk with any other text on, rows whose
+    frequency isn't a number are skipped (a slower parse).
+
+    Args:
+        file_path (str): Path to a .csv or .npz scan file.
+        chunk_rows (int): Most rows per chunk.
+    Yields:
+        tuple: (numpy.ndarray, numpy.ndarray) The frequencies (MHz) of the chunk's rows, and their
+               levels (dBm) with one column per level column of the file.
+    """
+    if file_path.lower().endswith('.npz'):
+        frequencies, levels = read_npz_scan_file(file_path)
+        frequencies = frequencies.astype(np.float64)
+        levels = levels.astype(np.float64).reshape(-1, 1)
+        for start in range(0, len(frequencies), chunk_rows):
+            yield frequencies[start:start + chunk_rows], levels[start:start + chunk_rows]
+        return
+    rows_read = 1 if has_header_row(file_path) else 0
+    try:
+        for chunk in pd.read_csv(file_path, header=None, skiprows=rows_read, chunksize=chunk_rows, dtype=np.float64, engine='c'):
+            values = chunk.to_numpy()
+            rows_read += len(values)
+            values = values[~np.isnan(values[:, 0])]
+            if len(values):
+                yield values[:, 0], values[:, 1:]
+        return
+    except ValueError:
+        pass # Text in the chunk: read the rest of the file as text and convert what is numeric
+    for chunk in pd.read_csv(file_path, header=None, skiprows=rows_read, chunksize=chunk_rows, dtype=str):
+        values = chunk.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values[:, 0])]
+        if len(values):
+            yield values[:, 0], values[:, 1:]
+
+
+def map_files(function, file_paths, workers, *argument_iterables):
+    """
+    Calls function(file_path, *arguments) for every file in a pool of worker processes,
+    yielding the results in file order, and prints the progress.
+
+    Args:
+        function: A module-level function (so it can be sent to the worker processes).
+        file_paths (list): The scan files.
+        workers (int): Number of worker processes (1 runs in this process).
+        *argument_iterables: Further arguments for function, one iterable per argument with an item for
+                             each file, as for map() (itertools.repeat for an argument that is the same for every file).
+    Yields:
+        The result for each file, in file order.
+    """
+    if workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Larger chunks send fewer, bigger messages between the processes
+            results = executor.map(function, file_paths, *argument_iterables, chunksize=max(1, len(file_paths) // (workers * 4)))
+            yield from report_progress(results, len(file_paths))
+    else:
+        yield from report_progress(map(function, file_paths, *argument_iterables), len(file_paths))
+
+
+def report_progress(results, file_count):
+    """Passes results through, printing the progress every PROGRESS_INTERVAL_FILES files."""
+    for file_number, result in enumerate(results, start=1):
+        if file_number % PROGRESS_INTERVAL_FILES == 0 or file_number == file_count:
+            print(f"🔄 Processed {file_number} of {file_count} files...")
+        yield result
+
+
+def scan_file_extent(file_path, chunk_rows=CHUNK_ROWS):
+    """
+    Finds the frequency range, level column count and smallest frequency step of one scan file.
+
+    Args:
+        file_path (str): Path to a .csv or .npz scan file.
+        chunk_rows (int): Most rows read at a time.
+    Returns:
+        tuple: (float, float, int, float) The lowest and highest frequency (MHz; inf and -inf without data),
+               the number of level columns, and the smallest step between its frequencies (None for one frequency).
+    """
+    lowest_mhz, highest_mhz = np.inf, -np.inf
+    level_column_count = 0
+    smallest_step_mhz = None
+    for frequencies, levels in iter_scan_chunks(file_path, chunk_rows):
+        lowest_mhz = min(lowest_mhz, frequencies.min())
+        highest_mhz = max(highest_mhz, frequencies.max())
+        level_column_count = max(level_column_count, levels.shape[1])
+        steps = np.diff(np.unique(np.round(frequencies, FREQUENCY_DECIMALS)))
+        if len(steps):
+            chunk_step_mhz = round(float(steps.min()), FREQUENCY_DECIMALS)
+            smallest_step_mhz = chunk_step_mhz if smallest_step_mhz is None else min(smallest_step_mhz, chunk_step_mhz)
+    return float(lowest_mhz), float(highest_mhz), level_column_count, smallest_step_mhz
+
+
+def find_common_grid(file_paths, grid_step_mhz=None, chunk_rows=CHUNK_ROWS, workers=DEFAULT_WORKERS):
+    """
+    Finds a frequency grid covering every file, in one streaming pass over the files
+    (in parallel, see scan_file_extent).
+
+    Args:
+        file_paths (list): The scan files.
+        grid_step_mhz (float): Grid step in MHz. None uses the smallest frequency step of the first file.
+        chunk_rows (int): Most rows read at a time.
+        workers (int): Number of worker processes.
+    Returns:
+        tuple: (float, float, int, list) The first grid frequency (MHz), the grid step (MHz),
+               the number of grid points, and the number of level columns of each file.
+    """
+    lowest_mhz, highest_mhz = np.inf, -np.inf
+    level_column_counts = []
+    for file_lowest_mhz, file_highest_mhz, level_column_count, smallest_step_mhz in map_files(scan_file_extent, file_paths, workers, repeat(chunk_rows)):
+        lowest_mhz = min(lowest_mhz, file_lowest_mhz)
+        highest_mhz = max(highest_mhz, file_highest_mhz)
+        level_column_counts.append(level_column_count)
+        if grid_step_mhz is None:
+            grid_step_mhz = smallest_step_mhz
+    if not np.isfinite(lowest_mhz):
+        return None, None, 0, level_column_counts
+    if grid_step_mhz is None:
+        grid_step_mhz = 1.0 # Every file holds a single frequency
+    point_count = int(np.rint((highest_mhz - lowest_mhz) / grid_step_mhz)) + 1
+    return float(lowest_mhz), grid_step_mhz, point_count, level_column_counts
+
+
+def bin_to_grid(frequencies, levels, grid_start_mhz, grid_step_mhz, binned_levels):
     """
-    Scans a specified folder for CSV files, merges them into a single file,
-    and calculates the average of all columns (except the first two) into another file.
+    Bins measured points to the nearest grid frequency. Several points in one bin keep the highest
+    level, as max hold does, so a narrow peak isn't averaged away.
+
+    Args:
+        frequencies (numpy.ndarray): Frequencies in MHz.
+        levels (numpy.ndarray): The level (dBm) of every frequency.
+        grid_start_mhz (float): The first grid frequency.
+        grid_step_mhz (float): The grid step.
+        binned_levels (numpy.ndarray): Grid levels, updated in place (-inf where nothing was measured yet).
+    """
+    measured = ~np.isnan(levels)
+    grid_indices = np.rint((frequencies[measured] - grid_start_mhz) / grid_step_mhz).astype(np.int64)
+    np.maximum.at(binned_levels, grid_indices, levels[measured])
+
+
+def bin_scan_file(file_path, level_column_count, grid_start_mhz, grid_step_mhz, point_count, chunk_rows=CHUNK_ROWS):
+    """
+    Bins every level column of one scan file to the grid (see bin_to_grid).
+
+    Args:
+        file_path (str): Path to a .csv or .npz scan file.
+        level_column_count (int): The file's number of level columns (see scan_file_extent).
+        grid_start_mhz (float): The first grid frequency.
+        grid_step_mhz (float): The grid step.
+        point_count (int): The number of grid points.
+        chunk_rows (int): Most rows read at a time.
+    Returns:
+        numpy.ndarray: float32 levels, one row per level column and one column per grid point (NaN where not measured).
+    """
+    binned_levels = np.full((level_column_count, point_count), -np.inf)
+    for frequencies, levels in iter_scan_chunks(file_path, chunk_rows):
+        for column in range(levels.shape[1]):
+            bin_to_grid(frequencies, levels[:, column], grid_start_mhz, grid_step_mhz, binned_levels[column])
+    binned_levels[np.isneginf(binned_levels)] = np.nan
+    return binned_levels.astype(np.float32)
+
+
+def benchmark_process_files(folder_path, worker_counts=BENCHMARK_WORKER_COUNTS, chunk_rows=CHUNK_ROWS):
+    """
+    Reads every scan file in a folder with each worker count and prints the files/sec (see scan_files.benchmark_workers).
+    It times the first pass of process_csv_files (find_common_grid), which parses every file in full;
+    the binning pass reads the files the same way.
+
+    Args:
+        folder_path (str): The path to the folder containing the scan files.
+        worker_counts (list): The worker counts to compare.
+        chunk_rows (int): Most rows read at a time.
+    Returns:
+        dict: Files/sec by worker count.
+    """
+    file_paths = [os.path.join(folder_path, file) for file in list_scan_files(folder_path, exclude_prefixes=OUTPUT_PREFIXES)]
+    if not file_paths:
+        print("❌ No CSV files found.")
+        return {}
+    print(f"⏱️ Benchmarking {len(file_paths)} files ({os.cpu_count()} CPUs)...")
+    return benchmark_workers(lambda paths, workers: find_common_grid(paths, None, chunk_rows, workers), file_paths, worker_counts)
+
+
+def process_csv_files(folder_path, grid_step_mhz=None, chunk_rows=CHUNK_ROWS, workers=DEFAULT_WORKERS):
+    """
+    Scans a specified folder for CSV (and binary .npz) scan files, merges them into a single file,
+    and calculates the average of all runs into another file.
+    Every level column of every file is a run. The runs are aligned on a common frequency grid
+    (see find_common_grid and bin_to_grid), so scans with different steps or bands can be merged.
+    The files are streamed in chunks and the merged runs are kept in a memory-mapped file on disk,
+    with only a running sum and count per grid frequency in memory, so weeks of cycles can be merged.
+    The files are read and binned by a pool of worker processes, and merged in file name order.
+    A cycle saved as both .csv and .npz ("CSV + NPZ" output format) is one run, read from the .npz file.
+    Grid frequencies that no run measured are left out of both files.
 
     Args:
         folder_path (str): The path to the folder containing the CSV files.
+        grid_step_mhz (float): Grid step in MHz (default: the smallest frequency step of the first file).
+        chunk_rows (int): Most rows read or written at a time.
+        workers (int): Number of worker processes reading the files.
     """
     print("🔍 Scanning folder for CSV files...")
-    # List all files in the given folder and filter for CSV files (case-insensitive)
-    csv_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.csv')]
-    csv_files.sort() # Sort the files to ensure consistent processing order
+    # One CSV or NPZ scan file per cycle (case-insensitive), sorted for a consistent processing order
+    csv_files = list_scan_files(folder_path, exclude_prefixes=OUTPUT_PREFIXES)
 
     print(f"✅ Found {len(csv_files)} CSV files.")
     if len(csv_files) == 0:
         print("❌ No CSV files found. Exiting function.")
         return # Exit if no CSV files are found
+    file_paths = [os.path.join(folder_path, file) for file in csv_files]
 
-    # Load the first CSV file to establish the base structure (first two columns)
-    print(f"📥 Reading first CSV file: {csv_files[0]}")
-    # Read CSV, skipping the first row (header), and ensure no header is inferred
-    first_df = pd.read_csv(os.path.join(folder_path, csv_files[0]), header=None, skiprows=1)
-
-    # The base DataFrame will contain the first two columns from the first CSV
-    base_df = first_df.iloc[:, 0:2].copy()
-    column_blocks = [] # List to store DataFrames of additional columns
-
-    # Loop through all found CSV files to gather their data
-    for file in csv_files:
-        print(f"🔄 Processing: {file}")
-        # Read each CSV file, skipping the first row (header), and no header inference
-        df = pd.read_csv(os.path.join(folder_path, file), header=None, skiprows=1)
-
-        # Determine the starting column for new data:
-        # If it's the first file, start from the 3rd column (index 2) as first two are base.
-        # Otherwise, start from the 2nd column (index 1) as other files often repeat first column.
-        start_col = 2 if file == csv_files[0] else 1
-        new_cols = df.iloc[:, start_col:] # Select relevant columns
+    print(f"📏 Finding the common frequency grid ({workers} worker(s))...")
+    grid_start_mhz, grid_step_mhz, point_count, level_column_counts = find_common_grid(file_paths, grid_step_mhz, chunk_rows, workers)
+    if point_count == 0:
+        print("❌ The files hold no data. Exiting function.")
+        return
+    grid_stop_mhz = grid_start_mhz + (point_count - 1) * grid_step_mhz
+    print(f"📏 Grid: {point_count} points from {grid_start_mhz:.3f} to {grid_stop_mhz:.3f} MHz, step {grid_step_mhz * 1000:g} kHz.")
 
-        # Assign new column names using the base filename and a numerical suffix
-        # This makes the source of the data more explicit in the mashed file.
-        new_cols.columns = [f"{os.path.basename(file)}_{i}" for i in range(new_cols.shape[1])]
-
-        column_blocks.append(new_cols) # Add the new columns DataFrame to the list
-
-    # Combine the base DataFrame with all collected column blocks along the column axis
-    mashed_df = pd.concat([base_df] + column_blocks, axis=1)
+    # Name the runs using the base filename and a numerical suffix,
+    # which makes the source of the data explicit in the mashed file
+    run_names = [f"{file}_{i}" for file, level_column_count in zip(csv_files, level_column_counts) for i in range(level_column_count)]
+    level_sum = np.zeros(point_count)
+    level_count = np.zeros(point_count, dtype=np.int64)
 
     # Generate a timestamp for unique filenames
     timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
     mashed_filename = f"Mashed-{timestamp}.csv"
-    mashed_path = os.path.join(folder_path, mashed_filename)
-    print(f"💾 Saving mashed file as: {mashed_filename}")
-    # Save the mashed DataFrame to a new CSV file, without the DataFrame index
-    mashed_df.to_csv(mashed_path, index=False)
-
-    # Create a DataFrame for the averaged data
-    print("🧮 Calculating average of all columns (except the first two)...")
-    average_df = pd.DataFrame()
-    # Keep the first column from the mashed DataFrame
-    average_df[mashed_df.columns[0]] = mashed_df.iloc[:, 0]
-    # Calculate the mean of all columns starting from the second one (index 1) across rows
-    average_df["Average"] = mashed_df.iloc[:, 1:].mean(axis=1)
-
-    # Save the averaged file
     average_filename = f"Average-{timestamp}.csv"
-    average_path = os.path.join(folder_path, average_filename)
-    print(f"💾 Saving average file as: {average_filename}")
-    # Save the average DataFrame to a new CSV file, without the DataFrame index
-    average_df.to_csv(average_path, index=False)
+
+    with tempfile.TemporaryDirectory(dir=folder_path) as work_dir:
+        # One row per run, written as each file is binned, and read back in blocks of grid frequencies
+        run_levels = np.lib.format.open_memmap(os.path.join(work_dir, "runs.npy"), mode="w+", dtype=np.float32, shape=(len(run_names), point_count))
+        run_index = 0
+        print(f"🔄 Binning the runs to the grid ({workers} worker(s))...")
+        binned_files = map_files(bin_scan_file, file_paths, workers, level_column_counts,
+                                 repeat(grid_start_mhz), repeat(grid_step_mhz), repeat(point_count), repeat(chunk_rows))
+        for level_column_count, binned_levels in zip(level_column_counts, binned_files):
+            measured = ~np.isnan(binned_levels)
+            level_sum += np.where(measured, binned_levels, 0).sum(axis=0)
+            level_count += measured.sum(axis=0)
+            run_levels[run_index:run_index + level_column_count] = binned_levels
+            run_index += level_column_count
+        run_levels.flush()
+
+        mashed_path = os.path.join(folder_path, mashed_filename)
+        average_path = os.path.join(folder_path, average_filename)
+        print(f"💾 Saving mashed file as: {mashed_filename}")
+        print(f"🧮 Saving average of all runs as: {average_filename}")
+        for block_start in range(0, point_count, chunk_rows):
+            block = slice(block_start, min(block_start + chunk_rows, point_count))
+            measured = level_count[block] > 0
+            frequencies = np.round(grid_start_mhz + np.arange(block.start, block.stop) * grid_step_mhz, FREQUENCY_DECIMALS)[measured]
+            write_header = block_start == 0
+            write_mode = "w" if write_header else "a"
+
+            mashed_df = pd.DataFrame(np.round(run_levels[:, block].T[measured].astype(np.float64), LEVEL_DECIMALS), columns=run_names)
+            mashed_df.insert(0, "Frequency (MHz)", frequencies)
+            mashed_df.to_csv(mashed_path, mode=write_mode, header=write_header, index=False)
+
+            average_df = pd.DataFrame({
+                "Frequency (MHz)": frequencies,
+                "Average": np.round(level_sum[block][measured] / level_count[block][measured], LEVEL_DECIMALS),
+            })
+            average_df.to_csv(average_path, mode=write_mode, header=write_header, index=False)
+        del run_levels # Close the memory map before its folder is removed
 
     print("✅ All tasks completed successfully!")
 
@@ -85,5 +298,14 @@ if __name__ == "__main__":
     # Or for macOS/Linux: "/Users/YourUser/Documents/MyCSVFiles"
     my_folder_path = r"C:\Users\4483\N9340 Scans\No_header"
 
+    parser = argparse.ArgumentParser(description="Merges the scan files of a folder and averages their runs.")
+    parser.add_argument("folder", nargs="?", default=my_folder_path, help="Folder with the scan files.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes reading the files.")
+    parser.add_argument("--benchmark", action="store_true", help="Print files/sec for each of BENCHMARK_WORKER_COUNTS instead of merging.")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_process_files(args.folder)
+        sys.exit(0)
+
     # Call the function to process the CSV files
-    process_csv_files(my_folder_path)
+    process_csv_files(args.folder, workers=args.workers)
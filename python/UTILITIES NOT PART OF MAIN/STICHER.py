@@ -1,18 +1,79 @@
 import os
+import sys
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from scan_files import BENCHMARK_WORKER_COUNTS, benchmark_workers, list_scan_files, read_scan_file
 
-def combine_csv_files(directory_path, output_filename="STICHED.csv"):
+# pyarrow parses CSV files several times faster than pandas' C engine; it is used when installed
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+DEFAULT_WORKERS = os.cpu_count() or 1 # Processes reading files in parallel
+PROGRESS_INTERVAL_FILES = 100 # Progress is printed every this many files, instead of for every file
+
+
+def read_scan_file_or_error(file_path):
+    """
+    read_scan_file (see scan_files.py) for a worker process: returns the error instead of raising it,
+    so one unreadable file doesn't stop the others. CSV files are parsed by CSV_ENGINE.
+
+    Returns:
+        tuple: (pd.DataFrame, str) The scan data (None on error) and the error message (None on success).
+    """
+    try:
+        return read_scan_file(file_path, CSV_ENGINE), None
+    except pd.errors.EmptyDataError:
+        return None, "empty"
+    except Exception as e:
+        return None, str(e)
+
+
+def read_scan_files(file_paths, workers=DEFAULT_WORKERS):
+    """
+    Reads scan files in parallel in a pool of worker processes, returning them in the order given.
+
+    Args:
+        file_paths (list): Paths of the .csv or .npz scan files.
+        workers (int): Number of worker processes (1 reads in this process).
+    Returns:
+        list: The DataFrame of every readable file, in file order (unreadable files are reported and left out).
+    """
+    scan_dfs = []
+    if workers > 1 and len(file_paths) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # Larger chunks send fewer, bigger messages between the processes
+        results = executor.map(read_scan_file_or_error, file_paths, chunksize=max(1, len(file_paths) // (workers * 4)))
+    else:
+        executor = None
+        results = map(read_scan_file_or_error, file_paths)
+    try:
+        for file_number, (file_path, (df, error)) in enumerate(zip(file_paths, results), start=1):
+            if error == "empty":
+                print(f"Warning: {os.path.basename(file_path)} is empty and will be skipped.")
+            elif error:
+                print(f"Error reading {os.path.basename(file_path)}: {error}")
+            else:
+                scan_dfs.append(df)
+            if file_number % PROGRESS_INTERVAL_FILES == 0 or file_number == len(file_paths):
+                print(f"Read {file_number} of {len(file_paths)} files...")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return scan_dfs
+
+
+def combine_csv_files(directory_path, output_filename="STICHED.csv", workers=DEFAULT_WORKERS):
     """
-    Combines all CSV files in a given directory into a single CSV file.
+    Combines all CSV (and binary .npz) scan files in a given directory into a single CSV file.
     It ignores headers in input CSVs and does not create a header in the output CSV.
+    The files are read in parallel (see read_scan_files) and combined in file name order.
+    A cycle saved as both .csv and .npz ("CSV + NPZ" output format) is read once, from the .npz file.
 
     Args:
         directory_path (str): The path to the directory containing the CSV files.
         output_filename (str): The name of the output CSV file.
+        workers (int): Number of worker processes reading the files.
     """
-    all_files = []
-    combined_df = pd.DataFrame() # Initialize an empty DataFrame to store combined data
-
     print(f"Searching for CSV files in: {directory_path}")
 
     # Check if the directory exists
@@ -20,34 +81,20 @@ def combine_csv_files(directory_path, output_filename="STICHED.csv"):
         print(f"Error: Directory not found at '{directory_path}'")
         return
 
-    # List all files in the directory
+    # One scan file (CSV or binary NPZ) per cycle, never re-reading a previous output file
+    # or the scanner's running statistics of the series (<series>_statistics.npz)
     try:
-        files_in_directory = os.listdir(directory_path)
+        csv_files = list_scan_files(directory_path, exclude_names=(output_filename,))
     except OSError as e:
         print(f"Error accessing directory '{directory_path}': {e}")
         return
 
-    # Filter for CSV files
-    csv_files = [f for f in files_in_directory if f.endswith('.csv')]
-
     if not csv_files:
         print(f"No CSV files found in the directory: {directory_path}")
         return
 
-    print(f"Found {len(csv_files)} CSV files.")
-
-    # Read each CSV file and append its DataFrame to a list, ignoring headers
-    for filename in csv_files:
-        file_path = os.path.join(directory_path, filename)
-        try:
-            print(f"Reading {filename} (ignoring header)...")
-            # Read CSV without a header (header=None)
-            df = pd.read_csv(file_path, header=None)
-            all_files.append(df)
-        except pd.errors.EmptyDataError:
-            print(f"Warning: {filename} is empty and will be skipped.")
-        except Exception as e:
-            print(f"Error reading {filename}: {e}")
+    print(f"Found {len(csv_files)} CSV files. Reading them with {workers} worker(s) ({CSV_ENGINE} CSV engine)...")
+    all_files = read_scan_files([os.path.join(directory_path, filename) for filename in csv_files], workers)
 
     if not all_files:
         print("No valid CSV files were read to combine.")
@@ -71,10 +118,37 @@ def combine_csv_files(directory_path, output_filename="STICHED.csv"):
     except Exception as e:
         print(f"Error saving combined CSV to {output_file_path}: {e}")
 
+
+def benchmark_read_scan_files(directory_path, worker_counts=BENCHMARK_WORKER_COUNTS):
+    """
+    Reads every scan file in a directory with each worker count and prints the files/sec (see scan_files.benchmark_workers).
+
+    Args:
+        directory_path (str): The path to the directory containing the scan files.
+        worker_counts (list): The worker counts to compare.
+    Returns:
+        dict: Files/sec by worker count.
+    """
+    file_paths = [os.path.join(directory_path, f) for f in list_scan_files(directory_path, exclude_names=("STICHED.csv",))]
+    if not file_paths:
+        print(f"No CSV files found in the directory: {directory_path}")
+        return {}
+    print(f"Benchmarking {len(file_paths)} files ({CSV_ENGINE} CSV engine, {os.cpu_count()} CPUs)...")
+    return benchmark_workers(read_scan_files, file_paths, worker_counts)
+
+
 # Specify the directory path
 # IMPORTANT: Make sure this path is correct on your system
 directory = r"C:\Users\4483\N9340 Scans\Trad Scans\New folder"
 
 # Call the function to combine the CSV files
 if __name__ == "__main__":
-    combine_csv_files(directory)
+    parser = argparse.ArgumentParser(description="Combines the scan files of a folder into one CSV file.")
+    parser.add_argument("directory", nargs="?", default=directory, help="Folder with the scan files.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes reading the files.")
+    parser.add_argument("--benchmark", action="store_true", help="Print files/sec for each of BENCHMARK_WORKER_COUNTS instead of combining.")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_read_scan_files(args.directory)
+        sys.exit(0)
+    combine_csv_files(args.directory, workers=args.workers)
@@ -11,8 +11,21 @@ import numpy as np # For numerical operations, especially mean
 # IMPORTANT: You must ensure this CSV file is accessible.
 # If running locally, make sure the path is correct.
 # If you've uploaded it, please specify the exact filename (e.g., 'your_data.csv').
+# A single binary scan file (.npz from the "CSV + NPZ" output format) can be plotted too, and so can
+# the scanner's running statistics of a scan series (<series>_statistics.npz): its mean, min and max
+# per frequency over every cycle, without reading the cycle files.
+data_file_path = r'C:\Users\4483\N9340 Scans\No_header\Mashed-20250702-110847.csv'
+is_statistics_file = data_file_path.endswith('_statistics.npz')
 try:
-    df = pd.read_csv(r'C:\Users\4483\N9340 Scans\No_header\Mashed-20250702-110847.csv')
+    if is_statistics_file:
+        with np.load(data_file_path) as archive:
+            df = pd.DataFrame({'Frequency (MHz)': archive['frequency_mhz'], 'Mean': archive['mean_dbm'],
+                               'Min': archive['min_dbm'], 'Max': archive['max_dbm']})
+    elif data_file_path.lower().endswith('.npz'):
+        with np.load(data_file_path) as archive:
+            df = pd.DataFrame({'Frequency (MHz)': archive['frequency_mhz'], 'Level (dBm)': archive['level_dbm']})
+    else:
+        df = pd.read_csv(data_file_path)
 except FileNotFoundError:
     print("ERROR: CSV file not found! Please ensure the path is correct or upload the file.")
     # Exit or handle the error appropriately if running non-interactively
@@ -41,7 +54,12 @@ for col in amplitude_columns:
 # --- Calculate the Average Amplitude ---
 # Calculate the mean across the amplitude columns for each row.
 # `numeric_only=True` is a safeguard, though we've already coerced to numeric.
-df['Average Amplitude'] = df[amplitude_columns].mean(axis=1, numeric_only=True)
+# A statistics file already holds the average over all cycles (its 'Mean' column).
+if is_statistics_file:
+    df['Average Amplitude'] = df['Mean']
+    amplitude_columns.remove('Mean')
+else:
+    df['Average Amplitude'] = df[amplitude_columns].mean(axis=1, numeric_only=True)
 
 # --- Prepare Columns for Plotly ---
 # The 'y' parameter in px.line can accept a list of column names.
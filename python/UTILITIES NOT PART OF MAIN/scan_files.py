@@ -0,0 +1,121 @@
+#Installation of dependancies
+#NB you need to pip install pandas
+
+# Finding and reading the scanner's output files, shared by STICHER and the CSV combiner
+
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+
+SCAN_FILE_EXTENSIONS = ('.npz', '.csv') # In order of preference when a cycle was saved in both formats ("CSV + NPZ")
+STATISTICS_FILE_SUFFIX = "_statistics.npz" # The scanner's running statistics of a series, not a scan file
+CHECKPOINT_FILE_SUFFIX = ".checkpoint.json" # Next to a scan file (<cycle>.csv.checkpoint.json) while its cycle is unfinished
+PART_FILE_PATTERN = re.compile(r"\.part\d+\.csv$", re.IGNORECASE) # One analyzer's share of a multi-instrument cycle (<cycle>.partN.csv)
+BENCHMARK_WORKER_COUNTS = [1, 2, 4, 8] # Worker counts compared by benchmark_workers
+
+
+def list_scan_files(folder_path, exclude_prefixes=(), exclude_names=()):
+    """
+    Lists the scan files of a folder, one file per scan cycle, in file name order.
+    With the "CSV + NPZ" output format every cycle is saved twice (<cycle>.csv and <cycle>.npz);
+    only the .npz file is listed then, as it holds the same data and reads faster.
+    Only complete cycles are listed: a cycle whose CSV file still has a checkpoint next to it is unfinished
+    (or still being written), and the .partN.csv files of a multi-instrument cycle are merged into the
+    cycle's own file once every part is done.
+
+    Args:
+        folder_path (str): The folder with the scan files.
+        exclude_prefixes (tuple): File name prefixes to leave out (e.g. the tool's own output files).
+        exclude_names (tuple): File names to leave out.
+    Returns:
+        list: The file names (without the folder).
+    """
+    folder_files = os.listdir(folder_path)
+    unfinished_files = {file_name[:-len(CHECKPOINT_FILE_SUFFIX)] for file_name in folder_files if file_name.endswith(CHECKPOINT_FILE_SUFFIX)}
+    unfinished_cycles = {os.path.splitext(file_name)[0] for file_name in unfinished_files}
+    files_by_cycle = {}
+    for file_name in folder_files:
+        cycle_name, extension = os.path.splitext(file_name)
+        extension = extension.lower()
+        if (extension not in SCAN_FILE_EXTENSIONS or file_name.startswith(exclude_prefixes) or file_name in exclude_names
+                or file_name.endswith(STATISTICS_FILE_SUFFIX) or PART_FILE_PATTERN.search(file_name) or cycle_name in unfinished_cycles):
+            continue
+        listed_name = files_by_cycle.get(cycle_name)
+        if listed_name is None or SCAN_FILE_EXTENSIONS.index(extension) < SCAN_FILE_EXTENSIONS.index(os.path.splitext(listed_name)[1].lower()):
+            files_by_cycle[cycle_name] = file_name
+    return sorted(files_by_cycle.values())
+
+
+def has_header_row(file_path):
+    """
+    Checks whether a CSV scan file starts with a header row (a first field that isn't a number).
+
+    Args:
+        file_path (str): Path to a .csv scan file.
+    Returns:
+        bool: Whether the first row is a header.
+    """
+    with open(file_path, newline='') as scan_file:
+        first_field = scan_file.readline().split(',')[0].strip()
+    try:
+        float(first_field)
+        return False
+    except ValueError:
+        return first_field != ""
+
+
+def read_npz_scan_file(file_path):
+    """
+    Reads one of the scanner's binary .npz scan files.
+
+    Args:
+        file_path (str): Path to a .npz scan file.
+    Returns:
+        tuple: (numpy.ndarray, numpy.ndarray) The frequencies (MHz) and levels (dBm).
+    """
+    with np.load(file_path) as archive:
+        return archive['frequency_mhz'], archive['level_dbm']
+
+
+def read_scan_file(file_path, csv_engine="c"):
+    """
+    Reads one scan output file into a DataFrame whose two columns are frequency (MHz) and level (dBm).
+    Handles both the scanner's CSV files and its binary .npz files ("CSV + NPZ" output format).
+    CSV files are parsed with explicit dtypes for the scanner's two-column layout, and a header row is skipped.
+
+    Args:
+        file_path (str): Path to a .csv or .npz scan file.
+        csv_engine (str): The pandas CSV engine ("c", or "pyarrow" when installed).
+    Returns:
+        pd.DataFrame: The scan data with integer column labels.
+    """
+    if file_path.lower().endswith('.npz'):
+        frequencies, levels = read_npz_scan_file(file_path)
+        return pd.DataFrame({0: frequencies, 1: levels})
+    return pd.read_csv(file_path, header=None, names=[0, 1], usecols=[0, 1], dtype={0: np.float64, 1: np.float32},
+                       skiprows=1 if has_header_row(file_path) else 0, engine=csv_engine)
+
+
+def benchmark_workers(read_files, file_paths, worker_counts=BENCHMARK_WORKER_COUNTS):
+    """
+    Reads the scan files with each worker count and prints the files/sec, to choose the worker count
+    for this machine and disk. Run it twice if the files aren't in the OS file cache yet,
+    as the first reads then also measure the disk.
+
+    Args:
+        read_files: The tool's parallel reader, called as read_files(file_paths, workers).
+        file_paths (list): Paths of the scan files.
+        worker_counts (list): The worker counts to compare.
+    Returns:
+        dict: Files/sec by worker count.
+    """
+    files_per_second = {}
+    for workers in worker_counts:
+        start_time = time.perf_counter()
+        read_files(file_paths, workers)
+        seconds = time.perf_counter() - start_time
+        files_per_second[workers] = len(file_paths) / seconds
+        print(f"{workers} worker(s): {seconds:.2f} s, {files_per_second[workers]:.1f} files/sec")
+    return files_per_second